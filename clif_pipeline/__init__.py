@@ -0,0 +1,12 @@
+"""Shared CLIF helpers used by the marimo notebooks in this repo."""
+from .interval_join import ADTIndex, merge_respiratory_adt
+from .loader import load_clif_table, load_config, scan_clif_table, table_path
+
+__all__ = [
+    'ADTIndex',
+    'load_clif_table',
+    'load_config',
+    'merge_respiratory_adt',
+    'scan_clif_table',
+    'table_path',
+]
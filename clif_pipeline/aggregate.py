@@ -0,0 +1,71 @@
+"""Dominant-mode aggregations over the respiratory/ADT merged data."""
+import pandas as pd
+
+from .instrument import step
+from .kernels import daily_dominant_mode, ffill_sorted, is_sorted_by
+
+TARGET_MODES = [
+    'Assist Control-Volume Control',
+    'Pressure Support/CPAP',
+    'Pressure-Regulated Volume Control'
+]
+
+
+def prepare_merged(df_merged: pd.DataFrame, target_modes=TARGET_MODES) -> pd.DataFrame:
+    """Forward fill mode_category per hospitalization and keep the target modes.
+
+    The sort by (hospitalization_id, recorded_dttm) is skipped when the rows
+    are already in that order, as ``merge_respiratory_adt`` returns them.
+    Adds ``date`` (recorded day) and ``year`` columns.
+    """
+    if is_sorted_by(df_merged, ['hospitalization_id', 'recorded_dttm']):
+        df = df_merged.copy(deep=False)
+    else:
+        with step('sort', rows_in=len(df_merged)):
+            df = df_merged.sort_values(['hospitalization_id', 'recorded_dttm'])
+    with step('ffill', rows_in=len(df)):
+        df['mode_category'] = ffill_sorted(df, ['mode_category'])['mode_category']
+    with step('filter', rows_in=len(df)) as info:
+        df = df[df['mode_category'].isin(target_modes)].copy()
+        info['rows_out'] = len(df)
+    df['date'] = df['recorded_dttm'].dt.normalize()
+    df['year'] = df['recorded_dttm'].dt.year
+    return df
+
+
+def location_yearly_modes(df_three_modes: pd.DataFrame) -> pd.DataFrame:
+    """Hospitalization-days per (location, year, dominant mode) with yearly percentages.
+
+    The dominant mode is the mode with the most records for a hospitalization
+    on a day within a location; ties go to the first mode alphabetically.
+    """
+    with step('dominant_mode', rows_in=len(df_three_modes)) as info:
+        hosp_daily_dominant = daily_dominant_mode(df_three_modes, keys=['location_name', 'hospitalization_id'])
+        info['rows_out'] = len(hosp_daily_dominant)
+    hosp_daily_dominant['year'] = hosp_daily_dominant['date'].dt.year
+
+    with step('groupby', rows_in=len(hosp_daily_dominant)) as info:
+        yearly_modes = (
+            hosp_daily_dominant.groupby(['location_name', 'year', 'mode_category'], observed=True)
+            .size().reset_index(name='hosp_days')
+        )
+        info['rows_out'] = len(yearly_modes)
+    return add_percentages(yearly_modes)
+
+
+def add_percentages(yearly_modes: pd.DataFrame, value='hosp_days') -> pd.DataFrame:
+    """Add per-(location, year) ``total`` and ``percentage`` columns of ``value`` (hosp_days counts or hours)."""
+    yearly_modes = yearly_modes.copy()
+    group_cols = [c for c in ['location_name', 'year'] if c in yearly_modes.columns]
+    yearly_modes['total'] = yearly_modes.groupby(group_cols, observed=True)[value].transform('sum')
+    yearly_modes['percentage'] = (yearly_modes[value] / yearly_modes['total'] * 100).round(1)
+    return yearly_modes
+
+
+def location_record_stats(df_three_modes: pd.DataFrame) -> pd.DataFrame:
+    """Records and unique hospitalizations per location."""
+    return (
+        df_three_modes.groupby('location_name', observed=True)
+        .agg(records=('hospitalization_id', 'size'), hospitalizations=('hospitalization_id', 'nunique'))
+        .reset_index()
+    )
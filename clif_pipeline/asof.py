@@ -0,0 +1,105 @@
+"""Grouped as-of join of continuous medication doses onto timestamped records.
+
+For every record (e.g. a respiratory charting time) and every
+``med_category``, the most recent dose of that category given to the same
+hospitalization at or before the record is attached, provided it is no older
+than ``tolerance_hours``. Records and doses are sorted together once by
+(hospitalization, time, doses before records) and the latest dose of each
+category is propagated with a running maximum of positions, so there is no
+per-hospitalization merge::
+
+    df_vaso = load_clif_table(config, 'medication_admin_continuous',
+                              columns=DOSE_COLS, filters={'med_group': 'vasoactives'})
+    df_aligned = asof_doses(df_merged, df_vaso, tolerance_hours=6)
+
+Tables sharded by ``hosp_code`` (see ``sharding``) hold disjoint
+hospitalizations, so each shard can be aligned independently.
+"""
+import numpy as np
+import pandas as pd
+
+from .hosp_ids import HOSP_CODE
+from .instrument import step
+from .interval_join import to_ns
+from .kernels import factorize_codes
+from .transitions import NS_PER_HOUR
+
+DOSE_COLS = ['hospitalization_id', 'admin_dttm', 'med_category', 'med_dose']
+DEFAULT_TOLERANCE_HOURS = 6.0
+
+_NAT = np.iinfo(np.int64).min
+
+
+def _hosp_keys(records: pd.DataFrame, doses: pd.DataFrame, by: str):
+    """Shared integer hospitalization keys of both frames (-1 for missing)."""
+    if HOSP_CODE in records.columns and HOSP_CODE in doses.columns:
+        return records[HOSP_CODE].to_numpy(dtype=np.int64), doses[HOSP_CODE].to_numpy(dtype=np.int64)
+    record_codes, record_ids = factorize_codes(records[by])
+    dose_codes, dose_ids = factorize_codes(doses[by])
+    # Map dose ids onto the record ids once per distinct id
+    lookup = np.append(pd.Index(record_ids).get_indexer(dose_ids), -1)
+    return record_codes.astype(np.int64), lookup[dose_codes]
+
+
+def asof_doses(records: pd.DataFrame, doses: pd.DataFrame, categories=None, time_col='recorded_dttm',
+               dose_time_col='admin_dttm', by='hospitalization_id', category_col='med_category',
+               dose_col='med_dose', tolerance_hours=DEFAULT_TOLERANCE_HOURS) -> pd.DataFrame:
+    """``records`` with one column per medication category holding the dose running at each record.
+
+    A record gets the latest non-missing ``dose_col`` of the category with
+    ``dose_time_col <= time_col`` in the same hospitalization (the last one in
+    ``doses`` order when several share that time), or NaN when there is none
+    within ``tolerance_hours`` (None for no limit). A dose of 0 is kept: the
+    infusion was stopped. Records keep their order and index.
+    ``categories`` defaults to the categories present in ``doses``; pass them
+    explicitly when several parts of a table must get the same columns.
+    """
+    category_codes, category_values = factorize_codes(doses[category_col])
+    if categories is None:
+        categories = list(category_values[np.unique(category_codes[category_codes >= 0])])
+    else:
+        categories = list(categories)
+    record_hosp, dose_hosp = _hosp_keys(records, doses, by)
+    record_t = to_ns(records[time_col])
+    dose_t = to_ns(doses[dose_time_col])
+    dose_values = pd.to_numeric(doses[dose_col]).to_numpy(dtype=np.float64, na_value=np.nan)
+
+    record_rows = np.flatnonzero((record_hosp >= 0) & (record_t != _NAT))
+    dose_rows = np.flatnonzero(
+        (dose_hosp >= 0) & (dose_t != _NAT) & (category_codes >= 0) & ~np.isnan(dose_values)
+    )
+    n_doses = len(dose_rows)
+
+    with step('sort', rows_in=len(record_rows) + n_doses):
+        hosp = np.concatenate([dose_hosp[dose_rows], record_hosp[record_rows]])
+        t = np.concatenate([dose_t[dose_rows], record_t[record_rows]])
+        is_record = np.concatenate([np.zeros(n_doses, dtype=np.int8), np.ones(len(record_rows), dtype=np.int8)])
+        # Doses before records at the same time, each in its original order
+        sweep = np.lexsort((is_record, t, hosp))
+        hosp, t = hosp[sweep], t[sweep]
+        at_record = sweep >= n_doses
+        record_of = record_rows[sweep[at_record] - n_doses]
+
+    aligned = records.copy(deep=False)
+    category_positions = pd.Index(category_values).get_indexer(categories)
+    with step('asof', rows_in=len(record_rows)) as info:
+        positions = np.arange(len(sweep))
+        sweep_category = np.full(len(sweep), -1, dtype=np.int64)
+        sweep_category[~at_record] = category_codes[dose_rows][sweep[~at_record]]
+        matched = 0
+        for category, code in zip(categories, category_positions):
+            # Position of the latest dose of this category so far
+            last = np.where(sweep_category == code, positions, -1) if code >= 0 else np.full(len(sweep), -1)
+            np.maximum.accumulate(last, out=last)
+            last = last[at_record]
+            found = last >= 0
+            found[found] = hosp[last[found]] == hosp[at_record][found]
+            if tolerance_hours is not None:
+                age = t[at_record] - t[np.maximum(last, 0)]
+                found &= age <= int(tolerance_hours * NS_PER_HOUR)
+            dose = np.full(len(records), np.nan)
+            dose[record_of[found]] = dose_values[dose_rows][sweep[last[found]]]
+            aligned[category] = dose
+            matched += int(found.sum())
+        info['rows_out'] = matched
+    return aligned
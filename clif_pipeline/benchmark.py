@@ -0,0 +1,279 @@
+"""Scaling benchmark of the pipeline stages against the original notebook logic.
+
+For each scale factor a synthetic extract is generated (see ``synthetic``)
+and every stage is run twice: once with the logic the notebooks originally
+used (plain pandas merges, groupbys and per-category loops) and once with the
+``clif_pipeline`` implementation. Each run is timed (wall and CPU), its peak
+Python-heap allocation is measured with ``tracemalloc`` in a separate pass,
+and the two outputs are checked for equivalence.
+
+Stages: load, adt_merge, ffill, dominant_mode, location_aggregation, ecdf.
+
+Usage::
+
+    python -m clif_pipeline.benchmark --scales 1 10 100 --out benchmark.csv
+"""
+import argparse
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .aggregate import TARGET_MODES, location_yearly_modes, prepare_merged
+from .ecdf import dose_summary
+from .interval_join import ADTIndex, merge_respiratory_adt
+from .kernels import daily_dominant_mode
+from .loader import load_clif_table, table_path
+from .synthetic import SyntheticSpec, write_synthetic
+
+STAGES = ['load', 'adt_merge', 'ffill', 'dominant_mode', 'location_aggregation', 'ecdf']
+
+RESPIRATORY_COLS = ['hospitalization_id', 'recorded_dttm', 'mode_category']
+ADT_COLS = ['hospitalization_id', 'in_dttm', 'out_dttm', 'location_name']
+MEDICATION_COLS = ['med_group', 'med_category', 'med_dose']
+
+
+# Original notebook logic
+
+def reference_load(config):
+    df_respiratory = pd.read_parquet(table_path(config, 'respiratory_support'))[RESPIRATORY_COLS].copy()
+    df_respiratory['recorded_dttm'] = pd.to_datetime(df_respiratory['recorded_dttm'])
+    df_adt = pd.read_parquet(table_path(config, 'adt'))[ADT_COLS].copy()
+    df_adt['in_dttm'] = pd.to_datetime(df_adt['in_dttm'])
+    df_adt['out_dttm'] = pd.to_datetime(df_adt['out_dttm'])
+    df_meds = pd.read_parquet(table_path(config, 'medication_admin_continuous'))[MEDICATION_COLS].copy()
+    return df_respiratory, df_adt, df_meds
+
+
+def reference_merge(df_respiratory, df_adt):
+    df_merged = pd.merge(df_respiratory, df_adt, on='hospitalization_id', how='inner')
+    df_merged = df_merged[
+        (df_merged['recorded_dttm'] >= df_merged['in_dttm']) &
+        (df_merged['recorded_dttm'] <= df_merged['out_dttm'])
+    ]
+    df_merged = df_merged.sort_values(['hospitalization_id', 'recorded_dttm'])
+    return df_merged.drop_duplicates(subset=['hospitalization_id', 'recorded_dttm', 'mode_category'], keep='first')
+
+
+def reference_ffill(df_merged, target_modes=TARGET_MODES):
+    df_merged = df_merged.copy()
+    df_merged['date'] = df_merged['recorded_dttm'].dt.date
+    df_merged = df_merged.sort_values(['hospitalization_id', 'recorded_dttm'])
+    df_merged['mode_category'] = df_merged.groupby('hospitalization_id')['mode_category'].ffill()
+    df_three_modes = df_merged[df_merged['mode_category'].isin(target_modes)].copy()
+    df_three_modes['year'] = df_three_modes['recorded_dttm'].dt.year
+    return df_three_modes
+
+
+def reference_dominant_mode(df_respiratory):
+    df_with_dates = df_respiratory.copy()
+    df_with_dates['date'] = df_with_dates['recorded_dttm'].dt.date
+    mode_time_df = df_with_dates.groupby(['hospitalization_id', 'date', 'mode_category']).size().reset_index(name='count')
+    idx_mode_time = mode_time_df.groupby(['hospitalization_id', 'date'])['count'].idxmax()
+    return mode_time_df.loc[idx_mode_time]
+
+
+def reference_location_aggregation(df_three_modes):
+    frames = []
+    for location in sorted(df_three_modes['location_name'].unique()):
+        df_location = df_three_modes[df_three_modes['location_name'] == location].copy()
+        hosp_daily_mode = df_location.groupby(['hospitalization_id', 'date', 'mode_category']).size().reset_index(name='count')
+        idx_hosp_daily = hosp_daily_mode.groupby(['hospitalization_id', 'date'])['count'].idxmax()
+        hosp_daily_dominant = hosp_daily_mode.loc[idx_hosp_daily]
+        hosp_daily_dominant['year'] = pd.to_datetime(hosp_daily_dominant['date']).dt.year
+        yearly_modes = hosp_daily_dominant.groupby(['year', 'mode_category']).size().reset_index(name='hosp_days')
+        yearly_totals = yearly_modes.groupby('year')['hosp_days'].sum()
+        yearly_modes['total'] = yearly_modes['year'].map(yearly_totals)
+        yearly_modes['percentage'] = (yearly_modes['hosp_days'] / yearly_modes['total'] * 100).round(1)
+        yearly_modes.insert(0, 'location_name', location)
+        frames.append(yearly_modes)
+    return pd.concat(frames, ignore_index=True)
+
+
+def reference_ecdf(df_meds):
+    stats, points = [], []
+    for (group, category), doses in df_meds.groupby(['med_group', 'med_category'])['med_dose']:
+        values = doses.dropna()
+        if values.empty:
+            continue
+        Q1 = values.quantile(0.25)
+        Q3 = values.quantile(0.75)
+        IQR = Q3 - Q1
+        stats.append({'med_group': group, 'med_category': category, 'count': len(values),
+                      'min': values.min(), 'max': values.max(), 'mean': values.mean(),
+                      'median': values.median(), 'p95': values.quantile(0.95)})
+        values = values[(values >= Q1 - 3 * IQR) & (values <= Q3 + 3 * IQR)].sort_values()
+        if len(values) > 500:
+            values = values.iloc[np.linspace(0, len(values) - 1, 500, dtype=int)]
+        points.append(pd.DataFrame({'med_group': group, 'med_category': category,
+                                    'med_dose': values.to_numpy(),
+                                    'ecdf': np.arange(1, len(values) + 1) / len(values)}))
+    return pd.DataFrame(stats), pd.concat(points, ignore_index=True)
+
+
+# clif_pipeline implementation
+
+def pipeline_load(config):
+    df_respiratory = load_clif_table(config, 'respiratory_support', columns=RESPIRATORY_COLS)
+    df_adt = load_clif_table(config, 'adt', columns=ADT_COLS)
+    df_meds = load_clif_table(config, 'medication_admin_continuous', columns=MEDICATION_COLS)
+    return df_respiratory, df_adt, df_meds
+
+
+def pipeline_merge(df_respiratory, df_adt):
+    return merge_respiratory_adt(df_respiratory, ADTIndex(df_adt))
+
+
+def pipeline_ecdf(df_meds):
+    return dose_summary(df_meds)
+
+
+# Equivalence checks
+
+def _normalize(df, columns):
+    """Plain object/float/int64 columns in a canonical row order, for comparison."""
+    df = df[columns].reset_index(drop=True).copy()
+    for col in columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(values):
+            values = values.astype(object)
+        if col == 'date' or pd.api.types.is_datetime64_any_dtype(values):
+            # The notebooks used datetime.date objects, the pipeline midnight timestamps
+            values = pd.to_datetime(values).astype('datetime64[ns]')
+        elif values.dtype == object:
+            values = values.where(values.notna(), None)
+        df[col] = values
+    order = np.lexsort([pd.factorize(df[col], sort=True)[0] for col in reversed(columns)])
+    return df.iloc[order].reset_index(drop=True)
+
+
+def frames_equivalent(left, right, columns) -> bool:
+    """Same multiset of rows over ``columns`` (categoricals, dates and order ignored)."""
+    if len(left) != len(right):
+        return False
+    a, b = _normalize(left, columns), _normalize(right, columns)
+    try:
+        pd.testing.assert_frame_equal(a, b, check_dtype=False, check_exact=False, rtol=1e-9)
+    except AssertionError:
+        return False
+    return True
+
+
+def _check(stage, ref, out) -> bool:
+    if stage == 'load':
+        return all(frames_equivalent(r, o, list(r.columns)) for r, o in zip(ref, out))
+    if stage == 'adt_merge':
+        return frames_equivalent(ref, out, RESPIRATORY_COLS + ADT_COLS[1:])
+    if stage == 'ffill':
+        return frames_equivalent(ref, out, RESPIRATORY_COLS + ['location_name', 'date', 'year'])
+    if stage == 'dominant_mode':
+        return frames_equivalent(ref, out, ['hospitalization_id', 'date', 'mode_category', 'count'])
+    if stage == 'location_aggregation':
+        return frames_equivalent(ref, out, ['location_name', 'year', 'mode_category', 'hosp_days', 'total', 'percentage'])
+    if stage == 'ecdf':
+        stats_columns = ['med_group', 'med_category', 'count', 'min', 'max', 'mean', 'median', 'p95']
+        return (frames_equivalent(ref[0], out[0], stats_columns)
+                and frames_equivalent(ref[1], out[1], ['med_group', 'med_category', 'med_dose', 'ecdf']))
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def _rows(result) -> int:
+    if isinstance(result, tuple):
+        return sum(len(r) for r in result)
+    return len(result)
+
+
+def measure(fn, *args, memory: bool = True):
+    """Run ``fn(*args)``; returns ``(result, wall_s, cpu_s, peak_mb)``.
+
+    The timed run is untraced; the peak Python-heap allocation (numpy and
+    pandas buffers included) comes from a second run under ``tracemalloc``.
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = fn(*args)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    peak_mb = np.nan
+    if memory:
+        tracemalloc.start()
+        try:
+            fn(*args)
+            peak_mb = tracemalloc.get_traced_memory()[1] / 1024**2
+        finally:
+            tracemalloc.stop()
+    return result, wall, cpu, peak_mb
+
+
+def _stage_calls(impl):
+    """``{stage: (fn, input names)}`` for one implementation."""
+    reference = impl == 'reference'
+    return {
+        'load': (reference_load if reference else pipeline_load, ['config']),
+        'adt_merge': (reference_merge if reference else pipeline_merge, ['respiratory', 'adt']),
+        'ffill': (reference_ffill if reference else prepare_merged, ['adt_merge']),
+        'dominant_mode': (reference_dominant_mode if reference else daily_dominant_mode, ['respiratory']),
+        'location_aggregation': (reference_location_aggregation if reference else location_yearly_modes, ['ffill']),
+        'ecdf': (reference_ecdf if reference else pipeline_ecdf, ['meds']),
+    }
+
+
+def run_pipeline(config: dict, impl: str, memory: bool = True):
+    """Run every stage with one implementation; returns ``(outputs, timings)``."""
+    outputs, timings = {'config': config}, []
+    for stage, (fn, inputs) in _stage_calls(impl).items():
+        result, wall, cpu, peak_mb = measure(fn, *[outputs[name] for name in inputs], memory=memory)
+        outputs[stage] = result
+        if stage == 'load':
+            outputs['respiratory'], outputs['adt'], outputs['meds'] = result
+        rows = _rows(result)
+        timings.append({'stage': stage, 'impl': impl, 'rows': rows, 'wall_s': wall, 'cpu_s': cpu,
+                        'rows_per_s': rows / wall if wall else np.nan, 'peak_mb': peak_mb})
+    return outputs, timings
+
+
+def run_benchmark(work_dir, scales=(1, 10, 100), spec: SyntheticSpec = None,
+                  reference: bool = True, memory: bool = True) -> pd.DataFrame:
+    """Benchmark every stage at each scale factor of ``spec``."""
+    spec = spec or SyntheticSpec()
+    results = []
+    for scale in scales:
+        scaled = spec.scaled(scale)
+        config = write_synthetic(Path(work_dir) / f"scale-{scale}x", scaled)
+        outputs, timings = run_pipeline(config, 'pipeline', memory)
+        if reference:
+            ref_outputs, ref_timings = run_pipeline(config, 'reference', memory)
+            equivalent = {stage: _check(stage, ref_outputs[stage], outputs[stage]) for stage in STAGES}
+            timings += ref_timings
+        else:
+            equivalent = {}
+        for row in timings:
+            row.update({'scale': scale, 'hospitalizations': scaled.hospitalizations,
+                        'equivalent': equivalent.get(row['stage'])})
+        results += timings
+        print(f"Scale {scale}x ({scaled.hospitalizations:,} hospitalizations) done")
+    columns = ['scale', 'hospitalizations', 'stage', 'impl', 'rows', 'wall_s', 'cpu_s', 'rows_per_s', 'peak_mb', 'equivalent']
+    return pd.DataFrame(results)[columns]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pipeline stages on synthetic CLIF data.')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--hospitalizations', type=int, default=SyntheticSpec.hospitalizations,
+                        help='hospitalizations at scale 1')
+    parser.add_argument('--work-dir', default='benchmark_data')
+    parser.add_argument('--out', default='benchmark.csv')
+    parser.add_argument('--skip-reference', action='store_true', help='only run the clif_pipeline stages')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    args = parser.parse_args()
+
+    scales = [int(s) if float(s).is_integer() else s for s in args.scales]
+    results = run_benchmark(args.work_dir, scales, SyntheticSpec(hospitalizations=args.hospitalizations),
+                            reference=not args.skip_reference, memory=not args.no_memory)
+    results.to_csv(args.out, index=False)
+    print(results.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+    print(f"\nBenchmark saved to: {args.out}")
+
+
+if __name__ == '__main__':
+    main()
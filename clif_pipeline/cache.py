@@ -0,0 +1,127 @@
+"""Content-addressed cache for expensive pipeline stage outputs.
+
+An entry is keyed on the stage name, the fingerprints (size and mtime) of its
+input files, its parameters, the source of this package and the ``uid`` of
+the global hospitalization_id dictionary (see ``hosp_ids``), and is stored as
+a Parquet file under ``cache_dir``. When the cache grows past ``max_bytes``
+the least recently used entries are removed; files in subdirectories (the id
+dictionary, runner stamps, CSV copies) are never evicted.
+
+Optional config keys: ``cache_dir`` (default ``.clif_cache``) and
+``cache_max_gb`` (default 20).
+"""
+import glob
+import hashlib
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .schema import to_pandas
+
+DEFAULT_CACHE_DIR = '.clif_cache'
+DEFAULT_MAX_GB = 20
+
+
+def fingerprint(path) -> list:
+    """Size and mtime of a file, or of every file under a directory or matching a glob pattern."""
+    path = Path(path)
+    if not path.exists():
+        if not glob.has_magic(str(path)):
+            return [str(path), None]
+        files = sorted(Path(p) for p in glob.glob(str(path), recursive=True) if Path(p).is_file())
+        return [[str(p), p.stat().st_size, p.stat().st_mtime_ns] for p in files] or [str(path), None]
+    files = sorted(p for p in path.rglob('*') if p.is_file()) if path.is_dir() else [path]
+    return [[str(p), p.stat().st_size, p.stat().st_mtime_ns] for p in files]
+
+
+@lru_cache(maxsize=None)
+def code_version() -> str:
+    """Hash of this package's source, so code changes invalidate old entries."""
+    digest = hashlib.sha256()
+    for source in sorted(Path(__file__).parent.glob('*.py')):
+        digest.update(source.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+class StageCache:
+    """Parquet-backed cache of stage outputs (DataFrames)."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_GB * 1024**3, hosp_ids=None):
+        """``hosp_ids`` returns the current ``HospitalizationIds`` (None when codes are not attached)."""
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hosp_ids = hosp_ids
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'StageCache':
+        # loader imports this module
+        from .loader import hospitalization_ids
+        return cls(
+            config.get('cache_dir', DEFAULT_CACHE_DIR),
+            int(config.get('cache_max_gb', DEFAULT_MAX_GB) * 1024**3),
+            (lambda: hospitalization_ids(config)) if config.get('hosp_codes', True) else None
+        )
+
+    def key(self, stage: str, inputs=(), params=None, version=None) -> str:
+        payload = {
+            'stage': stage,
+            'inputs': [fingerprint(p) for p in inputs],
+            'params': params or {},
+            'code': version or code_version(),
+            'hosp_ids': self.hosp_ids().uid if self.hosp_ids is not None else None,
+        }
+        text = json.dumps(payload, sort_keys=True, default=str)
+        return f"{stage}-{hashlib.sha256(text.encode()).hexdigest()[:24]}"
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.parquet"
+
+    def get(self, key: str):
+        """Cached DataFrame for ``key``, or None."""
+        path = self._path(key)
+        if not path.exists():
+            return None
+        os.utime(path)  # mark as recently used
+        return to_pandas(pq.read_table(path))
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp = path.with_suffix('.tmp')
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the cache fits in ``max_bytes``.
+
+        Only the entries directly in ``cache_dir`` are candidates.
+        """
+        entries = sorted(self.cache_dir.glob('*.parquet'), key=lambda p: p.stat().st_mtime)
+        total = sum(p.stat().st_size for p in entries)
+        for path in entries:
+            if total <= self.max_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink()
+
+    def cached(self, stage: str, compute, inputs=(), params=None, version=None) -> pd.DataFrame:
+        """Return the cached output of ``stage`` or run ``compute()`` and store it.
+
+        Example::
+
+            df = cache.cached('vasoactives', lambda: load_clif_table(...),
+                              inputs=[table_path(config, 'medication_admin_continuous')],
+                              params={'med_group': 'vasoactives'})
+        """
+        key = self.key(stage, inputs, params, version)
+        df = self.get(key)
+        if df is None:
+            df = compute()
+            self.put(key, df)
+        return df
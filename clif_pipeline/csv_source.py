@@ -0,0 +1,83 @@
+"""CSV CLIF sources, converted once to cached Parquet copies.
+
+Sites that export CLIF as CSV set ``"filetype": "csv"`` in ``config.json``.
+On first use, a table is read with pyarrow's multi-threaded block CSV reader.
+The column types come from the CLIF schema, so there is no type inference
+pass. The result is written as a zstd-compressed Parquet copy under
+``<cache_dir>/csv/``. The copy is keyed on the CSV path, size and mtime, so
+later reads scan Parquet and an edited CSV is converted again. A table stored
+as many part files gets one copy per part.
+"""
+import hashlib
+import os
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+from .cache import DEFAULT_CACHE_DIR
+from .schema import CLIF_SCHEMAS
+
+CSV_DIR = 'csv'
+BLOCK_SIZE = 16 * 1024**2
+
+
+def csv_column_types(table: str, tz=None) -> dict:
+    """CSV reader types for the CLIF columns of ``table``.
+
+    Strings are read as plain strings and dictionary-encoded when scanned.
+    """
+    types = {}
+    for field in CLIF_SCHEMAS.get(table, []):
+        if pa.types.is_dictionary(field.type):
+            types[field.name] = pa.string()
+        elif pa.types.is_timestamp(field.type):
+            types[field.name] = pa.timestamp(field.type.unit, tz=tz)
+        else:
+            types[field.name] = field.type
+    return types
+
+
+def read_clif_csv(path, table: str, block_size: int = BLOCK_SIZE) -> pa.Table:
+    """Read a CLIF CSV with the explicit schema, parsing blocks in parallel.
+
+    Timestamps with a UTC offset are read as UTC. Raises ``ValueError`` when a
+    value does not match its column type.
+    """
+    read_options = pv.ReadOptions(use_threads=True, block_size=block_size)
+    for tz in (None, 'UTC'):
+        convert_options = pv.ConvertOptions(
+            column_types=csv_column_types(table, tz),
+            strings_can_be_null=True,
+            timestamp_parsers=[pv.ISO8601],
+        )
+        try:
+            return pv.read_csv(path, read_options=read_options, convert_options=convert_options)
+        except pa.ArrowInvalid as e:
+            error = e
+    raise ValueError(f"{path}: {error}") from error
+
+
+def parquet_copy(csv_path, table: str, cache_dir=DEFAULT_CACHE_DIR) -> Path:
+    """Path of the cached Parquet copy of ``csv_path``, converting it when stale."""
+    csv_path = Path(csv_path).resolve()
+    stat = csv_path.stat()
+    # Part files of a directory often share a name, so copies are keyed on the full path
+    prefix = f"{csv_path.stem}-{hashlib.sha256(str(csv_path).encode()).hexdigest()[:8]}"
+    digest = hashlib.sha256(f"{csv_path}|{stat.st_size}|{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+    out_dir = Path(cache_dir) / CSV_DIR
+    path = out_dir / f"{prefix}-{digest}.parquet"
+    if path.exists():
+        return path
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    arrow_table = read_clif_csv(csv_path, table)
+    # Write then rename, so concurrent stages never see a partial copy
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    pq.write_table(arrow_table, tmp, compression='zstd', row_group_size=1_000_000)
+    os.replace(tmp, path)
+    for stale in out_dir.glob(f"{prefix}-*.parquet"):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+    return path
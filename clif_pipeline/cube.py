@@ -0,0 +1,123 @@
+"""Precomputed hospitalization-day cube over (year, location_name, mode_category, mode_name).
+
+Each hospitalization-day at a location is counted once, under its dominant
+mode. The dominant mode_category is the category with the most records,
+after mode_category/mode_name are forward filled as a pair within the
+hospitalization. The mode_name is the one with the most records inside that
+category. Ties go to the first value alphabetically, a missing mode_name
+last. Summing the cube over mode_name gives the dominant-category hosp-days
+exactly. The cube is a few thousand rows, so any mode set, location or year
+range is sliced from it without touching the respiratory data::
+
+    cube = build_site_cube(config)
+    yearly_modes = slice_cube(cube, modes=TARGET_MODES, locations=['MICU'], years=(2020, 2023))
+
+By default dominance is decided over all modes, and selecting a subset of
+modes keeps the hosp-days dominated by one of them.
+``aggregate.location_yearly_modes`` instead drops the other modes' records
+before deciding. A cube built with ``dominance_modes`` does the same, so
+slicing it to those modes reproduces its hosp-days::
+
+    target_cube = build_site_cube(config, dominance_modes=TARGET_MODES)
+"""
+import numpy as np
+import pandas as pd
+
+from .aggregate import add_percentages
+from .instrument import step
+from .interval_join import ADTIndex, merge_respiratory_adt_batches
+from .kernels import ffill_sorted, is_sorted_by
+from .loader import iter_clif_batches, load_clif_table
+
+CUBE_FILE = 'mode_cube.parquet'
+CUBE_DIMS = ['year', 'location_name', 'mode_category', 'mode_name']
+CUBE_RESPIRATORY_COLS = ['hospitalization_id', 'recorded_dttm', 'mode_category', 'mode_name']
+CUBE_ADT_COLS = ['hospitalization_id', 'in_dttm', 'out_dttm', 'location_name']
+
+
+def build_mode_cube(df_merged: pd.DataFrame, dominance_modes=None) -> pd.DataFrame:
+    """Hosp-days per ``CUBE_DIMS`` from merged respiratory/ADT rows with mode_name.
+
+    ``df_merged`` is ``merge_respiratory_adt`` output of the
+    ``CUBE_RESPIRATORY_COLS`` columns (sorted by hospitalization and time;
+    re-sorted otherwise). With ``dominance_modes``, records of other mode
+    categories are dropped after the forward fill, so the dominant mode is
+    chosen among those categories only.
+    """
+    if not is_sorted_by(df_merged, ['hospitalization_id', 'recorded_dttm']):
+        df_merged = df_merged.sort_values(['hospitalization_id', 'recorded_dttm'])
+    category_codes, categories = pd.factorize(df_merged['mode_category'], sort=True)
+    name_codes, names = pd.factorize(df_merged['mode_name'], sort=True)
+
+    # Forward fill (category, name) as one value so filled rows keep their
+    # pair; a missing name is its own value (code 0)
+    n_names = len(names) + 1
+    pair = np.where(category_codes >= 0, category_codes * n_names + name_codes + 1, np.nan)
+    frame = pd.DataFrame({
+        'hospitalization_id': df_merged['hospitalization_id'].array,
+        'location_name': df_merged['location_name'].array,
+        'date': df_merged['recorded_dttm'].dt.normalize().to_numpy(),
+        'pair': pair,
+    })
+    with step('ffill', rows_in=len(frame)):
+        frame['pair'] = ffill_sorted(frame, ['pair'])['pair']
+    if dominance_modes is not None:
+        kept = categories.get_indexer(list(dominance_modes))
+        frame = frame[np.isin(frame['pair'].to_numpy() // n_names, kept[kept >= 0])]
+
+    with step('count', rows_in=len(frame)) as info:
+        keys = ['location_name', 'hospitalization_id', 'date']
+        counts = frame.dropna(subset=['pair']).groupby([*keys, 'pair'], observed=True).size().reset_index(name='n')
+        info['rows_out'] = len(counts)
+
+    with step('dominant_mode', rows_in=len(counts)) as info:
+        counts['category'] = (counts['pair'] // n_names).astype(np.int64)
+        counts['name'] = (counts['pair'] % n_names).astype(np.int64) - 1
+        counts['category_n'] = counts.groupby([*keys, 'category'], observed=True)['n'].transform('sum')
+        # Dominant category first, then the dominant name inside it; a
+        # missing name loses ties
+        counts['name_order'] = np.where(counts['name'] < 0, n_names, counts['name'])
+        dominant = (
+            counts.sort_values([*keys, 'category_n', 'category', 'n', 'name_order'],
+                               ascending=[True, True, True, False, True, False, True])
+            .drop_duplicates(subset=keys, keep='first')
+        )
+        info['rows_out'] = len(dominant)
+
+    dominant['year'] = pd.DatetimeIndex(dominant['date']).year.astype('int32')
+    cube = dominant.groupby(['year', 'location_name', 'category', 'name'], observed=True).size().reset_index(name='hosp_days')
+    cube['mode_category'] = pd.Categorical.from_codes(cube['category'], categories=categories)
+    cube['mode_name'] = pd.Categorical.from_codes(cube['name'], categories=names)
+    cube['location_name'] = cube['location_name'].astype('category')
+    return cube[[*CUBE_DIMS, 'hosp_days']]
+
+
+def build_site_cube(config: dict, adt_index=None, dominance_modes=None) -> pd.DataFrame:
+    """Load, merge and cube a site's respiratory data; reuses a prebuilt ``ADTIndex`` when given."""
+    batches = iter_clif_batches(config, 'respiratory_support', columns=CUBE_RESPIRATORY_COLS)
+    if adt_index is None:
+        adt_index = ADTIndex(load_clif_table(config, 'adt', columns=CUBE_ADT_COLS))
+    return build_mode_cube(merge_respiratory_adt_batches(batches, adt_index), dominance_modes)
+
+
+def slice_cube(cube: pd.DataFrame, modes=None, locations=None, years=None, level='mode_category',
+               by_location=True) -> pd.DataFrame:
+    """Hosp-days and yearly percentages for a mode set, locations and ``(first, last)`` years.
+
+    ``level`` is ``'mode_category'`` or ``'mode_name'``. Returns the columns
+    of ``aggregate.location_yearly_modes`` (without ``location_name`` when
+    ``by_location`` is False), with the mode column named after ``level``.
+    """
+    if level not in ('mode_category', 'mode_name'):
+        raise ValueError(f"Unknown level '{level}', expected 'mode_category' or 'mode_name'")
+    mask = np.ones(len(cube), dtype=bool)
+    if modes is not None:
+        mask &= cube[level].isin(list(modes)).to_numpy()
+    if locations is not None:
+        mask &= cube['location_name'].isin(list(locations)).to_numpy()
+    if years is not None:
+        first, last = years
+        mask &= cube['year'].between(first, last).to_numpy()
+    keys = [*(['location_name'] if by_location else []), 'year', level]
+    sliced = cube[mask].groupby(keys, observed=True)['hosp_days'].sum().reset_index()
+    return add_percentages(sliced[sliced['hosp_days'] > 0])
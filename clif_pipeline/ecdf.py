@@ -0,0 +1,109 @@
+"""Grouped dose summaries and ECDF curves for every (med_group, med_category).
+
+The doses are sorted once by (med_group, med_category, med_dose); every
+statistic is then read from the group offsets of that single sorted array.
+The results are two small tables that the plots read directly:
+
+* summary: rows, count, min, max, mean, median, p95, q1, q3 and IQR bounds
+* ecdf: up to ``n_points`` (med_dose, ecdf) points of the IQR-filtered doses
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .kernels import combine_codes
+
+SUMMARY_FILE = 'med_dose_summary.parquet'
+ECDF_FILE = 'med_dose_ecdf.parquet'
+
+
+def _quantile(x, starts, n, q):
+    """Linear-interpolated quantile of each sorted segment (as ``Series.quantile``)."""
+    pos = starts + (n - 1) * q
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, starts + n - 1)
+    return x[lo] + (x[hi] - x[lo]) * (pos - lo)
+
+
+def dose_summary(df: pd.DataFrame, n_points: int = 500, iqr_factor: float = 3):
+    """Summary and ECDF tables for every (med_group, med_category) in ``df``.
+
+    Matches the per-category logic of medication_ecdf.py: quantiles use
+    linear interpolation, the ECDF keeps doses within
+    ``[q1 - iqr_factor * IQR, q3 + iqr_factor * IQR]`` and is downsampled to
+    ``n_points`` evenly spaced sorted positions. Returns ``(summary, ecdf)``.
+    """
+    group_codes, groups = pd.factorize(df['med_group'], sort=True)
+    category_codes, categories = pd.factorize(df['med_category'], sort=True)
+    key = combine_codes([group_codes, category_codes], [len(groups), len(categories)])
+    rows = np.bincount(key[key >= 0])
+
+    dose = df['med_dose'].to_numpy(dtype=np.float64, na_value=np.nan)
+    keep = (key >= 0) & ~np.isnan(dose)
+    key, dose = key[keep], dose[keep]
+
+    # The one sort: by group key, then dose
+    order = np.lexsort((dose, key))
+    key, x = key[order], dose[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(key) else np.zeros(0, dtype=np.int64)
+    n = np.diff(np.r_[starts, len(x)])
+    seg_key = key[starts]
+
+    q1 = _quantile(x, starts, n, 0.25)
+    q3 = _quantile(x, starts, n, 0.75)
+    iqr = q3 - q1
+    summary = pd.DataFrame({
+        'med_group': groups.take(seg_key // max(len(categories), 1)),
+        'med_category': categories.take(seg_key % max(len(categories), 1)),
+        'rows': rows[seg_key],
+        'count': n,
+        'min': x[starts],
+        'max': x[starts + n - 1],
+        'mean': np.add.reduceat(x, starts) / n if len(x) else np.zeros(0),
+        'median': _quantile(x, starts, n, 0.5),
+        'p95': _quantile(x, starts, n, 0.95),
+        'q1': q1,
+        'q3': q3,
+        'lower_bound': q1 - iqr_factor * iqr,
+        'upper_bound': q3 + iqr_factor * iqr,
+    })
+
+    # IQR filter: inside a sorted segment the kept doses are contiguous
+    seg = np.repeat(np.arange(len(starts)), n)
+    below = x < summary['lower_bound'].to_numpy()[seg]
+    inside = ~below & (x <= summary['upper_bound'].to_numpy()[seg])
+    first = starts + (np.add.reduceat(below, starts) if len(x) else 0)
+    m = np.add.reduceat(inside, starts) if len(x) else np.zeros(0, dtype=np.int64)
+
+    # Downsample each segment like np.linspace(0, m - 1, npts, dtype=int)
+    npts = np.minimum(m, n_points)
+    point_seg = np.repeat(np.arange(len(starts)), npts)
+    i = np.arange(npts.sum()) - np.repeat(np.cumsum(npts) - npts, npts)
+    step = np.where(npts > 1, (m - 1) / np.maximum(npts - 1, 1), 0)[point_seg]
+    offset = i * step
+    last = i == npts[point_seg] - 1
+    offset[last] = (m - 1)[point_seg][last]
+    idx = first[point_seg] + offset.astype(np.int64)
+
+    ecdf = pd.DataFrame({
+        'med_group': summary['med_group'].to_numpy()[point_seg],
+        'med_category': summary['med_category'].to_numpy()[point_seg],
+        'med_dose': x[idx],
+        'ecdf': (i + 1) / npts[point_seg],
+    })
+    return summary, ecdf
+
+
+def save_dose_summary(summary: pd.DataFrame, ecdf: pd.DataFrame, folder='.') -> None:
+    """Write the summary and ECDF tables next to each other."""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    summary.to_parquet(folder / SUMMARY_FILE, index=False)
+    ecdf.to_parquet(folder / ECDF_FILE, index=False)
+
+
+def load_dose_summary(folder='.'):
+    """Read the tables written by ``save_dose_summary``."""
+    folder = Path(folder)
+    return pd.read_parquet(folder / SUMMARY_FILE), pd.read_parquet(folder / ECDF_FILE)
@@ -0,0 +1,473 @@
+"""Selectable query backends for the core CLIF transforms.
+
+``get_backend(config)`` returns the backend named by the optional config key
+``backend``: ``pandas`` (default, the in-memory functions of this package),
+``polars`` (lazy frames) or ``duckdb`` (embedded SQL). The Polars and DuckDB
+backends plan each transform as one query from the source files, with
+column/row pushdown and multi-threaded execution, and are only imported when
+selected. Every backend returns the same pandas frames (categorical strings,
+datetime columns, ``hosp_code`` on row-level frames, same column order) as
+the pandas functions:
+
+* ``load(table, columns, filters)``: filtered load (``loader.load_clif_table``)
+* ``merged()``: respiratory rows joined to their ADT interval (``merge_respiratory_adt``)
+* ``three_modes(target_modes)``: forward filled and filtered rows (``prepare_merged``)
+* ``location_yearly_modes(target_modes)``: ``aggregate.location_yearly_modes``
+* ``daily_dominant_mode(modes)``: dominant respiratory mode per hospitalization-day
+* ``dose_summary()``: ``(summary, ecdf)`` as in ``ecdf.dose_summary``
+"""
+from datetime import date, datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .aggregate import TARGET_MODES, add_percentages, location_yearly_modes, prepare_merged
+from .ecdf import dose_summary
+from .interval_join import ADTIndex, merge_respiratory_adt_batches
+from .kernels import daily_dominant_mode
+from .loader import attach_hosp_codes, iter_clif_batches, load_clif_table, source_paths
+from .schema import CATEGORY, to_pandas
+
+RESPIRATORY_COLS = ['hospitalization_id', 'recorded_dttm', 'mode_category']
+ADT_COLS = ['hospitalization_id', 'in_dttm', 'out_dttm', 'location_name']
+MERGED_COLS = RESPIRATORY_COLS + ADT_COLS[1:]
+MEDICATION_COLS = ['med_group', 'med_category', 'med_dose']
+N_POINTS = 500
+IQR_FACTOR = 3
+
+
+def arrow_to_pandas(table: pa.Table) -> pd.DataFrame:
+    """Backend result to pandas with string columns as sorted categoricals."""
+    arrays = []
+    for values in table.columns:
+        if pa.types.is_string(values.type) or pa.types.is_large_string(values.type) \
+                or pa.types.is_string_view(values.type):
+            values = pc.dictionary_encode(pc.cast(values, pa.string())).cast(CATEGORY)
+        arrays.append(values)
+    return to_pandas(pa.Table.from_arrays(arrays, names=table.column_names))
+
+
+class PandasBackend:
+    """The package's in-memory pandas/numpy implementation."""
+    name = 'pandas'
+
+    def __init__(self, config: dict):
+        self.config = config
+
+    def load(self, table: str, columns=None, filters=None) -> pd.DataFrame:
+        return load_clif_table(self.config, table, columns=columns, filters=filters)
+
+    def merged(self) -> pd.DataFrame:
+        # Respiratory batches are read ahead while the ADT index is built, then
+        # joined as they arrive
+        batches = iter_clif_batches(self.config, 'respiratory_support', RESPIRATORY_COLS)
+        df_merged = merge_respiratory_adt_batches(batches, ADTIndex(self.load('adt', ADT_COLS)))
+        return attach_hosp_codes(self.config, df_merged)
+
+    def three_modes(self, target_modes=TARGET_MODES) -> pd.DataFrame:
+        return prepare_merged(self.merged(), target_modes)
+
+    def location_yearly_modes(self, target_modes=TARGET_MODES) -> pd.DataFrame:
+        return location_yearly_modes(self.three_modes(target_modes))
+
+    def daily_dominant_mode(self, modes=None) -> pd.DataFrame:
+        filters = {'mode_category': list(modes)} if modes is not None else None
+        return daily_dominant_mode(self.load('respiratory_support', RESPIRATORY_COLS, filters))
+
+    def dose_summary(self):
+        return dose_summary(self.load('medication_admin_continuous', MEDICATION_COLS), N_POINTS, IQR_FACTOR)
+
+
+def _sql_literal(value) -> str:
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, (datetime, date, pd.Timestamp)):
+        return f"TIMESTAMP '{pd.Timestamp(value).isoformat(sep=' ')}'"
+    return repr(value)
+
+
+class DuckDBBackend:
+    """Embedded DuckDB: each transform is one SQL query over the Parquet sources."""
+    name = 'duckdb'
+
+    def __init__(self, config: dict):
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError("backend 'duckdb' needs the duckdb package: pip install duckdb") from e
+        self.config = config
+        self.con = duckdb.connect()
+        if config.get('threads'):
+            self.con.execute(f"SET threads = {int(config['threads'])}")
+
+    def _source(self, table: str, row_number: bool = False) -> str:
+        paths = [_sql_literal(str(path)) for path in source_paths(self.config, table)]
+        if not row_number:
+            return f"read_parquet([{', '.join(paths)}])"
+        # file_row_number restarts in every file; prefix it with the file's
+        # position so row_number follows the table's file and row order
+        return '(' + ' UNION ALL BY NAME '.join(
+            f"SELECT * EXCLUDE (file_row_number), ({i}::BIGINT << 40) + file_row_number AS row_number "
+            f"FROM read_parquet({path}, file_row_number = true)"
+            for i, path in enumerate(paths)
+        ) + ')'
+
+    def _where(self, filters) -> str:
+        conditions = []
+        for col, value in (filters or {}).items():
+            if isinstance(value, (list, tuple, set)):
+                conditions.append(f"{col} IN ({', '.join(_sql_literal(v) for v in value)})")
+            else:
+                conditions.append(f"{col} = {_sql_literal(value)}")
+        return f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    def _query(self, sql: str) -> pd.DataFrame:
+        result = self.con.sql(sql)
+        return arrow_to_pandas(result.to_arrow_table() if hasattr(result, 'to_arrow_table') else result.fetch_arrow_table())
+
+    def load(self, table: str, columns=None, filters=None) -> pd.DataFrame:
+        select = ', '.join(columns) if columns else '*'
+        return attach_hosp_codes(self.config, self._query(f"SELECT {select} FROM {self._source(table)} {self._where(filters)}"))
+
+    def _merged_sql(self) -> str:
+        # Sorted interval join. ADT rows are numbered (pos) by in_dttm within
+        # each hospitalization; a record can only lie in rows up to the last
+        # one starting at or before it (found with an ASOF JOIN) and from the
+        # first whose running max out_dttm reaches that row's in_dttm. The
+        # first ADT row containing a record wins; duplicate
+        # (hospitalization_id, recorded_dttm, mode_category) rows keep the first record
+        return f"""
+            WITH resp AS (
+                SELECT {', '.join(RESPIRATORY_COLS)}, row_number AS resp_row
+                FROM {self._source('respiratory_support', row_number=True)}
+            ), adt AS (
+                SELECT *,
+                       row_number() OVER w - 1 AS pos,
+                       max(out_dttm) OVER (w ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS max_out
+                FROM (
+                    SELECT {', '.join(ADT_COLS)}, row_number AS adt_row
+                    FROM {self._source('adt', row_number=True)}
+                    WHERE hospitalization_id IS NOT NULL AND in_dttm IS NOT NULL AND out_dttm IS NOT NULL
+                )
+                WINDOW w AS (PARTITION BY hospitalization_id ORDER BY in_dttm, adt_row)
+            ), last_start AS (
+                SELECT hospitalization_id, in_dttm, max(pos) AS last_pos FROM adt GROUP BY ALL
+            ), first_end AS (
+                SELECT hospitalization_id, max_out, min(pos) AS first_pos FROM adt GROUP BY ALL
+            ), spans AS (
+                SELECT a.hospitalization_id, a.pos AS last_pos, unnest(range(e.first_pos, a.pos + 1)) AS pos
+                FROM adt a
+                ASOF JOIN first_end e
+                  ON a.hospitalization_id = e.hospitalization_id AND a.in_dttm <= e.max_out
+            ), matched AS (
+                SELECT {', '.join(f'r.{col}' for col in RESPIRATORY_COLS)}, r.resp_row,
+                       a.in_dttm, a.out_dttm, a.location_name
+                FROM resp r
+                ASOF JOIN last_start s
+                  ON r.hospitalization_id = s.hospitalization_id AND r.recorded_dttm >= s.in_dttm
+                JOIN spans p ON s.hospitalization_id = p.hospitalization_id AND s.last_pos = p.last_pos
+                JOIN adt a ON p.hospitalization_id = a.hospitalization_id AND p.pos = a.pos
+                WHERE a.in_dttm <= r.recorded_dttm AND r.recorded_dttm <= a.out_dttm
+                QUALIFY row_number() OVER (PARTITION BY r.resp_row ORDER BY a.adt_row) = 1
+            )
+            SELECT * FROM matched
+            QUALIFY row_number() OVER (
+                PARTITION BY hospitalization_id, recorded_dttm, mode_category ORDER BY resp_row) = 1
+        """
+
+    def merged(self) -> pd.DataFrame:
+        return attach_hosp_codes(self.config, self._query(f"""
+            SELECT {', '.join(MERGED_COLS)} FROM ({self._merged_sql()})
+            ORDER BY hospitalization_id, recorded_dttm, resp_row
+        """))
+
+    def _three_modes_sql(self, target_modes) -> str:
+        modes = ', '.join(_sql_literal(m) for m in target_modes)
+        return f"""
+            SELECT hospitalization_id, recorded_dttm, mode_filled AS mode_category, in_dttm, out_dttm,
+                   location_name, CAST(date_trunc('day', recorded_dttm) AS TIMESTAMP) AS date,
+                   CAST(year(recorded_dttm) AS INTEGER) AS year, resp_row
+            FROM (
+                SELECT *, last_value(mode_category IGNORE NULLS) OVER (
+                    PARTITION BY hospitalization_id ORDER BY recorded_dttm, resp_row
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS mode_filled
+                FROM ({self._merged_sql()})
+            )
+            WHERE mode_filled IN ({modes})
+        """
+
+    def three_modes(self, target_modes=TARGET_MODES) -> pd.DataFrame:
+        return attach_hosp_codes(self.config, self._query(f"""
+            SELECT * EXCLUDE (resp_row) FROM ({self._three_modes_sql(target_modes)})
+            ORDER BY hospitalization_id, recorded_dttm, resp_row
+        """))
+
+    def location_yearly_modes(self, target_modes=TARGET_MODES) -> pd.DataFrame:
+        yearly_modes = self._query(f"""
+            WITH counts AS (
+                SELECT location_name, hospitalization_id, date, mode_category, count(*) AS n
+                FROM ({self._three_modes_sql(target_modes)})
+                GROUP BY ALL
+            ), dominant AS (
+                SELECT * FROM counts
+                QUALIFY row_number() OVER (
+                    PARTITION BY location_name, hospitalization_id, date ORDER BY n DESC, mode_category) = 1
+            )
+            SELECT location_name, CAST(year(date) AS INTEGER) AS year, mode_category, count(*) AS hosp_days
+            FROM dominant GROUP BY ALL
+            ORDER BY location_name, year, mode_category
+        """)
+        return add_percentages(yearly_modes)
+
+    def daily_dominant_mode(self, modes=None) -> pd.DataFrame:
+        filters = {'mode_category': list(modes)} if modes is not None else None
+        where = self._where(filters) or 'WHERE TRUE'
+        return self._query(f"""
+            WITH counts AS (
+                SELECT hospitalization_id, CAST(date_trunc('day', recorded_dttm) AS TIMESTAMP) AS date,
+                       mode_category, count(*) AS count
+                FROM {self._source('respiratory_support')}
+                {where} AND hospitalization_id IS NOT NULL AND recorded_dttm IS NOT NULL
+                    AND mode_category IS NOT NULL
+                GROUP BY ALL
+            )
+            SELECT * FROM counts
+            QUALIFY row_number() OVER (PARTITION BY hospitalization_id, date ORDER BY count DESC, mode_category) = 1
+            ORDER BY hospitalization_id, date
+        """)
+
+    def dose_summary(self):
+        base = f"""
+            WITH d AS (
+                SELECT med_group, med_category,
+                       CASE WHEN isnan(med_dose) THEN NULL ELSE med_dose END AS med_dose
+                FROM {self._source('medication_admin_continuous')}
+                WHERE med_group IS NOT NULL AND med_category IS NOT NULL
+            ), stats AS (
+                SELECT med_group, med_category, count(*) AS rows, count(med_dose) AS count,
+                       min(med_dose) AS min, max(med_dose) AS max, avg(med_dose) AS mean,
+                       quantile_cont(med_dose, 0.5) AS median, quantile_cont(med_dose, 0.95) AS p95,
+                       quantile_cont(med_dose, 0.25) AS q1, quantile_cont(med_dose, 0.75) AS q3
+                FROM d GROUP BY ALL HAVING count(med_dose) > 0
+            ), summary AS (
+                SELECT *, q1 - {IQR_FACTOR} * (q3 - q1) AS lower_bound, q3 + {IQR_FACTOR} * (q3 - q1) AS upper_bound
+                FROM stats
+            )
+        """
+        summary = self._query(base + "SELECT * FROM summary ORDER BY med_group, med_category")
+        # Downsampled ECDF: point i is the dose at sorted position
+        # int(i * ((m - 1) / (npts - 1))) of the m doses inside the IQR bounds
+        ecdf = self._query(base + f"""
+            , kept AS (
+                SELECT d.med_group, d.med_category, d.med_dose,
+                       row_number() OVER (PARTITION BY d.med_group, d.med_category ORDER BY d.med_dose) - 1 AS pos
+                FROM d JOIN summary s USING (med_group, med_category)
+                WHERE d.med_dose >= s.lower_bound AND d.med_dose <= s.upper_bound
+            ), sizes AS (
+                SELECT med_group, med_category, count(*) AS m, least(count(*), {N_POINTS}) AS npts
+                FROM kept GROUP BY ALL
+            ), points AS (
+                SELECT med_group, med_category, m, npts, unnest(range(npts)) AS i FROM sizes
+            ), positions AS (
+                SELECT *, CASE WHEN i = npts - 1 THEN m - 1
+                               ELSE CAST(floor(i * ((m - 1) / (npts - 1))) AS BIGINT) END AS pos
+                FROM points
+            )
+            SELECT p.med_group, p.med_category, k.med_dose, (p.i + 1) / p.npts AS ecdf
+            FROM positions p JOIN kept k USING (med_group, med_category, pos)
+            ORDER BY p.med_group, p.med_category, p.i
+        """)
+        return summary, ecdf
+
+
+class PolarsBackend:
+    """Polars lazy frames: each transform is one optimized lazy query."""
+    name = 'polars'
+
+    def __init__(self, config: dict):
+        try:
+            import polars as pl
+        except ImportError as e:
+            raise ImportError("backend 'polars' needs the polars package: pip install polars") from e
+        self.pl = pl
+        self.config = config
+
+    def _scan(self, table: str, columns=None, filters=None, row_index=None):
+        pl = self.pl
+        lf = pl.scan_parquet([str(path) for path in source_paths(self.config, table)])
+        if row_index:
+            lf = lf.with_row_index(row_index)
+        for col, value in (filters or {}).items():
+            values = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            lf = lf.filter(pl.col(col).is_in(values))
+        if columns:
+            lf = lf.select([*columns, *([row_index] if row_index else [])])
+        return lf
+
+    def _collect(self, lf) -> pd.DataFrame:
+        return arrow_to_pandas(lf.collect().to_arrow())
+
+    def load(self, table: str, columns=None, filters=None) -> pd.DataFrame:
+        return attach_hosp_codes(self.config, self._collect(self._scan(table, columns, filters)))
+
+    def _merged(self):
+        pl = self.pl
+        resp = self._scan('respiratory_support', RESPIRATORY_COLS, row_index='resp_row')
+        adt = (
+            self._scan('adt', ADT_COLS, row_index='adt_row')
+            .drop_nulls(['hospitalization_id', 'in_dttm', 'out_dttm'])
+            .sort(['hospitalization_id', 'in_dttm', 'adt_row'])
+            .with_columns(
+                pl.int_range(pl.len()).over('hospitalization_id').alias('pos'),
+                pl.col('out_dttm').cum_max().over('hospitalization_id').alias('max_out'),
+            )
+        )
+        # Sorted interval join: a record can only lie in rows up to the last
+        # one starting at or before it and from the first whose running max
+        # out_dttm reaches that row's in_dttm
+        last_start = adt.group_by(['hospitalization_id', 'in_dttm']).agg(pl.col('pos').max().alias('last_pos'))
+        first_end = adt.group_by(['hospitalization_id', 'max_out']).agg(pl.col('pos').min().alias('first_pos'))
+        spans = (
+            adt.select(['hospitalization_id', 'in_dttm', pl.col('pos').alias('last_pos')]).sort('in_dttm')
+            .join_asof(first_end.sort('max_out'), left_on='in_dttm', right_on='max_out',
+                       by='hospitalization_id', strategy='forward', check_sortedness=False)
+            .drop_nulls('first_pos')
+            .select(['hospitalization_id', 'last_pos', pl.int_ranges('first_pos', pl.col('last_pos') + 1).alias('pos')])
+            .explode('pos')
+        )
+        candidates = (
+            resp.drop_nulls(['hospitalization_id', 'recorded_dttm']).sort('recorded_dttm')
+            .join_asof(last_start.sort('in_dttm'), left_on='recorded_dttm', right_on='in_dttm',
+                       by='hospitalization_id', strategy='backward', check_sortedness=False)
+            .drop_nulls('last_pos')
+            .select([*RESPIRATORY_COLS, 'resp_row', 'last_pos'])
+            .join(spans, on=['hospitalization_id', 'last_pos'], how='inner')
+        )
+        return (
+            candidates.join(adt.select(['hospitalization_id', 'pos', 'adt_row', *ADT_COLS[1:]]),
+                            on=['hospitalization_id', 'pos'], how='inner')
+            .filter((pl.col('in_dttm') <= pl.col('recorded_dttm')) & (pl.col('recorded_dttm') <= pl.col('out_dttm')))
+            # The first ADT row containing a record wins
+            .sort(['resp_row', 'adt_row'])
+            .unique(subset=['resp_row'], keep='first', maintain_order=True)
+            .sort(['hospitalization_id', 'recorded_dttm', 'resp_row'])
+            .unique(subset=RESPIRATORY_COLS, keep='first', maintain_order=True)
+            .select([*MERGED_COLS, 'resp_row'])
+        )
+
+    def merged(self) -> pd.DataFrame:
+        return attach_hosp_codes(self.config, self._collect(self._merged().select(MERGED_COLS)))
+
+    def _three_modes(self, target_modes):
+        pl = self.pl
+        return (
+            self._merged()
+            .with_columns(pl.col('mode_category').forward_fill().over('hospitalization_id'))
+            .filter(pl.col('mode_category').is_in(list(target_modes)))
+            .with_columns(
+                pl.col('recorded_dttm').dt.truncate('1d').alias('date'),
+                pl.col('recorded_dttm').dt.year().cast(pl.Int32).alias('year'),
+            )
+            .select([*MERGED_COLS, 'date', 'year'])
+        )
+
+    def three_modes(self, target_modes=TARGET_MODES) -> pd.DataFrame:
+        return attach_hosp_codes(self.config, self._collect(self._three_modes(target_modes)))
+
+    def _dominant(self, lf, keys, count_name):
+        pl = self.pl
+        return (
+            lf.group_by([*keys, 'date', 'mode_category']).agg(pl.len().alias(count_name))
+            .sort([*keys, 'date', count_name, 'mode_category'], descending=[*[False] * (len(keys) + 1), True, False])
+            .unique(subset=[*keys, 'date'], keep='first', maintain_order=True)
+        )
+
+    def location_yearly_modes(self, target_modes=TARGET_MODES) -> pd.DataFrame:
+        pl = self.pl
+        dominant = self._dominant(self._three_modes(target_modes), ['location_name', 'hospitalization_id'], 'n')
+        yearly_modes = (
+            dominant.group_by([pl.col('location_name'), pl.col('date').dt.year().cast(pl.Int32).alias('year'),
+                               pl.col('mode_category')])
+            .agg(pl.len().cast(pl.Int64).alias('hosp_days'))
+            .sort(['location_name', 'year', 'mode_category'])
+        )
+        return add_percentages(self._collect(yearly_modes))
+
+    def daily_dominant_mode(self, modes=None) -> pd.DataFrame:
+        pl = self.pl
+        filters = {'mode_category': list(modes)} if modes is not None else None
+        lf = (
+            self._scan('respiratory_support', RESPIRATORY_COLS, filters)
+            .drop_nulls(RESPIRATORY_COLS)
+            .with_columns(pl.col('recorded_dttm').dt.truncate('1d').alias('date'))
+        )
+        dominant = self._dominant(lf, ['hospitalization_id'], 'count')
+        return self._collect(dominant.select(['hospitalization_id', 'date', 'mode_category', pl.col('count').cast(pl.Int64)]))
+
+    def dose_summary(self):
+        pl = self.pl
+        keys = ['med_group', 'med_category']
+        doses = (
+            self._scan('medication_admin_continuous', MEDICATION_COLS)
+            .drop_nulls(keys)
+            .with_columns(pl.col('med_dose').fill_nan(None))
+        )
+        dose = pl.col('med_dose')
+        stats = (
+            doses.group_by(keys).agg(
+                pl.len().cast(pl.Int64).alias('rows'),
+                dose.count().cast(pl.Int64).alias('count'),
+                dose.min().alias('min'),
+                dose.max().alias('max'),
+                dose.mean().alias('mean'),
+                dose.quantile(0.5, 'linear').alias('median'),
+                dose.quantile(0.95, 'linear').alias('p95'),
+                dose.quantile(0.25, 'linear').alias('q1'),
+                dose.quantile(0.75, 'linear').alias('q3'),
+            )
+            .filter(pl.col('count') > 0)
+            .with_columns(
+                (pl.col('q1') - IQR_FACTOR * (pl.col('q3') - pl.col('q1'))).alias('lower_bound'),
+                (pl.col('q3') + IQR_FACTOR * (pl.col('q3') - pl.col('q1'))).alias('upper_bound'),
+            )
+            .sort(keys)
+        )
+        kept = (
+            doses.join(stats.select([*keys, 'lower_bound', 'upper_bound']), on=keys)
+            .filter((dose >= pl.col('lower_bound')) & (dose <= pl.col('upper_bound')))
+            .sort([*keys, 'med_dose'])
+            .with_columns(pl.int_range(pl.len()).over(keys).alias('pos'))
+        )
+        # Downsampled ECDF: point i is the dose at sorted position
+        # int(i * ((m - 1) / (npts - 1))) of the m doses inside the IQR bounds
+        m, npts, i = pl.col('m'), pl.col('npts'), pl.col('i')
+        positions = (
+            kept.group_by(keys).agg(pl.len().alias('m'))
+            .with_columns(pl.min_horizontal(m, pl.lit(N_POINTS)).alias('npts'))
+            .with_columns(pl.int_ranges(0, npts).alias('i'))
+            .explode('i')
+            .with_columns(
+                pl.when(i == npts - 1).then(m - 1)
+                .otherwise((i * ((m - 1) / (npts - 1))).floor())
+                .cast(pl.Int64).alias('pos')
+            )
+        )
+        ecdf = (
+            positions.join(kept.with_columns(pl.col('pos').cast(pl.Int64)), on=[*keys, 'pos'])
+            .sort([*keys, 'i'])
+            .select([*keys, 'med_dose', ((i + 1) / npts).alias('ecdf')])
+        )
+        summary, ecdf = pl.collect_all([stats, ecdf])
+        return arrow_to_pandas(summary.to_arrow()), arrow_to_pandas(ecdf.to_arrow())
+
+
+BACKENDS = {'pandas': PandasBackend, 'polars': PolarsBackend, 'duckdb': DuckDBBackend}
+
+
+def get_backend(config: dict):
+    """Backend named by ``config['backend']`` (default ``pandas``)."""
+    name = config.get('backend', 'pandas')
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](config)
@@ -0,0 +1,200 @@
+"""Time-weighted ventilation exposure: hours per mode, location and day.
+
+Record counts favour units that chart more often. Here every respiratory
+record starts a segment in its (forward filled) mode that lasts until the
+hospitalization's next record, capped at the record's ADT ``out_dttm`` and at
+``max_gap_hours`` after the record. When the next record lies in another ADT
+interval (a transfer), the mode also carries from that interval's
+``in_dttm`` up to the next record, within the same gap limit, so each side of
+the transfer is counted at its own location. Segments are then split at
+midnight and their hours summed. Every step works on the sorted arrays, so
+there is no per-hospitalization loop::
+
+    segments = exposure_segments(df_merged, mode_col='mode_category')
+    daily_hours = daily_exposure(segments)       # location_name, date, mode_category, hours
+    yearly_hours = location_yearly_exposure(daily_hours, modes=TARGET_MODES)
+
+Segments of a hospitalization never overlap, so its exposure never exceeds
+the wall-clock time it covers (``overlapping_segments`` checks this).
+
+``df_merged`` is ``merge_respiratory_adt`` output (or the merged dataset):
+records with ``in_dttm``, ``out_dttm`` and ``location_name`` of their ADT
+interval. Days are wall-clock days of the timestamps.
+"""
+import numpy as np
+import pandas as pd
+
+from .aggregate import add_percentages
+from .instrument import step
+from .interval_join import to_ns
+from .kernels import NS_PER_DAY, combine_codes, decode_codes, dense_ids, factorize_codes, is_sorted_by
+from .transitions import NS_PER_HOUR
+
+DEFAULT_MAX_GAP_HOURS = 4.0
+
+_NAT = np.iinfo(np.int64).min
+
+
+def _wall_ns(values) -> np.ndarray:
+    """int64 nanoseconds of the wall-clock time (timezone dropped, not converted)."""
+    times = pd.Series(values, copy=False)
+    if getattr(times.dt, 'tz', None) is not None:
+        times = times.dt.tz_localize(None)
+    return to_ns(times)
+
+
+def exposure_segments(df: pd.DataFrame, mode_col='mode_category', time_col='recorded_dttm',
+                      by='hospitalization_id', location_col='location_name',
+                      max_gap_hours: float = DEFAULT_MAX_GAP_HOURS) -> pd.DataFrame:
+    """Time segments spent in each mode, one or two per record.
+
+    ``mode_col`` is forward filled within each ``by`` group first; records
+    before the first mode, and records with a missing id, location, time or
+    ADT bound, start no segment. Returns ``by``, ``location_col``,
+    ``mode_col``, ``start_dttm``, ``end_dttm`` and ``hours`` for the
+    non-empty segments, in (``by``, time) order. The rows are only sorted when
+    they are not already in (``by``, ``time_col``) order; records at the same
+    time keep their order, so the last one's mode covers the time after it.
+    """
+    hosp_codes, hosp_values = factorize_codes(df[by])
+    mode_codes, mode_values = factorize_codes(df[mode_col])
+    location_codes, location_values = factorize_codes(df[location_col])
+    t = _wall_ns(df[time_col])
+    t_in = _wall_ns(df['in_dttm'])
+    t_out = _wall_ns(df['out_dttm'])
+    keep = (hosp_codes >= 0) & (location_codes >= 0) & (t != _NAT) & (t_in != _NAT) & (t_out != _NAT)
+
+    with step('sort', rows_in=len(df)):
+        if is_sorted_by(df, [by, time_col]):
+            rows = np.flatnonzero(keep)
+        else:
+            order = np.lexsort((t, hosp_codes))
+            rows = order[keep[order]]
+    h, m, loc = hosp_codes[rows], mode_codes[rows], location_codes[rows]
+    t, t_in, t_out = t[rows], t_in[rows], t_out[rows]
+
+    with step('segments', rows_in=len(rows)) as info:
+        n = len(rows)
+        starts = np.ones(n, dtype=bool)
+        starts[1:] = h[1:] != h[:-1]
+        # Forward fill the mode by propagating the index of the last row with one
+        source = np.where((m >= 0) | starts, np.arange(n), 0)
+        np.maximum.accumulate(source, out=source)
+        m = m[source]
+
+        has_next = np.zeros(n, dtype=bool)
+        has_next[:-1] = ~starts[1:]
+        t_next = np.r_[t[1:], 0] if n else t
+        gap_end = t + int(max_gap_hours * NS_PER_HOUR)
+        end = np.minimum(np.minimum(t_out, gap_end), np.where(has_next, t_next, t_out))
+
+        # The next record is in another ADT interval: carry the mode from that
+        # interval's start up to the record
+        moved = np.zeros(n, dtype=bool)
+        moved[:-1] = (t_in[1:] != t_in[:-1]) | (t_out[1:] != t_out[:-1]) | (loc[1:] != loc[:-1])
+        carry = np.flatnonzero(has_next & moved)
+        carry_start = np.maximum(t_in[carry + 1], t[carry])
+        carry_end = np.minimum(t[carry + 1], gap_end[carry])
+        # With overlapping intervals the record's own segment stops where the
+        # carried one starts, so no time is counted twice
+        end[carry] = np.minimum(end[carry], carry_start)
+
+        # Carried segments follow the segment of the record they come from
+        position = np.r_[2 * np.arange(n), 2 * carry + 1]
+        seg_order = np.argsort(position, kind='stable')
+        seg_hosp = np.r_[h, h[carry]][seg_order]
+        seg_location = np.r_[loc, loc[carry + 1]][seg_order]
+        seg_mode = np.r_[m, m[carry]][seg_order]
+        seg_start = np.r_[t, carry_start][seg_order]
+        seg_end = np.r_[end, carry_end][seg_order]
+        nonempty = (seg_mode >= 0) & (seg_end > seg_start)
+        info['rows_out'] = int(nonempty.sum())
+
+    seg_start, seg_end = seg_start[nonempty], seg_end[nonempty]
+    return pd.DataFrame({
+        by: decode_codes(seg_hosp[nonempty], hosp_values, df[by]),
+        location_col: decode_codes(seg_location[nonempty], location_values, df[location_col]),
+        mode_col: decode_codes(seg_mode[nonempty], mode_values, df[mode_col]),
+        'start_dttm': seg_start.astype('datetime64[ns]'),
+        'end_dttm': seg_end.astype('datetime64[ns]'),
+        'hours': (seg_end - seg_start) / NS_PER_HOUR,
+    })
+
+
+def overlapping_segments(segments: pd.DataFrame, by='hospitalization_id') -> np.ndarray:
+    """Mask of segments that start before an earlier segment of the same ``by`` ends.
+
+    Empty for ``exposure_segments`` output; any hit means some hours are
+    counted twice.
+    """
+    hosp_codes, _ = factorize_codes(segments[by])
+    start = to_ns(segments['start_dttm'])
+    end = to_ns(segments['end_dttm'])
+    order = np.lexsort((start, hosp_codes))
+    # In start order, any overlap shows up between neighbouring segments
+    overlap = np.zeros(len(order), dtype=bool)
+    h, s, e = hosp_codes[order], start[order], end[order]
+    overlap[1:] = (h[1:] == h[:-1]) & (s[1:] < e[:-1])
+    mask = np.zeros(len(order), dtype=bool)
+    mask[order] = overlap
+    return mask
+
+
+def daily_exposure(segments: pd.DataFrame, by=('location_name',), mode_col='mode_category') -> pd.DataFrame:
+    """Hours per ``by``, calendar day and ``mode_col``, with segments split at midnight.
+
+    Returns ``[*by, 'date', mode_col, 'hours']`` sorted by the keys, with
+    ``date`` as a midnight timestamp. Pass ``by=('location_name',
+    'hospitalization_id')`` for per-hospitalization hours.
+    """
+    keys = [*by, mode_col]
+    start = to_ns(segments['start_dttm'])
+    end = to_ns(segments['end_dttm'])
+
+    with step('split_days', rows_in=len(segments)) as info:
+        first_day = np.floor_divide(start, NS_PER_DAY)
+        days = np.floor_divide(end - 1, NS_PER_DAY) - first_day + 1
+        seg = np.repeat(np.arange(len(segments)), days)
+        offset = np.arange(len(seg)) - np.repeat(np.cumsum(days) - days, days)
+        day = first_day[seg] + offset
+        piece_ns = np.minimum(end[seg], (day + 1) * NS_PER_DAY) - np.maximum(start[seg], day * NS_PER_DAY)
+        info['rows_out'] = len(seg)
+
+    with step('sum_hours', rows_in=len(seg)) as info:
+        codes, sizes = [], []
+        for key in keys:
+            key_codes, key_values = factorize_codes(segments[key])
+            codes.append(key_codes[seg])
+            sizes.append(len(key_values))
+        first_seen = int(day.min()) if len(day) else 0
+        codes.insert(len(by), day - first_seen)
+        sizes.insert(len(by), int(day.max()) - first_seen + 1 if len(day) else 1)
+        group_codes = combine_codes(codes, sizes)
+        pieces = np.flatnonzero(group_codes >= 0)
+        group_ids, first = dense_ids(group_codes[pieces])
+        hours = np.bincount(group_ids, weights=piece_ns[pieces], minlength=len(first)) / NS_PER_HOUR
+        info['rows_out'] = len(first)
+
+    # One representative piece per group recovers the key values
+    first_piece = pieces[first]
+    result = segments[list(by)].iloc[seg[first_piece]].reset_index(drop=True)
+    result['date'] = pd.to_datetime((day[first_piece] * NS_PER_DAY).astype('datetime64[ns]'))
+    result[mode_col] = segments[mode_col].iloc[seg[first_piece]].to_numpy()
+    result['hours'] = hours
+    return result
+
+
+def location_yearly_exposure(daily_hours: pd.DataFrame, modes=None, mode_col='mode_category') -> pd.DataFrame:
+    """Hours per (location, year, mode) with each mode's share of the year's hours.
+
+    Only ``modes`` are kept (all when None), so percentages are over the
+    selected modes, like ``aggregate.location_yearly_modes``.
+    """
+    if modes is not None:
+        daily_hours = daily_hours[daily_hours[mode_col].isin(list(modes))]
+    yearly_hours = (
+        daily_hours.assign(year=daily_hours['date'].dt.year)
+        .groupby(['location_name', 'year', mode_col], observed=True)['hours'].sum()
+        .reset_index()
+    )
+    return add_percentages(yearly_hours, value='hours')
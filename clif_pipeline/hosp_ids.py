@@ -0,0 +1,140 @@
+"""Global dictionary of hospitalization_id values shared by every CLIF table.
+
+Each hospitalization_id of the extract gets a dense int32 code (its position
+in the dictionary). Loaders attach it as ``hosp_code`` next to
+``hospitalization_id``, so joins, overlap checks and shard assignment work on
+integer arrays instead of hashing the id strings again for every table.
+
+The dictionary is persisted as ``<cache_dir>/hosp_ids/hospitalization_ids.parquet``
+(outside the files ``StageCache`` evicts) together with the fingerprints of
+the tables it was built from. When a table changes, only its ids are re-read
+and any new ones are appended (sorted among themselves), so a code is never
+reassigned while the file is kept. Code order therefore follows string order
+only within one append; sort by ``hospitalization_id``, not ``hosp_code``.
+Each dictionary has a ``uid`` that appends keep and a rebuild replaces;
+``StageCache`` keys include it, so cached frames holding ``hosp_code`` never
+outlive the dictionary that assigned their codes.
+
+Usage::
+
+    ids = hospitalization_ids(config)      # loader.hospitalization_ids
+    df['hosp_code'] = ids.encode(df['hospitalization_id'])
+    both = ids.mask(resp_codes) & ids.mask(adt_codes)
+"""
+import json
+import os
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from .cache import fingerprint
+
+HOSP_ID_DIR = 'hosp_ids'
+HOSP_ID_FILE = 'hospitalization_ids.parquet'
+HOSP_CODE = 'hosp_code'
+_METADATA_KEY = b'clif_pipeline.hosp_id_sources'
+_UID_KEY = b'clif_pipeline.hosp_id_uid'
+
+# Dictionaries already read by this process, keyed on their file
+_LOADED = {}
+
+
+class HospitalizationIds:
+    """hospitalization_id <-> dense int32 code; ``ids[code]`` is the id of a code."""
+
+    def __init__(self, ids, sources=None, uid=None):
+        self.ids = pd.Index(ids, dtype=object)
+        if not self.ids.is_unique:
+            raise ValueError("hospitalization_id dictionary has duplicate ids")
+        if len(self.ids) > np.iinfo(np.int32).max:
+            raise ValueError(f"{len(self.ids):,} hospitalization ids do not fit int32 codes")
+        self.sources = dict(sources or {})
+        # Identifies this dictionary's code assignment; kept by appends
+        self.uid = uid or uuid.uuid4().hex
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def encode(self, values) -> np.ndarray:
+        """int32 code of each value, -1 for missing or unknown ids.
+
+        Categoricals are looked up once per category, not per row.
+        """
+        series = pd.Series(values, copy=False)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            lookup = np.append(self.ids.get_indexer(series.cat.categories.astype(str)), -1)
+            return lookup[series.cat.codes.to_numpy()].astype(np.int32)
+        codes = self.ids.get_indexer(series.astype(str))
+        codes[series.isna().to_numpy()] = -1
+        return codes.astype(np.int32)
+
+    def decode(self, codes) -> pd.Categorical:
+        """hospitalization_id of each code (missing for -1)."""
+        return pd.Categorical.from_codes(np.asarray(codes), categories=self.ids)
+
+    def mask(self, codes) -> np.ndarray:
+        """Boolean array over the dictionary, True for every code in ``codes``."""
+        codes = np.asarray(codes)
+        present = np.zeros(len(self.ids), dtype=bool)
+        present[codes[codes >= 0]] = True
+        return present
+
+    def extended(self, values, sources=None) -> 'HospitalizationIds':
+        """Dictionary with the ids of ``values`` not yet present appended in sorted order."""
+        values = pd.Index(pd.unique(pd.Series(values, dtype=object).dropna())).astype(str)
+        new = values[self.ids.get_indexer(values) < 0].sort_values()
+        return HospitalizationIds(self.ids.append(pd.Index(new, dtype=object)), {**self.sources, **(sources or {})},
+                                  self.uid)
+
+    def save(self, path) -> None:
+        """Write the dictionary; a temporary file is renamed so readers never see a partial one."""
+        table = pa.table({'hospitalization_id': pa.array(self.ids.to_numpy(), type=pa.string())})
+        table = table.replace_schema_metadata({_METADATA_KEY: json.dumps(self.sources), _UID_KEY: self.uid})
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path) -> 'HospitalizationIds':
+        table = pq.read_table(Path(path))
+        metadata = table.schema.metadata or {}
+        sources = json.loads(metadata.get(_METADATA_KEY, b'{}'))
+        uid = metadata[_UID_KEY].decode() if _UID_KEY in metadata else None
+        return cls(table.column('hospitalization_id').to_pylist(), sources, uid)
+
+
+def _read_ids(dataset: ds.Dataset) -> pa.Array:
+    column = dataset.to_table(columns=['hospitalization_id']).column('hospitalization_id')
+    return pc.unique(pc.cast(column, pa.string())).drop_null()
+
+
+def update_hosp_ids(path, sources: dict) -> HospitalizationIds:
+    """Dictionary at ``path`` brought up to date with ``sources``.
+
+    ``sources`` maps a table to ``(raw_path, parquet_paths)``, where
+    ``parquet_paths`` is a callable returning the Parquet files to read (so CSV
+    sources are only converted when they changed). Tables without a
+    hospitalization_id column are recorded without adding ids.
+    """
+    path = Path(path)
+    current = {table: fingerprint(raw) for table, (raw, _) in sources.items()}
+    ids = _LOADED.get(path)
+    if ids is None or any(ids.sources.get(t) != f for t, f in current.items()):
+        ids = HospitalizationIds.load(path) if path.exists() else HospitalizationIds([])
+    changed = [table for table, f in current.items() if ids.sources.get(table) != f]
+    if changed:
+        for table in changed:
+            dataset = ds.dataset([str(p) for p in sources[table][1]()], format='parquet')
+            has_ids = 'hospitalization_id' in dataset.schema.names
+            ids = ids.extended(_read_ids(dataset).to_pandas() if has_ids else [], {table: current[table]})
+        ids.save(path)
+    _LOADED[path] = ids
+    return ids
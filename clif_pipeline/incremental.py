@@ -0,0 +1,333 @@
+"""Incremental refresh of the respiratory/ADT merged dataset.
+
+Each refresh joins only the hospitalizations that are new or changed since
+the previous run, rewrites the year/location partitions that hold their rows
+and updates the per-location yearly aggregates from stored hosp-day results,
+so the cost scales with the delta rather than the full history.
+
+Changed hospitalizations are found either from a watermark (records or ADT
+times at or after the newest timestamp seen last time; only reads the row
+groups past the watermark, plus the id column to pick up hospitalizations
+never seen before, e.g. back-loaded ones whose times all predate the
+watermark) or from per-hospitalization signatures (row counts and max
+timestamps; also catches corrections and deletions of old records).
+
+State is kept in ``<root>/_state``, which dataset readers ignore.
+
+Usage::
+
+    python -m clif_pipeline.incremental --detect watermark
+"""
+import argparse
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from .aggregate import TARGET_MODES, add_percentages
+from .interval_join import merge_respiratory_adt
+from .kernels import daily_dominant_mode
+from .loader import load_clif_table, load_config, scan_clif_table
+from .merged_store import MERGED_DIR, fill_mode_category, open_merged_dataset, sort_merged, write_merged_dataset
+
+STATE_DIR = '_state'
+RESPIRATORY_COLS = ['hospitalization_id', 'recorded_dttm', 'mode_category']
+ADT_COLS = ['hospitalization_id', 'in_dttm', 'out_dttm', 'location_name']
+SIGNATURE_COLS = ['resp_rows', 'resp_max_dttm', 'adt_rows', 'adt_max_in_dttm', 'adt_max_out_dttm']
+
+
+def _state_path(root, name: str) -> Path:
+    return Path(root) / STATE_DIR / name
+
+
+def _read_state_table(root, name: str) -> pd.DataFrame:
+    return pd.read_parquet(_state_path(root, f"{name}.parquet"))
+
+
+def _write_state_table(root, name: str, df: pd.DataFrame) -> None:
+    path = _state_path(root, f"{name}.parquet")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(path, index=False)
+
+
+def read_watermark(root=MERGED_DIR):
+    """Watermark written by the last refresh, or None if there is no state yet."""
+    path = _state_path(root, 'watermark.json')
+    if not path.exists():
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _as_str_ids(ids) -> pd.Series:
+    return pd.Series(np.asarray(ids, dtype=object)).astype(str)
+
+
+def hosp_signatures(df_respiratory: pd.DataFrame, df_adt: pd.DataFrame) -> pd.DataFrame:
+    """Row counts and max timestamps per hospitalization_id."""
+    resp = df_respiratory.groupby('hospitalization_id', observed=True)['recorded_dttm'].agg(
+        resp_rows='size', resp_max_dttm='max'
+    )
+    adt = df_adt.groupby('hospitalization_id', observed=True).agg(
+        adt_rows=('in_dttm', 'size'), adt_max_in_dttm=('in_dttm', 'max'), adt_max_out_dttm=('out_dttm', 'max')
+    )
+    resp.index = _as_str_ids(resp.index)
+    adt.index = _as_str_ids(adt.index)
+    signatures = resp.join(adt, how='outer')
+    signatures.index.name = 'hospitalization_id'
+    return signatures.reset_index()
+
+
+def changed_by_signature(config: dict, root=MERGED_DIR):
+    """Hospitalizations whose signature differs from the stored one, and the new signatures."""
+    df_respiratory = load_clif_table(config, 'respiratory_support', columns=['hospitalization_id', 'recorded_dttm'])
+    df_adt = load_clif_table(config, 'adt', columns=['hospitalization_id', 'in_dttm', 'out_dttm'])
+    current = hosp_signatures(df_respiratory, df_adt)
+    stored = _read_state_table(root, 'hosp_signatures')
+
+    both = stored.merge(current, on='hospitalization_id', how='outer', suffixes=('_old', '_new'))
+    changed = pd.Series(False, index=both.index)
+    for col in SIGNATURE_COLS:
+        old, new = both[f"{col}_old"], both[f"{col}_new"]
+        changed |= ~((old == new) | (old.isna() & new.isna()))
+    return set(both.loc[changed, 'hospitalization_id']), current
+
+
+def changed_since_watermark(config: dict, watermark: dict) -> set:
+    """Hospitalizations with respiratory or ADT times at or after the stored watermark."""
+    ids = set()
+    resp_since = watermark.get('recorded_dttm')
+    if resp_since is not None:
+        df = load_clif_table(config, 'respiratory_support', columns=['hospitalization_id'],
+                             time_col='recorded_dttm', start=resp_since)
+        ids.update(_as_str_ids(df['hospitalization_id'].unique()))
+    adt_since = watermark.get('adt_dttm')
+    if adt_since is not None:
+        for time_col in ['in_dttm', 'out_dttm']:
+            df = load_clif_table(config, 'adt', columns=['hospitalization_id'], time_col=time_col, start=adt_since)
+            ids.update(_as_str_ids(df['hospitalization_id'].unique()))
+    return ids
+
+
+def unseen_hospitalizations(config: dict, root=MERGED_DIR) -> set:
+    """Respiratory or ADT hospitalizations missing from the stored signatures (reads only the ids)."""
+    seen = set(_read_state_table(root, 'hosp_signatures')['hospitalization_id'])
+    ids = set()
+    for table in ('respiratory_support', 'adt'):
+        column = scan_clif_table(config, table, columns=['hospitalization_id'], typed=False).column(0)
+        ids.update(pc.unique(pc.cast(column, pa.string())).drop_null().to_pylist())
+    return ids - seen
+
+
+def _target_rows(df_merged: pd.DataFrame, target_modes) -> pd.DataFrame:
+    df = df_merged[df_merged['mode_category_filled'].isin(target_modes)]
+    df = df[['hospitalization_id', 'recorded_dttm', 'location_name', 'mode_category_filled']]
+    return df.rename(columns={'mode_category_filled': 'mode_category'})
+
+
+def _hosp_aggregates(df_merged: pd.DataFrame, target_modes):
+    """Per-hospitalization pieces of the location aggregates for ``df_merged``."""
+    df_three_modes = _target_rows(df_merged, target_modes)
+    hosp_daily = daily_dominant_mode(df_three_modes, keys=['location_name', 'hospitalization_id'])
+    location_records = (
+        df_three_modes.groupby(['location_name', 'hospitalization_id'], observed=True)
+        .size().reset_index(name='records')
+    )
+    for df in (hosp_daily, location_records):
+        df['hospitalization_id'] = _as_str_ids(df['hospitalization_id']).to_numpy()
+        df['location_name'] = df['location_name'].astype(str)
+    hosp_daily['mode_category'] = hosp_daily['mode_category'].astype(str)
+    return hosp_daily, location_records
+
+
+def location_aggregates(hosp_daily: pd.DataFrame, location_records: pd.DataFrame):
+    """Yearly dominant-mode table and location stats from the stored hosp-level tables."""
+    hosp_daily = hosp_daily.assign(year=hosp_daily['date'].dt.year)
+    yearly_modes = add_percentages(
+        hosp_daily.groupby(['location_name', 'year', 'mode_category']).size().reset_index(name='hosp_days')
+    )
+    location_stats = location_records.groupby('location_name').agg(
+        records=('records', 'sum'), hospitalizations=('hospitalization_id', 'nunique')
+    )
+    location_stats['years'] = hosp_daily.groupby('location_name')['year'].nunique()
+    location_stats['years'] = location_stats['years'].fillna(0).astype(int)
+    return yearly_modes, location_stats.reset_index()
+
+
+def _save_aggregates(root, hosp_daily, location_records) -> dict:
+    _write_state_table(root, 'hosp_daily', hosp_daily)
+    _write_state_table(root, 'location_records', location_records)
+    yearly_modes, location_stats = location_aggregates(hosp_daily, location_records)
+    _write_state_table(root, 'yearly_modes', yearly_modes)
+    _write_state_table(root, 'location_stats', location_stats)
+    return {'yearly_modes': yearly_modes, 'location_stats': location_stats}
+
+
+def _save_watermark(root, df_respiratory, df_adt, target_modes, previous=None) -> None:
+    def newest(*values):
+        values = [pd.Timestamp(v) for v in values if v is not None and pd.notna(v)]
+        return max(values).isoformat() if values else None
+
+    previous = previous or {}
+    watermark = {
+        'recorded_dttm': newest(previous.get('recorded_dttm'), df_respiratory['recorded_dttm'].max()),
+        'adt_dttm': newest(previous.get('adt_dttm'), df_adt['in_dttm'].max(), df_adt['out_dttm'].max()),
+        'target_modes': list(target_modes),
+    }
+    path = _state_path(root, 'watermark.json')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(watermark, f, indent=2)
+
+
+def _partition_rows(df_merged: pd.DataFrame) -> pd.DataFrame:
+    parts = pd.DataFrame({
+        'hospitalization_id': _as_str_ids(df_merged['hospitalization_id']).to_numpy(),
+        'year': df_merged['recorded_dttm'].dt.year.astype('int32').to_numpy(),
+        'location_name': df_merged['location_name'].astype(object).where(df_merged['location_name'].notna(), None).to_numpy(),
+    })
+    return parts.drop_duplicates()
+
+
+def initialize_state(df_respiratory, df_adt, df_merged, root=MERGED_DIR, target_modes=TARGET_MODES) -> dict:
+    """Record the state of a full build so later refreshes can be incremental.
+
+    ``df_merged`` is the full merged frame that was just written to ``root``.
+    """
+    df_merged = sort_merged(df_merged)
+    df_merged['mode_category_filled'] = fill_mode_category(df_merged)
+    _write_state_table(root, 'hosp_signatures', hosp_signatures(df_respiratory, df_adt))
+    _write_state_table(root, 'hosp_partitions', _partition_rows(df_merged))
+    _save_watermark(root, df_respiratory, df_adt, target_modes)
+    return _save_aggregates(root, *_hosp_aggregates(df_merged, target_modes))
+
+
+def _rewrite_partitions(root, df_new: pd.DataFrame, hosp_ids: set, affected: set) -> None:
+    """Replace the rows of ``hosp_ids`` in the ``affected`` (year, location) partitions."""
+    dataset = open_merged_dataset(root)
+    fragments = []
+    for fragment in dataset.get_fragments():
+        keys = ds.get_partition_keys(fragment.partition_expression)
+        if (keys.get('year'), keys.get('location_name')) in affected:
+            fragments.append(fragment)
+
+    kept = []
+    for fragment in fragments:
+        df = fragment.to_table(schema=dataset.schema).to_pandas()
+        kept.append(df[~_as_str_ids(df['hospitalization_id']).isin(hosp_ids).to_numpy()])
+    for fragment in fragments:
+        os.remove(fragment.path)
+
+    df_write = pd.concat(kept + [df_new], ignore_index=True)
+    if len(df_write):
+        write_merged_dataset(
+            df_write, root,
+            existing_data_behavior='overwrite_or_ignore',
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet"
+        )
+
+    # Drop partition directories that no longer hold any rows
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        if Path(dirpath) != Path(root) and STATE_DIR not in Path(dirpath).parts and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+
+def update_merged(config: dict, root=MERGED_DIR, target_modes=TARGET_MODES, detect='watermark') -> dict:
+    """Bring the merged dataset and its aggregates up to date with the CLIF extract.
+
+    ``detect`` is ``'watermark'`` or ``'signature'``. The watermark catches
+    new hospitalizations and appended records, but not edits or deletions of
+    records older than the watermark; use ``'signature'`` for those. Without
+    existing state (or with different target modes) the dataset is rebuilt
+    from scratch.
+    Returns the number of refreshed hospitalizations and the updated
+    ``yearly_modes`` and ``location_stats`` tables.
+    """
+    watermark = read_watermark(root)
+    if watermark is None or watermark.get('target_modes') != list(target_modes):
+        df_respiratory = load_clif_table(config, 'respiratory_support', columns=RESPIRATORY_COLS)
+        df_adt = load_clif_table(config, 'adt', columns=ADT_COLS)
+        df_merged = merge_respiratory_adt(df_respiratory, df_adt)
+        if Path(root).exists():
+            shutil.rmtree(root)
+        write_merged_dataset(df_merged, root)
+        results = initialize_state(df_respiratory, df_adt, df_merged, root, target_modes)
+        results['hospitalizations'] = df_merged['hospitalization_id'].nunique()
+        return results
+
+    signatures = None
+    if detect == 'signature':
+        hosp_ids, signatures = changed_by_signature(config, root)
+    elif detect == 'watermark':
+        hosp_ids = changed_since_watermark(config, watermark) | unseen_hospitalizations(config, root)
+    else:
+        raise ValueError(f"Unknown change detection '{detect}', expected 'watermark' or 'signature'")
+
+    if not hosp_ids:
+        return {
+            'hospitalizations': 0,
+            'yearly_modes': _read_state_table(root, 'yearly_modes'),
+            'location_stats': _read_state_table(root, 'location_stats'),
+        }
+
+    # Join only the changed hospitalizations
+    ids = sorted(hosp_ids)
+    df_respiratory = load_clif_table(config, 'respiratory_support', columns=RESPIRATORY_COLS,
+                                     filters={'hospitalization_id': ids})
+    df_adt = load_clif_table(config, 'adt', columns=ADT_COLS, filters={'hospitalization_id': ids})
+    df_new = merge_respiratory_adt(df_respiratory, df_adt)
+    df_new['mode_category_filled'] = fill_mode_category(df_new)
+
+    # Upsert into the partitions that held or will hold their rows
+    hosp_partitions = _read_state_table(root, 'hosp_partitions')
+    changed_parts = hosp_partitions['hospitalization_id'].isin(hosp_ids)
+    new_parts = _partition_rows(df_new)
+    affected = set(zip(hosp_partitions.loc[changed_parts, 'year'], hosp_partitions.loc[changed_parts, 'location_name']))
+    affected |= set(zip(new_parts['year'], new_parts['location_name']))
+    _rewrite_partitions(root, df_new, hosp_ids, affected)
+    _write_state_table(root, 'hosp_partitions', pd.concat([hosp_partitions[~changed_parts], new_parts]))
+
+    # Replace the hosp-level aggregate rows of the changed hospitalizations
+    hosp_daily_new, location_records_new = _hosp_aggregates(df_new, target_modes)
+    hosp_daily = _read_state_table(root, 'hosp_daily')
+    location_records = _read_state_table(root, 'location_records')
+    hosp_daily = pd.concat([hosp_daily[~hosp_daily['hospitalization_id'].isin(hosp_ids)], hosp_daily_new])
+    location_records = pd.concat([
+        location_records[~location_records['hospitalization_id'].isin(hosp_ids)], location_records_new
+    ])
+    results = _save_aggregates(root, hosp_daily, location_records)
+
+    if signatures is None:
+        stored = _read_state_table(root, 'hosp_signatures')
+        signatures = pd.concat([
+            stored[~stored['hospitalization_id'].isin(hosp_ids)], hosp_signatures(df_respiratory, df_adt)
+        ])
+    _write_state_table(root, 'hosp_signatures', signatures)
+    _save_watermark(root, df_respiratory, df_adt, target_modes, previous=watermark)
+
+    results['hospitalizations'] = len(hosp_ids)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Incrementally refresh the respiratory/ADT merged dataset.')
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--root', default=MERGED_DIR)
+    parser.add_argument('--detect', choices=['watermark', 'signature'], default='watermark')
+    args = parser.parse_args()
+
+    results = update_merged(load_config(args.config), args.root, detect=args.detect)
+    print(f"Refreshed {results['hospitalizations']:,} hospitalizations in {args.root}")
+    print("\nLocation statistics:")
+    print(results['location_stats'].to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
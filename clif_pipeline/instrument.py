@@ -0,0 +1,158 @@
+"""Per-stage timing, throughput and memory instrumentation.
+
+A ``Recorder`` times named stages (wall and CPU), counts rows in and out,
+samples the process RSS to get each stage's peak, and optionally tracks the
+Python-heap peak with ``tracemalloc`` and runs ``cProfile`` per top-level
+stage. Library functions mark their inner steps with ``step(...)``, which
+records into the active recorder and does nothing when none is active::
+
+    recorder = Recorder(trace_memory=True, profile_dir='profiles')
+    with recorder.activate(), recorder.stage('merge', rows_in=len(df)) as info:
+        df_merged = merge_respiratory_adt(df, adt_index)   # records merge/join, merge/sort, ...
+        info['rows_out'] = len(df_merged)
+    recorder.write('run_report')   # run_report.json and run_report.csv
+"""
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+_ACTIVE = []
+REPORT_COLUMNS = ['stage', 'depth', 'rows_in', 'rows_out', 'wall_s', 'cpu_s', 'rows_per_s',
+                  'rss_start_mb', 'peak_rss_mb', 'peak_traced_mb']
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process (peak so far where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+
+class _RssSampler(threading.Thread):
+    """Background thread keeping the highest RSS seen while a stage runs."""
+
+    def __init__(self, interval: float = 0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss_mb()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def stop(self) -> float:
+        self._stop_event.set()
+        self.join()
+        return max(self.peak, current_rss_mb())
+
+
+class Recorder:
+    """Collects one record per stage and writes them as a JSON/CSV run report."""
+
+    def __init__(self, run_name: str = 'run', trace_memory: bool = False, profile_dir=None):
+        self.run_name = run_name
+        self.trace_memory = trace_memory
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self.started = datetime.now().isoformat(timespec='seconds')
+        self.records = []
+        self._stack = []
+        self._child_peaks = []
+        self._owns_tracing = False
+
+    @contextmanager
+    def activate(self):
+        """Make this the recorder that ``step`` writes to."""
+        _ACTIVE.append(self)
+        try:
+            yield self
+        finally:
+            _ACTIVE.remove(self)
+
+    @contextmanager
+    def stage(self, name: str, rows_in=None):
+        """Time a stage; set ``info['rows_out']`` (and optionally ``rows_in``) inside the block."""
+        info = {'rows_in': rows_in, 'rows_out': None}
+        full_name = '/'.join([*self._stack, name])
+        top_level = not self._stack
+        profiler = cProfile.Profile() if top_level and self.profile_dir else None
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracing = True
+        traced_start = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+        record = {'stage': full_name, 'depth': len(self._stack), 'rss_start_mb': current_rss_mb()}
+        self._stack.append(name)
+        self._child_peaks.append([])
+        sampler = _RssSampler()
+        sampler.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profiler:
+            profiler.enable()
+        try:
+            yield info
+        finally:
+            if profiler:
+                profiler.disable()
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                profiler.dump_stats(self.profile_dir / f"{full_name.replace('/', '_')}.prof")
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            record['peak_rss_mb'] = sampler.stop()
+            self._stack.pop()
+            children = self._child_peaks.pop()
+            if self.trace_memory:
+                # Nested stages reset the peak, so fold in the peaks they recorded
+                peak = tracemalloc.get_traced_memory()[1] - traced_start
+                record['peak_traced_mb'] = max([peak / 1024**2, *children])
+                if self._child_peaks:
+                    self._child_peaks[-1].append(record['peak_traced_mb'])
+                if top_level and self._owns_tracing:
+                    tracemalloc.stop()
+                    self._owns_tracing = False
+            else:
+                record['peak_traced_mb'] = None
+            rows = info['rows_out'] if info['rows_out'] is not None else info['rows_in']
+            record.update({
+                'rows_in': info['rows_in'],
+                'rows_out': info['rows_out'],
+                'wall_s': wall,
+                'cpu_s': cpu,
+                'rows_per_s': rows / wall if rows is not None and wall > 0 else None,
+            })
+            self.records.append(record)
+
+    def report(self) -> pd.DataFrame:
+        return pd.DataFrame(self.records, columns=REPORT_COLUMNS)
+
+    def write(self, path, extra=None) -> None:
+        """Write ``<path>.json`` (run metadata and stages) and ``<path>.csv`` (stages)."""
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        payload = {'run': self.run_name, 'started': self.started, **(extra or {}), 'stages': self.records}
+        with open(f"{path}.json", 'w') as f:
+            json.dump(payload, f, indent=2, default=str)
+        self.report().to_csv(f"{path}.csv", index=False)
+
+
+@contextmanager
+def step(name: str, rows_in=None):
+    """Record ``name`` as a sub-stage of the active recorder, if any."""
+    if not _ACTIVE:
+        yield {'rows_in': rows_in, 'rows_out': None}
+        return
+    with _ACTIVE[-1].stage(name, rows_in) as info:
+        yield info
@@ -0,0 +1,234 @@
+"""Interval join of timestamped CLIF records onto ADT location intervals.
+
+The ADT table is sorted once by (hospitalization_id, in_dttm) and every
+record is assigned directly to the interval that contains it, so memory grows
+with the number of records instead of records x ADT rows per hospitalization.
+When both sides carry the global ``hosp_code`` (see ``hosp_ids``), records
+are matched to their hospitalization through an integer lookup table instead
+of hashing the id strings.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .hosp_ids import HOSP_CODE
+from .instrument import step
+from .schema import to_pandas
+
+_NAT = np.iinfo(np.int64).min
+_METADATA_KEY = b'clif_pipeline.adt_index'
+
+
+def to_ns(values) -> np.ndarray:
+    """Convert timestamps to int64 nanoseconds (NaT becomes int64 min)."""
+    series = pd.Series(values, copy=False)
+    if not pd.api.types.is_datetime64_any_dtype(series):
+        series = pd.to_datetime(series)
+    if getattr(series.dt, 'tz', None) is not None:
+        series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+    return series.to_numpy(dtype='datetime64[ns]').view(np.int64)
+
+
+class ADTIndex:
+    """Per-hospitalization ADT intervals sorted by (hospitalization_id, in_dttm).
+
+    Build it once with ``ADTIndex(df_adt)`` (or ``ADTIndex.load``) and reuse it
+    to place rows of any CLIF table with a timestamp column into the ADT
+    interval that was active at that time.
+    """
+
+    def __init__(self, df_adt: pd.DataFrame, id_col: str = 'hospitalization_id',
+                 in_col: str = 'in_dttm', out_col: str = 'out_dttm'):
+        self.id_col = id_col
+        self.in_col = in_col
+        self.out_col = out_col
+
+        frame = df_adt.reset_index(drop=True)
+        if 'adt_row' not in frame.columns:
+            frame['adt_row'] = np.arange(len(frame), dtype=np.int64)
+
+        # Rows with a missing bound can never contain a timestamp
+        in_ns = to_ns(frame[in_col])
+        out_ns = to_ns(frame[out_col])
+        usable = (in_ns != _NAT) & (out_ns != _NAT) & frame[id_col].notna().to_numpy()
+        frame = frame[usable]
+
+        codes, hosp_ids = pd.factorize(frame[id_col], sort=True)
+        order = np.lexsort((in_ns[usable], codes))
+
+        self.frame = frame.iloc[order].reset_index(drop=True)
+        self.hosp_ids = pd.Index(hosp_ids)
+        self.codes = codes[order]
+        self.in_ns = in_ns[usable][order]
+        self.out_ns = out_ns[usable][order]
+        self.adt_row = self.frame['adt_row'].to_numpy(dtype=np.int64)
+        self.offsets = np.searchsorted(self.codes, np.arange(len(self.hosp_ids) + 1))
+        # Global hosp_code -> position in hosp_ids, when every interval has one
+        self.code_lookup = None
+        if HOSP_CODE in self.frame.columns:
+            hosp_codes = self.frame[HOSP_CODE].to_numpy(dtype=np.int64)
+            if len(hosp_codes) and hosp_codes.min() >= 0:
+                self.code_lookup = np.full(hosp_codes.max() + 1, -1, dtype=np.int64)
+                self.code_lookup[hosp_codes] = self.codes
+        # Running max of out_dttm within each hospitalization bounds how far
+        # back an overlapping interval can still contain a timestamp
+        self.max_out_ns = (
+            pd.Series(self.out_ns).groupby(self.codes).cummax().to_numpy(dtype=np.int64)
+        )
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def _hosp_positions(self, hosp_ids, hosp_codes=None) -> np.ndarray:
+        """Position of each hospitalization in ``hosp_ids`` (-1 when not in the index)."""
+        if hosp_codes is None or self.code_lookup is None:
+            return self.hosp_ids.get_indexer(pd.Index(hosp_ids))
+        hosp_codes = np.asarray(hosp_codes, dtype=np.int64)
+        known = (hosp_codes >= 0) & (hosp_codes < len(self.code_lookup))
+        positions = np.full(len(hosp_codes), -1, dtype=np.int64)
+        positions[known] = self.code_lookup[hosp_codes[known]]
+        return positions
+
+    def locate(self, hosp_ids, times, hosp_codes=None) -> np.ndarray:
+        """Return the index row containing each (hosp_id, time) pair, or -1.
+
+        When intervals overlap, the interval that came first in the original
+        ADT table wins, matching ``drop_duplicates(keep='first')`` after the
+        old merge-then-filter. ``hosp_codes`` (global codes of ``hosp_ids``)
+        replaces the id lookup when the index has them too.
+        """
+        codes = self._hosp_positions(hosp_ids, hosp_codes)
+        t = to_ns(times)
+        valid = np.flatnonzero((codes >= 0) & (t != _NAT))
+        n_adt = len(self.codes)
+
+        # Sweep: sort interval starts and records together; the last start
+        # seen before a record is its closest candidate interval.
+        keys_code = np.concatenate([self.codes, codes[valid]])
+        keys_time = np.concatenate([self.in_ns, t[valid]])
+        is_record = np.concatenate([np.zeros(n_adt, dtype=np.int8), np.ones(len(valid), dtype=np.int8)])
+        sweep = np.lexsort((is_record, keys_time, keys_code))
+        last_start = np.maximum.accumulate(np.where(sweep < n_adt, sweep, -1))
+        record_pos = sweep >= n_adt
+        cand = np.full(len(t), -1, dtype=np.int64)
+        cand[valid[sweep[record_pos] - n_adt]] = last_start[record_pos]
+        same_hosp = cand >= 0
+        same_hosp[same_hosp] = self.codes[cand[same_hosp]] == codes[same_hosp]
+        cand[~same_hosp] = -1
+
+        result = np.full(len(t), -1, dtype=np.int64)
+        best_row = np.full(len(t), np.iinfo(np.int64).max, dtype=np.int64)
+        active = np.flatnonzero(cand >= 0)
+        while active.size:
+            j = cand[active]
+            tt = t[active]
+            hit = (self.out_ns[j] >= tt) & (self.adt_row[j] < best_row[active])
+            result[active[hit]] = j[hit]
+            best_row[active[hit]] = self.adt_row[j[hit]]
+
+            prev = j - 1
+            seg_start = self.offsets[codes[active]]
+            more = prev >= seg_start
+            more[more] = self.max_out_ns[prev[more]] >= tt[more]
+            cand[active] = prev
+            active = active[more]
+        return result
+
+    def join(self, df: pd.DataFrame, time_col: str = 'recorded_dttm', columns=None) -> pd.DataFrame:
+        """Inner-join ``df`` to the ADT interval containing ``time_col``.
+
+        Returns the matched rows of ``df`` in their original order with the
+        ADT columns (``columns``, default all but the ids) appended.
+        """
+        hosp_codes = df[HOSP_CODE] if HOSP_CODE in df.columns else None
+        pos = self.locate(df[self.id_col], df[time_col], hosp_codes)
+        matched = pos >= 0
+        return self._append_columns(df[matched], pos[matched], columns)
+
+    def _append_columns(self, left: pd.DataFrame, pos, columns=None) -> pd.DataFrame:
+        """``left`` with the ADT columns of index rows ``pos`` (default all but the ids) appended."""
+        if columns is None:
+            columns = [c for c in self.frame.columns if c not in (self.id_col, HOSP_CODE, 'adt_row')]
+        right = self.frame[list(columns)].iloc[pos].reset_index(drop=True)
+        return pd.concat([left.reset_index(drop=True), right], axis=1)
+
+    def save(self, path) -> None:
+        """Persist the sorted intervals so other notebooks can reuse them."""
+        table = pa.Table.from_pandas(self.frame, preserve_index=False)
+        info = {'id_col': self.id_col, 'in_col': self.in_col, 'out_col': self.out_col}
+        metadata = dict(table.schema.metadata or {})
+        metadata[_METADATA_KEY] = json.dumps(info).encode()
+        pq.write_table(table.replace_schema_metadata(metadata), Path(path))
+
+    @classmethod
+    def load(cls, path) -> 'ADTIndex':
+        """Load an index written by ``save``."""
+        table = pq.read_table(Path(path))
+        info = json.loads(table.schema.metadata[_METADATA_KEY])
+        return cls(table.to_pandas(), **info)
+
+
+def _sort_dedup(df_merged: pd.DataFrame) -> pd.DataFrame:
+    with step('sort', rows_in=len(df_merged)):
+        df_merged = df_merged.sort_values(['hospitalization_id', 'recorded_dttm'], kind='stable')
+    with step('drop_duplicates', rows_in=len(df_merged)) as info:
+        df_merged = df_merged.drop_duplicates(
+            subset=['hospitalization_id', 'recorded_dttm', 'mode_category'],
+            keep='first'
+        )
+        info['rows_out'] = len(df_merged)
+    return df_merged.reset_index(drop=True)
+
+
+def merge_respiratory_adt(df_respiratory: pd.DataFrame, adt) -> pd.DataFrame:
+    """Assign each respiratory record to its ADT interval.
+
+    Produces the same rows as the inner merge on hospitalization_id, the
+    ``in_dttm <= recorded_dttm <= out_dttm`` filter, the sort and the
+    ``drop_duplicates(keep='first')`` it replaces. ``adt`` may be an ADT
+    frame or a prebuilt ``ADTIndex``.
+    """
+    index = adt if isinstance(adt, ADTIndex) else ADTIndex(adt)
+    with step('join', rows_in=len(df_respiratory)) as info:
+        df_merged = index.join(df_respiratory, time_col='recorded_dttm')
+        info['rows_out'] = len(df_merged)
+    return _sort_dedup(df_merged)
+
+
+def merge_respiratory_adt_batches(batches, adt, chunk_rows: int = 1_000_000) -> pd.DataFrame:
+    """``merge_respiratory_adt`` over record batches of the respiratory table.
+
+    Batches (e.g. from ``loader.iter_clif_batches``) are located in chunks of
+    about ``chunk_rows`` rows while the following batches are still being
+    read, and only their matched rows are kept, so reading overlaps the join.
+    The result equals ``merge_respiratory_adt`` on the loaded table.
+    """
+    index = adt if isinstance(adt, ADTIndex) else ADTIndex(adt)
+    matched, positions, pending = [], [], []
+
+    def join_pending():
+        chunk = pa.Table.from_batches(pending)
+        hosp_codes = chunk.column(HOSP_CODE).to_numpy() if HOSP_CODE in chunk.column_names else None
+        pos = index.locate(chunk.column(index.id_col).to_pandas(), chunk.column('recorded_dttm').to_pandas(),
+                           hosp_codes)
+        matched.append(chunk.filter(pa.array(pos >= 0)))
+        positions.append(pos[pos >= 0])
+        pending.clear()
+
+    with step('join') as info:
+        rows_in = 0
+        for batch in batches:
+            pending.append(batch)
+            rows_in += batch.num_rows
+            if sum(b.num_rows for b in pending) >= chunk_rows:
+                join_pending()
+        if pending:
+            join_pending()
+        left = to_pandas(pa.concat_tables(matched))
+        df_merged = index._append_columns(left, np.concatenate(positions))
+        info['rows_in'], info['rows_out'] = rows_in, len(df_merged)
+    return _sort_dedup(df_merged)
@@ -0,0 +1,263 @@
+"""Vectorized kernels over integer-coded CLIF columns."""
+import numpy as np
+import pandas as pd
+
+from .hosp_ids import HOSP_CODE
+from .interval_join import to_ns
+
+NS_PER_DAY = 86_400 * 10**9
+
+# Above this many (group, mode) cells the dense count matrix is replaced by a
+# sort of the combined keys to keep intermediate memory small.
+_DENSE_LIMIT = 1 << 24
+
+
+def combine_codes(codes, sizes) -> np.ndarray:
+    """Combine several dense code arrays into one int64 key with the same sort order.
+
+    Rows with a negative (missing) code in any column get -1.
+    """
+    combined = np.zeros(len(codes[0]), dtype=np.int64)
+    missing = np.zeros(len(codes[0]), dtype=bool)
+    span = 1
+    for code, size in zip(codes, sizes):
+        code = np.asarray(code, dtype=np.int64)
+        missing |= code < 0
+        if span * max(size, 1) >= 1 << 62:
+            # Re-densify before the key overflows
+            _, combined = np.unique(combined, return_inverse=True)
+            span = int(combined.max()) + 1 if len(combined) else 1
+        combined = combined * max(size, 1) + code
+        span *= max(size, 1)
+    combined[missing] = -1
+    return combined
+
+
+def dense_ids(keys):
+    """Map int64 keys to dense ids in key order without sorting every row.
+
+    Returns ``(ids, first)`` where ``first[i]`` is the first row holding the
+    i-th smallest key. Only the distinct keys are sorted.
+    """
+    codes, uniques = pd.factorize(np.asarray(keys, dtype=np.int64))
+    # factorize numbers keys by first appearance, so a row is a first
+    # occurrence exactly when its code exceeds every earlier code
+    seen = np.maximum.accumulate(np.r_[-1, codes[:-1]]) if len(codes) else codes
+    first = np.flatnonzero(codes > seen)
+    order = np.argsort(uniques)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[codes], first[order]
+
+
+def factorize_codes(values: pd.Series):
+    """``(codes, uniques)`` with -1 for missing values; categoricals keep their categories."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(), values.cat.categories
+    return pd.factorize(values, sort=True)
+
+
+def decode_codes(codes, uniques, like: pd.Series):
+    """Values of ``factorize_codes`` output, as a categorical when ``like`` is one."""
+    if isinstance(like.dtype, pd.CategoricalDtype):
+        return pd.Categorical.from_codes(codes, dtype=like.dtype, validate=False)
+    return uniques.take(codes)
+
+
+def _order_keys(values: pd.Series) -> np.ndarray:
+    """Integer array with the same ascending order as ``values`` (no missing values)."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        if values.cat.categories.is_monotonic_increasing:
+            return values.cat.codes.to_numpy()
+        return pd.factorize(values, sort=True)[0]
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return to_ns(values)
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        return values.to_numpy()
+    return pd.factorize(values, sort=True)[0]
+
+
+def is_sorted_by(df: pd.DataFrame, columns) -> bool:
+    """Whether ``df`` is already in ``df.sort_values(columns)`` order.
+
+    A frame with a missing value in any of ``columns`` is reported unsorted.
+    """
+    tied = np.ones(max(len(df) - 1, 0), dtype=bool)
+    for col in columns:
+        values = df[col]
+        if values.isna().any():
+            return False
+        values = _order_keys(values)
+        prev, curr = values[:-1], values[1:]
+        if (tied & (prev > curr)).any():
+            return False
+        tied &= prev == curr
+    return True
+
+
+def merge_sorted_runs(df: pd.DataFrame, columns) -> pd.DataFrame:
+    """``df`` in ``df.sort_values(columns, kind='stable')`` order with a fresh index.
+
+    Meant for frames concatenated from pieces that are each in ``columns``
+    order (e.g. the files of a partitioned dataset): every row gets one
+    fixed-width big-endian byte key and a stable timsort merges the existing
+    runs instead of sorting from scratch. Falls back to ``sort_values`` when a
+    key column has missing or non-integer order keys.
+    """
+    if is_sorted_by(df, columns):
+        return df.reset_index(drop=True)
+    keys = [None if df[col].isna().any() else _order_keys(df[col]) for col in columns]
+    if any(key is None or key.dtype.kind not in 'iu' for key in keys):
+        return df.sort_values(columns, kind='stable').reset_index(drop=True)
+    packed = np.empty((len(df), len(keys)), dtype='>u8')
+    for i, key in enumerate(keys):
+        key = key.astype(np.int64, copy=False)
+        # Flipping the sign bit makes unsigned byte order match signed order
+        packed[:, i] = key.view(np.uint64) ^ np.uint64(1 << 63)
+    order = np.argsort(packed.view(f'V{8 * len(keys)}').ravel(), kind='stable')
+    return df.take(order).reset_index(drop=True)
+
+
+def ffill_sorted(df: pd.DataFrame, columns, by='hospitalization_id') -> pd.DataFrame:
+    """Forward fill ``columns`` within each ``by`` group of a grouped frame.
+
+    Equivalent to ``df.groupby(by)[columns].ffill()`` when the rows of each
+    group are contiguous (e.g. sorted by ``by`` and time). Group boundaries
+    come from one comparison of neighbouring keys and every column is filled
+    by propagating the index of its last valid row, so there is no per-group
+    work. Raises ``ValueError`` when the groups are not contiguous.
+    """
+    n = len(df)
+    keys = df[by]
+    key_codes = keys.cat.codes.to_numpy() if isinstance(keys.dtype, pd.CategoricalDtype) else pd.factorize(keys)[0]
+    starts = np.ones(n, dtype=bool)
+    starts[1:] = key_codes[1:] != key_codes[:-1]
+    run_keys = key_codes[starts]
+    run_keys = run_keys[run_keys >= 0]
+    if len(run_keys) and np.bincount(run_keys).max() > 1:
+        raise ValueError(f"Rows are not grouped by '{by}'; sort by it before filling")
+    missing_key = key_codes < 0
+
+    rows = np.arange(n, dtype=np.int32 if n < np.iinfo(np.int32).max else np.int64)
+    filled = {}
+    for col in columns:
+        values = df[col]
+        categorical = isinstance(values.dtype, pd.CategoricalDtype)
+        codes = values.cat.codes.to_numpy() if categorical else None
+        valid = codes >= 0 if categorical else values.notna().to_numpy()
+        # Index of the last valid row so far; a group start resets it to
+        # itself, so an invalid first row propagates a missing value
+        source = rows * (valid | starts)
+        np.maximum.accumulate(source, out=source)
+        if categorical:
+            filled_codes = codes[source]
+            filled_codes[missing_key] = -1
+            filled[col] = pd.Categorical.from_codes(filled_codes, dtype=values.dtype, validate=False)
+        else:
+            filled[col] = values.take(source).where(valid[source] & ~missing_key).array
+    return pd.DataFrame(filled, index=df.index)
+
+
+def dominant_mode(group_ids, mode_codes, n_groups: int, n_modes: int):
+    """Most frequent mode per group over dense integer codes.
+
+    ``group_ids`` lie in ``[0, n_groups)`` and ``mode_codes`` in
+    ``[0, n_modes)``. Ties go to the smallest mode code. Returns ``(modes,
+    counts)`` indexed by group id.
+    """
+    group_ids = np.asarray(group_ids, dtype=np.int64)
+    mode_codes = np.asarray(mode_codes, dtype=np.int64)
+    cell = group_ids * n_modes + mode_codes
+
+    if n_groups == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    if n_groups * n_modes <= _DENSE_LIMIT:
+        counts = np.bincount(cell, minlength=n_groups * n_modes).reshape(n_groups, n_modes)
+        modes = counts.argmax(axis=1)
+        return modes, counts[np.arange(n_groups), modes]
+
+    # Sparse path: count the (group, mode) cells that occur, then keep the
+    # highest count per group with the smallest mode code on ties
+    cells, counts = np.unique(cell, return_counts=True)
+    cell_group = cells // n_modes
+    cell_mode = cells % n_modes
+    order = np.lexsort((cell_mode, -counts, cell_group))
+    first = order[np.r_[True, cell_group[order][1:] != cell_group[order][:-1]]]
+    modes = np.zeros(n_groups, dtype=np.int64)
+    best = np.zeros(n_groups, dtype=np.int64)
+    modes[cell_group[first]] = cell_mode[first]
+    best[cell_group[first]] = counts[first]
+    return modes, best
+
+
+def _key_codes(df: pd.DataFrame, col: str):
+    """``factorize_codes`` of ``df[col]``; ``hospitalization_id`` uses its ``hosp_code`` column.
+
+    Only the distinct ids present are sorted then, instead of every row.
+    """
+    values = df[col]
+    if col == 'hospitalization_id' and HOSP_CODE in df.columns and not isinstance(values.dtype, pd.CategoricalDtype):
+        hosp_codes = df[HOSP_CODE].to_numpy()
+        missing = hosp_codes < 0
+        # Ids missing from the dictionary also get -1
+        if not (missing.any() and values[missing].notna().any()):
+            n_codes = int(hosp_codes.max()) + 1 if len(hosp_codes) else 0
+            first = np.full(n_codes + 1, -1, dtype=np.int64)
+            # Reversed assignment leaves each code's first row
+            first[hosp_codes[::-1]] = np.arange(len(hosp_codes) - 1, -1, -1)
+            present = np.flatnonzero(first[:n_codes] >= 0)
+            ids = pd.Index(values.take(first[present]).to_numpy())
+            order = ids.argsort()
+            rank = np.full(n_codes + 1, -1, dtype=np.int64)
+            rank[present[order]] = np.arange(len(present))
+            return rank[hosp_codes], ids.take(order)
+    return factorize_codes(values)
+
+
+def daily_dominant_mode(df: pd.DataFrame, keys=('hospitalization_id',), time_col='recorded_dttm',
+                        mode_col='mode_category') -> pd.DataFrame:
+    """Dominant ``mode_col`` per ``keys`` and calendar day of ``time_col``.
+
+    Equivalent to ``groupby([*keys, 'date', mode_col]).size()`` followed by
+    ``groupby([*keys, 'date'])['count'].idxmax()``: rows with a missing key or
+    mode are ignored and ties go to the alphabetically first mode. Returns
+    ``[*keys, 'date', mode_col, 'count']`` sorted by keys and date, with
+    ``date`` as a midnight timestamp.
+
+    Categorical columns are grouped on their codes, so order and ties follow
+    the category order (alphabetical for ``schema.to_pandas`` output);
+    ``hospitalization_id`` uses ``hosp_code`` when present. Only other columns
+    are factorized row by row.
+    """
+    keys = list(keys)
+    mode_codes, mode_values = factorize_codes(df[mode_col])
+    codes, sizes = [], []
+    for key in keys:
+        key_codes, key_values = _key_codes(df, key)
+        codes.append(key_codes)
+        sizes.append(len(key_values))
+
+    # Calendar days of the wall-clock time
+    times = pd.Series(df[time_col], copy=False)
+    if getattr(times.dt, 'tz', None) is not None:
+        times = times.dt.tz_localize(None)
+    t = to_ns(times)
+    valid_day = t != np.iinfo(np.int64).min
+    day = np.floor_divide(t, NS_PER_DAY)
+    first_day = day[valid_day].min() if valid_day.any() else 0
+    day_codes = np.where(valid_day, day - first_day, -1)
+    codes.append(day_codes)
+    sizes.append(int(day_codes.max()) + 1 if len(day_codes) else 1)
+
+    group_codes = combine_codes(codes, sizes)
+    rows = np.flatnonzero((group_codes >= 0) & (mode_codes >= 0))
+    group_ids, first = dense_ids(group_codes[rows])
+    modes, counts = dominant_mode(group_ids, mode_codes[rows], len(first), len(mode_values))
+
+    # One representative row per group recovers the key values
+    first_row = rows[first]
+    result = df[keys].iloc[first_row].reset_index(drop=True)
+    result['date'] = pd.to_datetime((day[first_row] * NS_PER_DAY).astype('datetime64[ns]'))
+    result[mode_col] = decode_codes(modes, mode_values, df[mode_col])
+    result['count'] = counts
+    return result
@@ -0,0 +1,292 @@
+"""Column-projected, filtered loading of CLIF tables from ``clif2_path``.
+
+A table is a single file (``clif_adt.parquet``), a directory of part files
+(``clif_adt/`` or ``clif_adt.parquet/``) or, through the optional config key
+``tables`` (``{"adt": "exports/adt/*.parquet"}``), any path or glob pattern
+relative to ``clif2_path``.
+
+Column selection and row filters are handed to the pyarrow Parquet scanner,
+which skips row groups whose min/max statistics cannot match and only decodes
+the requested columns. Files and row groups are decoded concurrently on the
+pyarrow thread pool with a bounded read-ahead (config key ``read_ahead``,
+in record batches), and ``iter_clif_batches`` hands the batches on as they
+arrive, so downstream compute overlaps the reads. CSV sources
+(``"filetype": "csv"``) are scanned through cached Parquet copies (see
+``csv_source``). Loaded tables with a ``hospitalization_id`` column also get
+its int32 ``hosp_code`` from the global id dictionary (see ``hosp_ids``); set
+``"hosp_codes": false`` in the config to skip it.
+"""
+import glob
+import json
+import queue
+import threading
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from .cache import DEFAULT_CACHE_DIR
+from .csv_source import parquet_copy
+from .hosp_ids import HOSP_CODE, HOSP_ID_DIR, HOSP_ID_FILE, update_hosp_ids
+from .instrument import step
+from .schema import cast_to_schema, to_pandas
+
+TABLE_FILES = {
+    'respiratory_support': 'clif_respiratory_support',
+    'adt': 'clif_adt',
+    'medication_admin_continuous': 'clif_medication_admin_continuous',
+}
+DEFAULT_READ_AHEAD = 16
+
+
+def load_config(config_path='config.json') -> dict:
+    """Read the site config (``site``, ``clif2_path``, ``filetype``)."""
+    with open(config_path, 'r') as f:
+        return json.load(f)
+
+
+def table_path(config: dict, table: str) -> Path:
+    """Path of a CLIF table (file, directory or glob pattern), e.g. ``table_path(config, 'adt')``."""
+    root = Path(config['clif2_path'])
+    if table in config.get('tables', {}):
+        return root / config['tables'][table]
+    name = TABLE_FILES.get(table, table)
+    path = root / f"{name}.{config.get('filetype', 'parquet')}"
+    if not path.exists() and (root / name).is_dir():
+        return root / name
+    return path
+
+
+def _hidden(relative: Path) -> bool:
+    return any(part.startswith(('.', '_')) for part in relative.parts)
+
+
+def table_files(config: dict, table: str) -> list:
+    """Files of a CLIF table in a stable order.
+
+    Part files of a directory are the ``*.<filetype>`` files below it, except
+    hidden and ``_``-prefixed ones (``_SUCCESS``, ``_temporary/``). Raises
+    ``FileNotFoundError`` when a directory or glob pattern matches no file.
+    """
+    path = table_path(config, table)
+    suffix = f".{config.get('filetype', 'parquet')}"
+    if path.is_dir():
+        files = [p for p in path.rglob(f"*{suffix}") if p.is_file() and not _hidden(p.relative_to(path))]
+    elif glob.has_magic(str(path)):
+        files = [Path(p) for p in glob.glob(str(path), recursive=True)
+                 if Path(p).is_file() and not _hidden(Path(Path(p).name))]
+    else:
+        return [path]
+    if not files:
+        raise FileNotFoundError(f"No {suffix} files for table '{table}' at {path}")
+    return sorted(files)
+
+
+def source_paths(config: dict, table: str) -> list:
+    """Parquet files to scan for a table: its files, or the cached copies of its CSVs."""
+    filetype = config.get('filetype', 'parquet')
+    if filetype == 'parquet':
+        return table_files(config, table)
+    if filetype == 'csv':
+        cache_dir = config.get('cache_dir', DEFAULT_CACHE_DIR)
+        with step(f"convert_{table}"):
+            return [parquet_copy(path, table, cache_dir) for path in table_files(config, table)]
+    raise ValueError(f"Unsupported filetype '{filetype}', expected 'parquet' or 'csv'")
+
+
+def clif_dataset(config: dict, table: str) -> ds.Dataset:
+    """pyarrow dataset over all files of a CLIF table."""
+    return ds.dataset([str(path) for path in source_paths(config, table)], format='parquet')
+
+
+def clif_tables(config: dict) -> list:
+    """Every CLIF table under ``clif2_path`` (files or part-file directories) plus ``tables`` entries."""
+    names = {file: table for table, file in TABLE_FILES.items()}
+    suffix = f".{config.get('filetype', 'parquet')}"
+    tables = []
+    for path in sorted(Path(config['clif2_path']).glob('clif_*')):
+        stem = path.name[:-len(suffix)] if path.name.endswith(suffix) else path.name
+        if path.name.endswith(suffix) or path.is_dir():
+            tables.append(names.get(stem, stem))
+    return list(dict.fromkeys([*tables, *config.get('tables', {})]))
+
+
+def hospitalization_ids(config: dict):
+    """Global ``HospitalizationIds`` of every CLIF table, updated when a table changes."""
+    sources = {
+        table: (table_path(config, table), lambda table=table: source_paths(config, table))
+        for table in clif_tables(config)
+    }
+    return update_hosp_ids(Path(config.get('cache_dir', DEFAULT_CACHE_DIR)) / HOSP_ID_DIR / HOSP_ID_FILE, sources)
+
+
+def attach_hosp_codes(config: dict, df: pd.DataFrame) -> pd.DataFrame:
+    """Insert ``hosp_code`` right after ``hospitalization_id`` (in place; returns ``df``)."""
+    if 'hospitalization_id' in df.columns and HOSP_CODE not in df.columns and config.get('hosp_codes', True):
+        with step('hosp_codes', rows_in=len(df)):
+            codes = hospitalization_ids(config).encode(df['hospitalization_id'])
+        df.insert(df.columns.get_loc('hospitalization_id') + 1, HOSP_CODE, codes)
+    return df
+
+
+def _scalar(value, field_type: pa.DataType) -> pa.Scalar:
+    """Build a filter literal of the column's type so the comparison can use statistics."""
+    if pa.types.is_timestamp(field_type):
+        ts = pd.Timestamp(value)
+        if field_type.tz is not None and ts.tz is None:
+            ts = ts.tz_localize(field_type.tz)
+        elif field_type.tz is None and ts.tz is not None:
+            ts = ts.tz_convert(None)
+        return pa.scalar(ts, type=field_type)
+    if pa.types.is_string(field_type) or pa.types.is_large_string(field_type):
+        return pa.scalar(str(pd.Timestamp(value)) if isinstance(value, pd.Timestamp) else str(value))
+    return pa.scalar(value).cast(field_type)
+
+
+def build_filter(schema: pa.Schema, filters=None, time_col=None, start=None, end=None):
+    """Combine equality/isin filters and a ``[start, end)`` time range into one expression.
+
+    ``filters`` maps a column to a value (``==``) or a list of values (``isin``).
+    """
+    expr = None
+    for col, value in (filters or {}).items():
+        field_type = schema.field(col).type
+        if isinstance(value, (list, tuple, set)):
+            cond = ds.field(col).isin(pa.array([_scalar(v, field_type).as_py() for v in value], type=field_type))
+        else:
+            cond = ds.field(col) == _scalar(value, field_type)
+        expr = cond if expr is None else expr & cond
+
+    if time_col is not None:
+        field_type = schema.field(time_col).type
+        if start is not None:
+            cond = ds.field(time_col) >= _scalar(start, field_type)
+            expr = cond if expr is None else expr & cond
+        if end is not None:
+            cond = ds.field(time_col) < _scalar(end, field_type)
+            expr = cond if expr is None else expr & cond
+    return expr
+
+
+def prefetch(iterable, depth: int = DEFAULT_READ_AHEAD):
+    """Iterate ``iterable`` in a background thread, keeping up to ``depth`` items ready.
+
+    An exception raised while producing is re-raised in the consumer; closing
+    the generator early stops the producer.
+    """
+    items = queue.Queue(maxsize=max(depth, 1))
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((done, e))
+        else:
+            put((done, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def _scanner(config: dict, table: str, columns=None, filters=None, time_col=None, start=None, end=None,
+             batch_size=None) -> ds.Scanner:
+    dataset = clif_dataset(config, table)
+    read_ahead = int(config.get('read_ahead', DEFAULT_READ_AHEAD))
+    options = {} if batch_size is None else {'batch_size': batch_size}
+    return dataset.scanner(
+        columns=columns,
+        filter=build_filter(dataset.schema, filters, time_col, start, end),
+        batch_readahead=read_ahead,
+        fragment_readahead=max(1, read_ahead // 4),
+        use_threads=True,
+        **options
+    )
+
+
+def _scan_batches(scanner: ds.Scanner):
+    """The scanner's batches, or one empty batch when no row matches, so consumers always see the schema."""
+    empty = True
+    for batch in scanner.to_batches():
+        empty = False
+        yield batch
+    if empty:
+        yield pa.RecordBatch.from_pylist([], schema=scanner.projected_schema)
+
+
+def _read_batches(config: dict, scanner: ds.Scanner, table: str, typed: bool):
+    batches = _scan_batches(scanner)
+    if typed:
+        batches = (cast_to_schema(batch, table) for batch in batches)
+    return prefetch(batches, int(config.get('read_ahead', DEFAULT_READ_AHEAD)))
+
+
+def iter_clif_batches(config: dict, table: str, columns=None, filters=None, time_col=None, start=None,
+                      end=None, typed=True, batch_size=None):
+    """Record batches of a CLIF table in file and row order, as soon as each is read.
+
+    Row groups of all files are decoded concurrently, up to ``read_ahead``
+    batches ahead of the consumer; with ``typed`` each batch is cast to the
+    CLIF schema in a prefetch thread. At least one (possibly empty) batch is
+    yielded. Example::
+
+        for batch in iter_clif_batches(config, 'medication_admin_continuous', columns=['med_dose']):
+            ...
+    """
+    scanner = _scanner(config, table, columns, filters, time_col, start, end, batch_size)
+    return _read_batches(config, scanner, table, typed)
+
+
+def scan_clif_table(config: dict, table: str, columns=None, filters=None,
+                    time_col=None, start=None, end=None, typed=True) -> pa.Table:
+    """Scan a CLIF table to Arrow, reading only ``columns`` and matching rows.
+
+    With ``typed`` each record batch is cast to the CLIF schema as it is read.
+    """
+    scanner = _scanner(config, table, columns, filters, time_col, start, end)
+    schema = scanner.projected_schema
+    if typed:
+        schema = cast_to_schema(schema.empty_table(), table).schema
+    return pa.Table.from_batches(list(_read_batches(config, scanner, table, typed)), schema=schema)
+
+
+def load_clif_table(config: dict, table: str, columns=None, filters=None,
+                    time_col=None, start=None, end=None, typed=True) -> pd.DataFrame:
+    """Load a CLIF table as pandas with column projection and row filters pushed down.
+
+    Strings come back as categoricals, ``*_dttm`` columns as datetimes and
+    ``hosp_code`` is attached when ``hospitalization_id`` is loaded.
+    Example::
+
+        df = load_clif_table(config, 'medication_admin_continuous',
+                             columns=['med_category', 'med_dose'],
+                             filters={'med_group': 'vasoactives'})
+    """
+    with step(f"read_{table}") as info:
+        arrow_table = scan_clif_table(config, table, columns, filters, time_col, start, end, typed)
+        info['rows_out'] = arrow_table.num_rows
+    with step('to_pandas', rows_in=arrow_table.num_rows):
+        df = to_pandas(arrow_table) if typed else arrow_table.to_pandas()
+    return attach_hosp_codes(config, df) if typed else df
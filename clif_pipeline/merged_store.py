@@ -0,0 +1,138 @@
+"""Hive-partitioned storage of the respiratory/ADT merged data.
+
+The merged rows are written under ``year=<yyyy>/location_name=<name>/``
+directories, sorted by (hospitalization_id, recorded_dttm) within each file,
+so a single location or year range can be read without touching the rest.
+The sort order is recorded in each file's schema metadata (see
+``merged_sort_order``). Files of different partitions hold rows of the same
+hospitalization, so a read spanning several files is not in that order as
+read; ``read_merged`` restores it by merging the sorted per-file runs.
+"""
+import json
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from .instrument import step
+from .kernels import ffill_sorted, is_sorted_by, merge_sorted_runs
+from .schema import to_pandas
+
+MERGED_DIR = 'respiratory_adt_merged'
+SORT_ORDER = ['hospitalization_id', 'recorded_dttm']
+SORT_METADATA_KEY = b'clif_pipeline.sort_order'
+
+PARTITIONING = ds.partitioning(
+    pa.schema([('year', pa.int32()), ('location_name', pa.string())]),
+    flavor='hive'
+)
+
+
+def fill_mode_category(df: pd.DataFrame) -> pd.Series:
+    """mode_category forward filled within each hospitalization (df sorted by hosp/time)."""
+    return ffill_sorted(df, ['mode_category'])['mode_category']
+
+
+def sort_merged(df_merged: pd.DataFrame) -> pd.DataFrame:
+    """``df_merged`` in ``SORT_ORDER`` with a fresh index; the sort is skipped when already in order."""
+    if is_sorted_by(df_merged, SORT_ORDER):
+        return df_merged.reset_index(drop=True)
+    with step('sort', rows_in=len(df_merged)):
+        return df_merged.sort_values(SORT_ORDER).reset_index(drop=True)
+
+
+def write_merged_dataset(df_merged: pd.DataFrame, root=MERGED_DIR, existing_data_behavior='delete_matching',
+                         basename_template='part-{i}.parquet') -> None:
+    """Write merged rows partitioned by year and location_name.
+
+    Adds ``mode_category_filled`` (mode_category forward filled over the whole
+    hospitalization) so readers can filter on the target modes without losing
+    the fill from rows stored in other partitions; rows that already carry it
+    keep their value. Pass ``existing_data_behavior='overwrite_or_ignore'``
+    with a unique ``basename_template`` to add files without replacing the
+    partitions they land in.
+    """
+    df = sort_merged(df_merged)
+    if 'mode_category_filled' not in df.columns:
+        df['mode_category_filled'] = fill_mode_category(df)
+    df['year'] = df['recorded_dttm'].dt.year.astype('int32')
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), SORT_METADATA_KEY: json.dumps(SORT_ORDER)})
+    with step('write_dataset', rows_in=table.num_rows):
+        ds.write_dataset(
+            table,
+            Path(root),
+            format='parquet',
+            partitioning=PARTITIONING,
+            existing_data_behavior=existing_data_behavior,
+            basename_template=basename_template
+        )
+
+
+def replace_merged_dataset(df_merged: pd.DataFrame, root=MERGED_DIR) -> None:
+    """Remove any existing dataset at ``root`` and write ``df_merged`` in its place."""
+    if Path(root).exists():
+        shutil.rmtree(root)
+    write_merged_dataset(df_merged, root)
+
+
+def merged_filter(locations=None, years=None, modes=None):
+    """Filter expression for a location list, ``(first, last)`` year range and mode list."""
+    expr = None
+    conditions = []
+    if locations is not None:
+        conditions.append(ds.field('location_name').isin(list(locations)))
+    if years is not None:
+        first, last = years
+        conditions.append((ds.field('year') >= first) & (ds.field('year') <= last))
+    if modes is not None:
+        conditions.append(ds.field('mode_category_filled').isin(list(modes)))
+    for cond in conditions:
+        expr = cond if expr is None else expr & cond
+    return expr
+
+
+def _recorded_order(fragments) -> list:
+    orders = {(fragment.physical_schema.metadata or {}).get(SORT_METADATA_KEY) for fragment in fragments}
+    if len(orders) != 1 or None in orders:
+        return []
+    return json.loads(orders.pop())
+
+
+def merged_sort_order(root=MERGED_DIR) -> list:
+    """Columns every file of the merged dataset is sorted by ([] when not recorded)."""
+    return _recorded_order(open_merged_dataset(root).get_fragments())
+
+
+def open_merged_dataset(root=MERGED_DIR) -> ds.Dataset:
+    return ds.dataset(Path(root), format='parquet', partitioning=PARTITIONING)
+
+
+def read_merged(root=MERGED_DIR, locations=None, years=None, modes=None, columns=None,
+                ordered=True) -> pd.DataFrame:
+    """Read part of the merged dataset; only matching partitions are opened.
+
+    When every file read records ``SORT_ORDER`` and its columns are selected,
+    the rows are returned in that order across files (the per-file runs are
+    merged, see ``kernels.merge_sorted_runs``). Pass ``ordered=False`` when
+    the order does not matter.
+
+    Example::
+
+        df = read_merged(locations=['MICU'], years=(2021, 2023))
+    """
+    dataset = open_merged_dataset(root)
+    expr = merged_filter(locations, years, modes)
+    with step('read_merged') as info:
+        table = dataset.to_table(columns=columns, filter=expr)
+        info['rows_out'] = table.num_rows
+    df = to_pandas(table)
+    if not ordered or not set(SORT_ORDER) <= set(df.columns):
+        return df
+    if _recorded_order(dataset.get_fragments(filter=expr)) != SORT_ORDER:
+        return df
+    with step('merge_runs', rows_in=len(df)):
+        return merge_sorted_runs(df, SORT_ORDER)
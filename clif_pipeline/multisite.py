@@ -0,0 +1,175 @@
+"""Run the pipeline for several sites in parallel and pool their aggregates.
+
+A multi-site config lists the sites; top-level keys are shared defaults::
+
+    {
+      "max_memory_gb": 16,
+      "sites": [
+        {"site": "RUSH", "clif2_path": "/data/rush/clif", "filetype": "parquet"},
+        {"site": "UCMC", "clif2_path": "/data/ucmc/clif", "filetype": "parquet", "max_memory_gb": 32}
+      ]
+    }
+
+Each site runs the full runner stage graph in its own worker process and
+directory (``sites/<site>/``), with its address space capped at
+``max_memory_gb`` so one large extract cannot take the machine down. The
+pooled results are built only from the small per-site outputs (yearly mode
+hosp-days, location stats and dose sketches), never from raw data.
+
+Usage::
+
+    python -m clif_pipeline.multisite --config sites.json --workers 4
+"""
+import argparse
+import json
+import os
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from .aggregate import add_percentages
+from .loader import load_config
+from .runner import RECORD_STATS_FILE, SKETCH_FILE, YEARLY_MODES_FILE, run_pipeline
+from .sketch import merge_sketches, sketches_from_frame, sketches_to_frame, summary_from_sketches
+
+SITES_DIR = 'sites'
+POOLED_DIR = 'pooled'
+
+# Soft RLIMIT_AS of this process before any site capped it
+_initial_memory_limit = None
+
+
+def site_configs(config: dict) -> list:
+    """One config per site; a single-site config is returned as is."""
+    if 'sites' not in config:
+        return [config]
+    shared = {k: v for k, v in config.items() if k != 'sites'}
+    sites = [{**shared, **site} for site in config['sites']]
+    names = [site.get('site') for site in sites]
+    if None in names or len(set(names)) != len(names):
+        raise ValueError(f"Every site needs a unique 'site' name, got {names}")
+    return sites
+
+
+def _cap_memory(max_memory_gb) -> None:
+    """Set this process's address space cap, or restore the one it started with when none is given.
+
+    Workers are reused, so a site without a cap must not inherit the cap of
+    the previous site.
+    """
+    global _initial_memory_limit
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if _initial_memory_limit is None:
+        _initial_memory_limit = soft
+    if not max_memory_gb:
+        limit = _initial_memory_limit
+    else:
+        limit = int(max_memory_gb * 1024**3)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+    if limit != soft:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def run_site(config: dict, site_dir, force: bool = False) -> dict:
+    """Run every stage for one site inside ``site_dir`` (called in a worker process).
+
+    ``clif2_path`` and ``site_dir`` must be absolute: workers are reused and
+    keep the directory of the previous site. The memory cap is reset for
+    every site.
+    """
+    Path(site_dir).mkdir(parents=True, exist_ok=True)
+    os.chdir(site_dir)
+    # The cap is inherited by the single stage worker the runner starts
+    _cap_memory(config.get('max_memory_gb'))
+    return run_pipeline(config, force=force, max_workers=1)
+
+
+def run_sites(config: dict, sites_dir=SITES_DIR, max_workers: int = None, force: bool = False) -> dict:
+    """Run all sites concurrently; returns ``{site: stage status dict or error}``."""
+    sites = [{**site, 'clif2_path': str(Path(site['clif2_path']).resolve())} for site in site_configs(config)]
+    results = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            site['site']: pool.submit(run_site, site, Path(sites_dir).resolve() / site['site'], force)
+            for site in sites
+        }
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = {'error': repr(e)}
+            print(f"[{name}] {results[name]}")
+    return results
+
+
+def _read_site_tables(sites_dir, sites, filename) -> pd.DataFrame:
+    frames = []
+    for site in sites:
+        path = Path(sites_dir) / site / filename
+        if path.exists():
+            df = pd.read_parquet(path)
+            df.insert(0, 'site', site)
+            frames.append(df)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def pool_sites(sites, sites_dir=SITES_DIR, out_dir=POOLED_DIR) -> dict:
+    """Combine the per-site aggregates under ``out_dir``; returns the pooled tables.
+
+    * ``site_yearly_modes``: every site's (location, year, mode) hosp-days, with a site column
+    * ``pooled_yearly_modes``: hosp-days and percentages per (year, mode) over all sites
+    * ``site_location_stats``: records and hospitalizations per site and location
+    * ``pooled_dose_summary``: dose summary from the merged per-site sketches
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    pooled = {}
+
+    site_yearly = _read_site_tables(sites_dir, sites, YEARLY_MODES_FILE)
+    pooled['site_yearly_modes'] = site_yearly
+    if len(site_yearly):
+        pooled['pooled_yearly_modes'] = add_percentages(
+            site_yearly.groupby(['year', 'mode_category'], observed=True)['hosp_days'].sum().reset_index()
+        )
+    pooled['site_location_stats'] = _read_site_tables(sites_dir, sites, RECORD_STATS_FILE)
+
+    sketch_dicts = [
+        sketches_from_frame(pd.read_parquet(Path(sites_dir) / site / SKETCH_FILE))
+        for site in sites if (Path(sites_dir) / site / SKETCH_FILE).exists()
+    ]
+    if sketch_dicts:
+        merged = merge_sketches(*sketch_dicts)
+        sketches_to_frame(merged).to_parquet(out_dir / 'pooled_dose_sketches.parquet', index=False)
+        pooled['pooled_dose_summary'] = summary_from_sketches(merged)
+
+    for name, df in pooled.items():
+        df.to_parquet(out_dir / f"{name}.parquet", index=False)
+    return pooled
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run every site in a multi-site config and pool the results.')
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--sites-dir', default=SITES_DIR)
+    parser.add_argument('--out-dir', default=POOLED_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help='rerun stages even when up to date')
+    parser.add_argument('--pool-only', action='store_true', help='only combine existing per-site outputs')
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    sites = [site['site'] for site in site_configs(config)]
+    if not args.pool_only:
+        results = run_sites(config, args.sites_dir, args.workers, args.force)
+        print(json.dumps(results, indent=2))
+    pooled = pool_sites(sites, args.sites_dir, args.out_dir)
+    for name, df in pooled.items():
+        print(f"{name}: {len(df):,} rows")
+    print(f"\nPooled results saved to: {args.out_dir}/")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Plotly figures shared by the notebooks and the headless runner."""
+from pathlib import Path
+
+import plotly.express as px
+import plotly.graph_objects as go
+
+from .instrument import step
+
+MODE_COLORS = {
+    'Assist Control-Volume Control': '#66c266',  # green
+    'Pressure Support/CPAP': '#ffcc00',  # yellow
+    'Pressure-Regulated Volume Control': '#fdc086'  # R color
+}
+
+
+def plot_filename(location: str) -> str:
+    return f"{location.replace('/', '_').replace(' ', '_')}.png"
+
+
+def mode_colors_for(modes, base=MODE_COLORS) -> dict:
+    """Colour per mode: ``base`` colours where defined, the plotly palette for the rest."""
+    palette = [c for c in px.colors.qualitative.Plotly if c not in base.values()]
+    extra = iter(palette * (len(modes) // max(len(palette), 1) + 1))
+    return {mode: base[mode] if mode in base else next(extra) for mode in modes}
+
+
+def mode_year_table(yearly_modes, modes, years, value='percentage', mode_col='mode_category'):
+    """``value`` per mode (rows, in ``modes`` order) and year (columns), 0 where absent."""
+    return (
+        yearly_modes.pivot_table(index=mode_col, columns='year', values=value, aggfunc='sum', observed=True)
+        .reindex(index=list(modes), columns=list(years))
+        .fillna(0)
+    )
+
+
+def location_mode_figure(location: str, yearly_modes, mode_colors=MODE_COLORS, mode_col='mode_category') -> go.Figure:
+    """100% stacked bar chart of dominant-mode percentages per year for one location."""
+    years_list = sorted(yearly_modes['year'].unique())
+    percentages_by_mode = mode_year_table(yearly_modes, mode_colors.keys(), years_list, mode_col=mode_col)
+
+    fig = go.Figure()
+
+    for mode_name, percentages in percentages_by_mode.iterrows():
+        percentages = percentages.tolist()
+
+        # Replace display name for Pressure Support/CPAP
+        display_name = 'Pressure Control' if mode_name == 'Pressure Support/CPAP' else mode_name
+
+        fig.add_trace(go.Bar(
+            name=display_name,
+            x=years_list,
+            y=percentages,
+            text=[f'{p:.1f}%' if p > 0 else '' for p in percentages],
+            textposition='inside',
+            textfont=dict(color='white', size=14, family='Arial Black'),
+            marker_color=mode_colors[mode_name],
+            hovertemplate='%{x}<br>' + display_name + '<br>Percentage: %{text}<extra></extra>'
+        ))
+
+    fig.update_layout(
+        barmode='stack',
+        title=f'Ventilation Mode Distribution - {location}',
+        xaxis_title='Year',
+        yaxis_title='Percentage (%)',
+        yaxis=dict(range=[0, 100]),
+        height=600,
+        showlegend=True,
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=-0.15,
+            xanchor="center",
+            x=0.5
+        ),
+        bargap=0.15
+    )
+    return fig
+
+
+def write_location_plots(yearly_modes_all, plots_folder='plots', mode_colors=MODE_COLORS):
+    """Save one PNG per location of ``yearly_modes_all``.
+
+    Returns ``(figures, files)``, both keyed by location.
+    """
+    plots_folder = Path(plots_folder)
+    plots_folder.mkdir(parents=True, exist_ok=True)
+    figures, files = {}, {}
+    for location, yearly_modes in yearly_modes_all.groupby('location_name', observed=True):
+        fig = location_mode_figure(location, yearly_modes, mode_colors)
+        filename = plot_filename(location)
+        with step('write_image', rows_in=len(yearly_modes)):
+            fig.write_image(str(plots_folder / filename), width=1200, height=800, scale=2)
+        figures[location] = fig
+        files[location] = filename
+    return figures, files
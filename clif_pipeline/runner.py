@@ -0,0 +1,322 @@
+"""Headless runner for the notebook pipeline as a declared stage graph.
+
+Stages (outputs are relative to the working directory):
+
+* ``load``       ADT interval index ``adt_index.parquet``; warms the stage cache
+                 with the projected respiratory and ADT tables
+* ``merge``      partitioned ``respiratory_adt_merged/`` plus incremental state
+* ``aggregate``  ``location_yearly_modes.parquet`` and ``location_record_stats.parquet``
+* ``transitions`` mode_category from -> to counts per location and year ``mode_transitions.parquet``
+* ``exposure``   time-weighted hours per location, day and mode_category ``mode_exposure.parquet``
+* ``cube``       hosp-days per (year, location, mode_category, mode_name) ``mode_cube.parquet``
+* ``plot``       one PNG per location under ``plots/``
+* ``ecdf``       ``med_dose_summary.parquet`` and ``med_dose_ecdf.parquet``
+* ``sketch``     mergeable dose sketches ``med_dose_sketches.parquet``
+
+Stages whose dependencies are done run concurrently in worker processes, so
+``ecdf`` runs alongside the respiratory chain. A stage is skipped when its
+outputs exist and its stamp (input fingerprints, upstream outputs, config and
+package source) matches the last successful run.
+
+The merge and ecdf stages run on the backend named by the config key
+``backend`` (``pandas``, ``polars`` or ``duckdb``; see ``engine``).
+
+Every invocation writes a run report (``run_reports/run-<timestamp>.json`` and
+``.csv``) with wall/CPU time, rows, rows/s and peak memory per stage and per
+instrumented step (see ``instrument``).
+
+Usage::
+
+    python -m clif_pipeline.runner
+    python -m clif_pipeline.runner --stages plot --force
+    python -m clif_pipeline.runner --trace-memory --profile-dir profiles
+"""
+import argparse
+import json
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+
+from .aggregate import TARGET_MODES, location_record_stats, location_yearly_modes
+from .cache import StageCache
+from .ecdf import dose_summary, save_dose_summary
+from .cube import CUBE_FILE, build_site_cube
+from .engine import get_backend
+from .exposure import daily_exposure, exposure_segments, overlapping_segments
+from .incremental import ADT_COLS, RESPIRATORY_COLS, initialize_state
+from .instrument import Recorder
+from .interval_join import ADTIndex, merge_respiratory_adt
+from .loader import load_clif_table, load_config, table_path
+from .merged_store import MERGED_DIR, read_merged, replace_merged_dataset
+from .sketch import sketches_to_frame, stream_dose_sketches
+from .transitions import mode_runs, mode_transitions, transition_matrix
+
+ADT_INDEX_FILE = 'adt_index.parquet'
+YEARLY_MODES_FILE = 'location_yearly_modes.parquet'
+RECORD_STATS_FILE = 'location_record_stats.parquet'
+PLOTS_DIR = 'plots'
+REPORT_DIR = 'run_reports'
+SKETCH_FILE = 'med_dose_sketches.parquet'
+TRANSITIONS_FILE = 'mode_transitions.parquet'
+EXPOSURE_FILE = 'mode_exposure.parquet'
+MEDICATION_COLS = ['med_group', 'med_category', 'med_dose']
+
+
+# Stage bodies (module level so worker processes can import them) return the
+# number of rows they processed. The cache stage names and parameters match
+# the notebooks, so both share entries.
+
+def _load_inputs(config: dict, cache: StageCache):
+    df_respiratory = cache.cached(
+        'respiratory_load',
+        lambda: load_clif_table(config, 'respiratory_support', columns=RESPIRATORY_COLS),
+        inputs=[table_path(config, 'respiratory_support')],
+        params={'columns': RESPIRATORY_COLS}
+    )
+    df_adt = cache.cached(
+        'adt_load',
+        lambda: load_clif_table(config, 'adt', columns=ADT_COLS),
+        inputs=[table_path(config, 'adt')],
+        params={'columns': ADT_COLS}
+    )
+    return df_respiratory, df_adt
+
+
+def run_load(config: dict) -> int:
+    df_respiratory, df_adt = _load_inputs(config, StageCache.from_config(config))
+    ADTIndex(df_adt).save(ADT_INDEX_FILE)
+    return len(df_respiratory) + len(df_adt)
+
+
+def run_merge(config: dict) -> int:
+    cache = StageCache.from_config(config)
+    df_respiratory, df_adt = _load_inputs(config, cache)
+    backend = get_backend(config)
+    if backend.name == 'pandas':
+        adt_index = ADTIndex.load(ADT_INDEX_FILE)
+        compute, params = lambda: merge_respiratory_adt(df_respiratory, adt_index), {}
+    else:
+        compute, params = backend.merged, {'backend': backend.name}
+    df_merged = cache.cached(
+        'respiratory_adt_merge',
+        compute,
+        inputs=[table_path(config, 'respiratory_support'), table_path(config, 'adt')],
+        params={'columns': df_respiratory.columns.tolist(), **params}
+    )
+    replace_merged_dataset(df_merged, MERGED_DIR)
+    initialize_state(df_respiratory, df_adt, df_merged, MERGED_DIR)
+    return len(df_respiratory)
+
+
+def run_aggregate(config: dict) -> int:
+    df_three_modes = read_merged(
+        MERGED_DIR,
+        modes=TARGET_MODES,
+        columns=['hospitalization_id', 'recorded_dttm', 'location_name', 'mode_category_filled', 'year'],
+        ordered=False
+    ).rename(columns={'mode_category_filled': 'mode_category'})
+    location_yearly_modes(df_three_modes).to_parquet(YEARLY_MODES_FILE, index=False)
+    location_record_stats(df_three_modes).to_parquet(RECORD_STATS_FILE, index=False)
+    return len(df_three_modes)
+
+
+def run_transitions(config: dict) -> int:
+    df_merged = read_merged(MERGED_DIR, columns=['hospitalization_id', 'recorded_dttm', 'mode_category', 'location_name'])
+    runs = mode_runs(df_merged, mode_col='mode_category', location_col='location_name')
+    transitions = mode_transitions(runs, mode_col='mode_category')
+    transition_matrix(transitions, by=['location_name', 'year']).to_parquet(TRANSITIONS_FILE, index=False)
+    return len(df_merged)
+
+
+def run_exposure(config: dict) -> int:
+    df_merged = read_merged(
+        MERGED_DIR,
+        columns=['hospitalization_id', 'recorded_dttm', 'mode_category', 'in_dttm', 'out_dttm', 'location_name']
+    )
+    segments = exposure_segments(df_merged)
+    overlapping = overlapping_segments(segments)
+    if overlapping.any():
+        raise ValueError(f"{int(overlapping.sum()):,} exposure segments overlap; hours would be counted twice")
+    daily_exposure(segments).to_parquet(EXPOSURE_FILE, index=False)
+    return len(df_merged)
+
+
+def run_cube(config: dict) -> int:
+    cube = build_site_cube(config, ADTIndex.load(ADT_INDEX_FILE))
+    cube.to_parquet(CUBE_FILE, index=False)
+    return int(cube['hosp_days'].sum())
+
+
+def run_plot(config: dict) -> int:
+    # plotly/kaleido are only imported by the stage that needs them
+    from .plots import write_location_plots
+    yearly_modes_all = pd.read_parquet(YEARLY_MODES_FILE)
+    write_location_plots(yearly_modes_all, PLOTS_DIR)
+    return len(yearly_modes_all)
+
+
+def run_ecdf(config: dict) -> int:
+    backend = get_backend(config)
+    if backend.name != 'pandas':
+        summary, ecdf = backend.dose_summary()
+        save_dose_summary(summary, ecdf, '.')
+        return int(summary['rows'].sum())
+    cache = StageCache.from_config(config)
+    df_meds = cache.cached(
+        'medication_doses',
+        lambda: load_clif_table(config, 'medication_admin_continuous', columns=MEDICATION_COLS),
+        inputs=[table_path(config, 'medication_admin_continuous')]
+    )
+    save_dose_summary(*dose_summary(df_meds), '.')
+    return len(df_meds)
+
+
+def run_sketch(config: dict) -> int:
+    sketches = stream_dose_sketches(config)
+    sketches_to_frame(sketches).to_parquet(SKETCH_FILE, index=False)
+    return sum(s.count for s in sketches.values())
+
+
+@dataclass(frozen=True)
+class Stage:
+    """A pipeline step: the CLIF tables it reads, upstream stages and files it writes."""
+    name: str
+    run: Callable[[dict], int]
+    deps: tuple = ()
+    tables: tuple = ()
+    outputs: tuple = ()
+
+
+STAGES = {stage.name: stage for stage in [
+    Stage('load', run_load, tables=('respiratory_support', 'adt'), outputs=(ADT_INDEX_FILE,)),
+    Stage('merge', run_merge, deps=('load',), tables=('respiratory_support', 'adt'), outputs=(MERGED_DIR,)),
+    Stage('aggregate', run_aggregate, deps=('merge',), outputs=(YEARLY_MODES_FILE, RECORD_STATS_FILE)),
+    Stage('transitions', run_transitions, deps=('merge',), outputs=(TRANSITIONS_FILE,)),
+    Stage('exposure', run_exposure, deps=('merge',), outputs=(EXPOSURE_FILE,)),
+    Stage('cube', run_cube, deps=('load',), tables=('respiratory_support', 'adt'), outputs=(CUBE_FILE,)),
+    Stage('plot', run_plot, deps=('aggregate',), outputs=(PLOTS_DIR,)),
+    Stage('ecdf', run_ecdf, tables=('medication_admin_continuous',),
+          outputs=('med_dose_summary.parquet', 'med_dose_ecdf.parquet')),
+    Stage('sketch', run_sketch, tables=('medication_admin_continuous',), outputs=(SKETCH_FILE,)),
+]}
+
+
+def with_upstream(names) -> list:
+    """``names`` plus every stage they depend on, in declaration order."""
+    needed, todo = set(), list(names)
+    while todo:
+        name = todo.pop()
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage: {name}")
+        if name not in needed:
+            needed.add(name)
+            todo.extend(STAGES[name].deps)
+    return [name for name in STAGES if name in needed]
+
+
+def _stamp_path(cache: StageCache, name: str) -> Path:
+    return cache.cache_dir / 'stamps' / f"{name}.json"
+
+
+def stage_key(stage: Stage, config: dict, cache: StageCache) -> str:
+    inputs = [table_path(config, table) for table in stage.tables]
+    inputs += [output for dep in stage.deps for output in STAGES[dep].outputs]
+    params = {k: config.get(k) for k in ('site', 'clif2_path', 'filetype', 'backend')}
+    return cache.key(stage.name, inputs, params)
+
+
+def is_up_to_date(stage: Stage, config: dict, cache: StageCache) -> bool:
+    stamp = _stamp_path(cache, stage.name)
+    if not stamp.exists() or not all(Path(p).exists() for p in stage.outputs):
+        return False
+    return json.loads(stamp.read_text()).get('key') == stage_key(stage, config, cache)
+
+
+def _write_stamp(stage: Stage, config: dict, cache: StageCache) -> None:
+    stamp = _stamp_path(cache, stage.name)
+    stamp.parent.mkdir(parents=True, exist_ok=True)
+    stamp.write_text(json.dumps({'key': stage_key(stage, config, cache)}))
+
+
+def _execute(name: str, config: dict, trace_memory: bool, profile_dir) -> list:
+    """Run one stage in a worker under a recorder; returns its records."""
+    recorder = Recorder(name, trace_memory, profile_dir)
+    with recorder.activate(), recorder.stage(name) as info:
+        info['rows_in'] = STAGES[name].run(config)
+    return recorder.records
+
+
+def run_pipeline(config: dict, stages=None, force: bool = False, max_workers: int = None,
+                 report=None, trace_memory: bool = False, profile_dir=None) -> dict:
+    """Run ``stages`` (default all) and their upstream stages.
+
+    Writes the run report to ``report`` (default
+    ``run_reports/run-<timestamp>``). Returns ``{stage: 'ran' | 'skipped' |
+    'failed' | 'blocked'}``.
+    """
+    cache = StageCache.from_config(config)
+    pending = with_upstream(stages or list(STAGES))
+    status, running = {}, {}
+    recorder = Recorder('pipeline')
+    report = report or Path(REPORT_DIR) / f"run-{datetime.now():%Y%m%d-%H%M%S}"
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for name in list(pending):
+                stage = STAGES[name]
+                if any(status.get(dep) in ('failed', 'blocked') for dep in stage.deps):
+                    status[name] = 'blocked'
+                    pending.remove(name)
+                elif all(status.get(dep) in ('ran', 'skipped') for dep in stage.deps):
+                    pending.remove(name)
+                    if not force and is_up_to_date(stage, config, cache):
+                        status[name] = 'skipped'
+                        print(f"[{name}] up to date, skipped")
+                    else:
+                        print(f"[{name}] started")
+                        running[pool.submit(_execute, name, config, trace_memory, profile_dir)] = name
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    recorder.records += future.result()
+                except Exception as e:
+                    status[name] = 'failed'
+                    print(f"[{name}] failed: {e!r}")
+                else:
+                    status[name] = 'ran'
+                    _write_stamp(STAGES[name], config, cache)
+                    print(f"[{name}] done in {recorder.records[-1]['wall_s']:.1f}s")
+
+    recorder.write(report, extra={'site': config.get('site'), 'status': status})
+    print(f"Run report saved to: {report}.json")
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the respiratory/medication pipeline without the notebooks.')
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=None,
+                        help='stages to run (their upstream stages are included)')
+    parser.add_argument('--force', action='store_true', help='rerun stages even when up to date')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--report', default=None, help='run report path without extension')
+    parser.add_argument('--trace-memory', action='store_true', help='also record tracemalloc peaks (slower)')
+    parser.add_argument('--profile-dir', default=None, help='write a cProfile .prof file per stage here')
+    args = parser.parse_args()
+
+    status = run_pipeline(load_config(args.config), args.stages, args.force, args.workers,
+                          args.report, args.trace_memory, args.profile_dir)
+    print(json.dumps(status, indent=2))
+    if any(s in ('failed', 'blocked') for s in status.values()):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Typed Arrow schemas for the CLIF tables used in this repo.
+
+Low-cardinality strings are dictionary encoded (pandas categoricals) and
+``*_dttm`` columns are native timestamps, cast once when the table is scanned
+so the notebooks never call ``pd.to_datetime`` again.
+"""
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+TIMESTAMP = pa.timestamp('us')
+
+CLIF_SCHEMAS = {
+    'respiratory_support': pa.schema([
+        ('hospitalization_id', CATEGORY),
+        ('recorded_dttm', TIMESTAMP),
+        ('device_name', CATEGORY),
+        ('device_category', CATEGORY),
+        ('mode_name', CATEGORY),
+        ('mode_category', CATEGORY),
+        ('fio2_set', pa.float64()),
+        ('lpm_set', pa.float64()),
+        ('tidal_volume_set', pa.float64()),
+        ('resp_rate_set', pa.float64()),
+        ('pressure_control_set', pa.float64()),
+        ('pressure_support_set', pa.float64()),
+        ('flow_rate_set', pa.float64()),
+        ('peak_inspiratory_pressure_set', pa.float64()),
+        ('inspiratory_time_set', pa.float64()),
+        ('peep_set', pa.float64()),
+        ('tidal_volume_obs', pa.float64()),
+        ('resp_rate_obs', pa.float64()),
+        ('plateau_pressure_obs', pa.float64()),
+        ('peak_inspiratory_pressure_obs', pa.float64()),
+        ('peep_obs', pa.float64()),
+        ('minute_vent_obs', pa.float64()),
+        ('mean_airway_pressure_obs', pa.float64()),
+    ]),
+    'adt': pa.schema([
+        ('hospitalization_id', CATEGORY),
+        ('hospital_id', CATEGORY),
+        ('in_dttm', TIMESTAMP),
+        ('out_dttm', TIMESTAMP),
+        ('location_name', CATEGORY),
+        ('location_category', CATEGORY),
+        ('location_type', CATEGORY),
+    ]),
+    'medication_admin_continuous': pa.schema([
+        ('hospitalization_id', CATEGORY),
+        ('med_order_id', pa.string()),
+        ('admin_dttm', TIMESTAMP),
+        ('med_name', CATEGORY),
+        ('med_category', CATEGORY),
+        ('med_group', CATEGORY),
+        ('med_route_name', CATEGORY),
+        ('med_route_category', CATEGORY),
+        ('med_dose', pa.float64()),
+        ('med_dose_unit', CATEGORY),
+        ('mar_action_name', CATEGORY),
+        ('mar_action_category', CATEGORY),
+    ]),
+}
+
+
+def _cast_column(values, target: pa.DataType, name: str):
+    source = values.type
+    try:
+        if pa.types.is_dictionary(target):
+            if pa.types.is_dictionary(source):
+                return values
+            return pc.dictionary_encode(pc.cast(values, pa.string()))
+        if pa.types.is_timestamp(target) and pa.types.is_timestamp(source):
+            # Keep the stored unit and time zone
+            return values
+        if source == target:
+            return values
+        return pc.cast(values, target)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        raise ValueError(f"Column '{name}': cannot cast {source} to {target}: {e}") from e
+
+
+def cast_to_schema(data, table: str):
+    """Cast the columns of a RecordBatch or Table to the CLIF schema of ``table``.
+
+    Columns that are not in the schema are passed through unchanged. Raises
+    ``ValueError`` naming the column when a value cannot be cast.
+    """
+    schema = CLIF_SCHEMAS.get(table)
+    if schema is None:
+        return data
+    arrays = []
+    for name, values in zip(data.column_names, data.columns):
+        index = schema.get_field_index(name)
+        arrays.append(values if index < 0 else _cast_column(values, schema.field(index).type, name))
+    return type(data).from_arrays(arrays, names=data.column_names)
+
+
+def to_pandas(table: pa.Table) -> pd.DataFrame:
+    """Convert an Arrow table to pandas, keeping dictionary columns as categoricals.
+
+    Categories are put in sorted order so sorting and tie-breaking on a
+    categorical column match the plain string column.
+    """
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            categories = df[col].cat.categories
+            if not categories.is_monotonic_increasing:
+                df[col] = df[col].cat.reorder_categories(categories.sort_values())
+    return df
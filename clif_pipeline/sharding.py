@@ -0,0 +1,204 @@
+"""Sharded, out-of-core execution keyed on hospitalization_id.
+
+Every analysis in this repo is per hospitalization, so the respiratory, ADT
+and medication tables are split into N on-disk shards by the global int32
+``hosp_code`` of hospitalization_id (see ``hosp_ids``) and each shard is
+processed independently in a process pool. Peak memory is bounded by the
+largest shard instead of the full extract.
+Each shard also gets its vasoactive doses as-of aligned onto the merged
+respiratory rows (see ``asof``).
+
+Usage::
+
+    python -m clif_pipeline.sharding --shards 16 --workers 8
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .aggregate import (
+    TARGET_MODES,
+    add_percentages,
+    location_record_stats,
+    location_yearly_modes,
+    prepare_merged,
+)
+from .asof import DEFAULT_TOLERANCE_HOURS, asof_doses
+from .hosp_ids import HOSP_CODE
+from .interval_join import merge_respiratory_adt
+from .loader import clif_dataset, hospitalization_ids, iter_clif_batches, load_config
+from .schema import cast_to_schema, to_pandas
+
+SHARD_COLUMNS = {
+    'respiratory_support': ['hospitalization_id', 'recorded_dttm', 'mode_category'],
+    'adt': ['hospitalization_id', 'in_dttm', 'out_dttm', 'location_name'],
+    'medication_admin_continuous': ['hospitalization_id', 'admin_dttm', 'med_group', 'med_category', 'med_dose'],
+}
+VASOACTIVE_GROUP = 'vasoactives'
+
+
+def shard_of(hosp_codes, n_shards: int) -> np.ndarray:
+    """Shard number of each global ``hosp_code``; codes are dense, so shards get equal numbers of ids."""
+    return np.asarray(hosp_codes, dtype=np.int64) % n_shards
+
+
+def shard_file(shard_dir, table: str, shard: int) -> Path:
+    return Path(shard_dir) / table / f"shard-{shard:04d}.parquet"
+
+
+def write_shards(config: dict, shard_dir, n_shards: int, batch_size: int = 1_000_000) -> None:
+    """Split each CLIF table into ``n_shards`` parquet files, one record batch at a time.
+
+    Each shard row carries its ``hosp_code``, so the per-shard joins run on
+    integer codes.
+    """
+    ids = hospitalization_ids(config)
+    for table, columns in SHARD_COLUMNS.items():
+        dataset = clif_dataset(config, table)
+        schema = cast_to_schema(dataset.schema.empty_table().select(columns), table).schema
+        schema = schema.insert(1, pa.field(HOSP_CODE, pa.int32()))
+        (Path(shard_dir) / table).mkdir(parents=True, exist_ok=True)
+        writers = [pq.ParquetWriter(shard_file(shard_dir, table, k), schema) for k in range(n_shards)]
+        try:
+            for batch in iter_clif_batches(config, table, columns=columns, batch_size=batch_size):
+                hosp_codes = ids.encode(batch.column('hospitalization_id').to_pandas())
+                batch = pa.RecordBatch.from_arrays(
+                    [batch.column(0), pa.array(hosp_codes), *batch.columns[1:]], schema=schema
+                )
+                shards = shard_of(hosp_codes, n_shards)
+                order = np.argsort(shards, kind='stable')
+                bounds = np.searchsorted(shards[order], np.arange(n_shards + 1))
+                for k in range(n_shards):
+                    if bounds[k + 1] > bounds[k]:
+                        writers[k].write_batch(batch.take(order[bounds[k]:bounds[k + 1]]))
+        finally:
+            for writer in writers:
+                writer.close()
+
+
+def dose_categories(shard_dir, med_group: str = VASOACTIVE_GROUP) -> list:
+    """Sorted med_category values of ``med_group`` over every medication shard."""
+    table = pq.read_table(Path(shard_dir) / 'medication_admin_continuous', columns=['med_category'],
+                          filters=[('med_group', '==', med_group)])
+    return sorted(value for value in table.column('med_category').unique().to_pylist() if value is not None)
+
+
+def process_shard(shard_dir, shard: int, target_modes=TARGET_MODES, dose_columns=None,
+                  tolerance_hours=DEFAULT_TOLERANCE_HOURS) -> dict:
+    """Run the merge, dose alignment and per-location aggregation for one shard.
+
+    Writes the merged rows, and the merged rows with the vasoactive dose
+    running at each record (``shard_dir/respiratory_vasoactives``, one column
+    per ``dose_columns`` category), next to the shard and returns the small
+    partial results to be combined by ``combine_partials``.
+    """
+    df_respiratory = to_pandas(pq.read_table(shard_file(shard_dir, 'respiratory_support', shard)))
+    df_adt = to_pandas(pq.read_table(shard_file(shard_dir, 'adt', shard)))
+
+    df_merged = merge_respiratory_adt(df_respiratory, df_adt)
+    merged_file = shard_file(shard_dir, 'merged', shard)
+    merged_file.parent.mkdir(parents=True, exist_ok=True)
+    df_merged.to_parquet(merged_file, index=False)
+
+    df_three_modes = prepare_merged(df_merged, target_modes)
+    yearly_modes = location_yearly_modes(df_three_modes)
+    location_years = yearly_modes[['location_name', 'year']].drop_duplicates()
+
+    df_med = to_pandas(pq.read_table(shard_file(shard_dir, 'medication_admin_continuous', shard)))
+    df_vaso = df_med[df_med['med_group'] == VASOACTIVE_GROUP]
+    df_aligned = asof_doses(df_merged, df_vaso, categories=dose_columns, tolerance_hours=tolerance_hours)
+    aligned_file = shard_file(shard_dir, 'respiratory_vasoactives', shard)
+    aligned_file.parent.mkdir(parents=True, exist_ok=True)
+    df_aligned.to_parquet(aligned_file, index=False)
+
+    med_counts = df_med.groupby(['med_group', 'med_category'], observed=True).size().reset_index(name='count')
+
+    return {
+        'merged_rows': len(df_merged),
+        'yearly_modes': yearly_modes[['location_name', 'year', 'mode_category', 'hosp_days']],
+        'location_stats': location_record_stats(df_three_modes),
+        'location_years': location_years,
+        'med_counts': med_counts,
+    }
+
+
+def combine_partials(partials) -> dict:
+    """Merge per-shard partial results.
+
+    Shards hold disjoint hospitalizations, so counts and unique
+    hospitalizations add up exactly across shards.
+    """
+    partials = list(partials)
+    yearly_modes = (
+        pd.concat([p['yearly_modes'] for p in partials])
+        .groupby(['location_name', 'year', 'mode_category'], observed=True)['hosp_days'].sum()
+        .reset_index()
+    )
+    location_stats = (
+        pd.concat([p['location_stats'] for p in partials])
+        .groupby('location_name', observed=True)[['records', 'hospitalizations']].sum()
+    )
+    years = (
+        pd.concat([p['location_years'] for p in partials])
+        .drop_duplicates().groupby('location_name', observed=True).size()
+    )
+    location_stats['years'] = years.reindex(location_stats.index).fillna(0).astype(int)
+    med_counts = (
+        pd.concat([p['med_counts'] for p in partials])
+        .groupby(['med_group', 'med_category'], observed=True)['count'].sum()
+        .reset_index()
+    )
+    return {
+        'merged_rows': sum(p['merged_rows'] for p in partials),
+        'yearly_modes': add_percentages(yearly_modes),
+        'location_stats': location_stats.reset_index(),
+        'med_counts': med_counts,
+    }
+
+
+def run_sharded(config: dict, shard_dir, n_shards: int = 16, n_workers=None,
+                target_modes=TARGET_MODES, tolerance_hours=DEFAULT_TOLERANCE_HOURS) -> dict:
+    """Shard the CLIF tables and process the shards in a process pool.
+
+    Merged rows are left in ``shard_dir/merged`` and merged rows with their
+    vasoactive doses in ``shard_dir/respiratory_vasoactives``, as one parquet
+    file per shard.
+    """
+    write_shards(config, shard_dir, n_shards)
+    dose_columns = dose_categories(shard_dir)
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        partials = pool.map(process_shard, [shard_dir] * n_shards, range(n_shards), [target_modes] * n_shards,
+                            [dose_columns] * n_shards, [tolerance_hours] * n_shards)
+        results = combine_partials(partials)
+    results['merged_dir'] = Path(shard_dir) / 'merged'
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the respiratory/ADT pipeline on hash shards.')
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--shard-dir', default='shards')
+    parser.add_argument('--shards', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--tolerance-hours', type=float, default=DEFAULT_TOLERANCE_HOURS,
+                        help='Oldest vasoactive dose still attached to a respiratory record')
+    args = parser.parse_args()
+
+    results = run_sharded(load_config(args.config), args.shard_dir, args.shards, args.workers,
+                          tolerance_hours=args.tolerance_hours)
+    print(f"Merged {results['merged_rows']:,} rows into {results['merged_dir']}")
+    print("\nYearly dominant modes by location:")
+    print(results['yearly_modes'].to_string(index=False))
+    print("\nLocation statistics:")
+    print(results['location_stats'].to_string(index=False))
+    for name in ['yearly_modes', 'location_stats', 'med_counts']:
+        results[name].to_parquet(Path(args.shard_dir) / f"{name}.parquet", index=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+"""Streaming, mergeable quantile sketches for medication dose distributions.
+
+``stream_dose_sketches`` reads the medication table one record batch at a
+time and keeps a KLL sketch per (med_group, med_category), so dose profiles
+can be built for tables larger than memory. Sketches from different shards
+or sites can be merged and stored as a small Parquet table.
+
+Usage::
+
+    python -m clif_pipeline.sketch --out med_dose_sketches.parquet
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .loader import iter_clif_batches, load_config
+
+SKETCH_KEYS = ['med_group', 'med_category']
+
+
+class KLLSketch:
+    """KLL quantile sketch with exact count, min, max and mean.
+
+    Level ``h`` holds items of weight ``2**h``; a level that outgrows its
+    capacity is sorted and every other item (random offset) is promoted to
+    the next level. Rank error is about ``1.7 / k`` of the count.
+    """
+
+    def __init__(self, k: int = 200, seed=None):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.total = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # An odd item out stays at this level
+                keep = items[len(items) - len(items) % 2:]
+                items = items[:len(items) - len(items) % 2]
+                promoted = items[self._rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def update(self, values) -> None:
+        """Add a batch of values (NaNs are ignored)."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other: 'KLLSketch') -> None:
+        """Fold another sketch into this one."""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+
+    def _weighted(self):
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** h, dtype=np.int64) for h, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        return values[order], np.cumsum(weights[order])
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else np.nan
+
+    def quantiles(self, qs) -> np.ndarray:
+        """Approximate quantiles for ``qs`` in [0, 1]; 0 and 1 give the exact min/max."""
+        return self.at_ranks(np.asarray(qs, dtype=np.float64) * max(self.count - 1, 0))
+
+    def at_ranks(self, ranks) -> np.ndarray:
+        """Value at each 0-based rank of the sorted data."""
+        ranks = np.asarray(ranks, dtype=np.float64)
+        if not self.count:
+            return np.full(ranks.shape, np.nan)
+        values, cum = self._weighted()
+        # Rescale so the sketch weights add up to the exact count
+        cum = cum * (self.count / cum[-1])
+        pos = np.clip(np.searchsorted(cum, ranks + 1, side='left'), 0, len(values) - 1)
+        result = values[pos]
+        result = np.where(ranks <= 0, self.min, result)
+        return np.where(ranks >= self.count - 1, self.max, result)
+
+    def rank(self, x, inclusive: bool = True) -> np.ndarray:
+        """Approximate number of values ``<= x`` (or ``< x`` when not inclusive)."""
+        x = np.asarray(x, dtype=np.float64)
+        if not self.count:
+            return np.zeros(x.shape)
+        values, cum = self._weighted()
+        cum = np.r_[0, cum * (self.count / cum[-1])]
+        return cum[np.searchsorted(values, x, side='right' if inclusive else 'left')]
+
+    def to_frame(self) -> pd.DataFrame:
+        """Items and levels as a frame (exact stats go in ``sketches_to_frame``)."""
+        return pd.DataFrame({
+            'level': np.concatenate([np.full(len(items), h, dtype=np.int16) for h, items in enumerate(self.levels)]),
+            'value': np.concatenate(self.levels),
+        })
+
+
+def sketches_to_frame(sketches: dict) -> pd.DataFrame:
+    """Flatten ``{(med_group, med_category): KLLSketch}`` into one table for Parquet."""
+    frames = []
+    for (group, category), sketch in sketches.items():
+        items = sketch.to_frame()
+        # Exact stats ride along on a level -1 row
+        stats = pd.DataFrame({'level': [-1], 'value': [np.nan]})
+        df = pd.concat([stats, items], ignore_index=True)
+        df.insert(0, 'med_category', category)
+        df.insert(0, 'med_group', group)
+        df['k'] = sketch.k
+        df['count'] = np.where(df['level'] == -1, sketch.count, 0)
+        df['total'] = np.where(df['level'] == -1, sketch.total, 0.0)
+        df['min'] = np.where(df['level'] == -1, sketch.min, np.nan)
+        df['max'] = np.where(df['level'] == -1, sketch.max, np.nan)
+        frames.append(df)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def sketches_from_frame(df: pd.DataFrame) -> dict:
+    """Inverse of ``sketches_to_frame``."""
+    sketches = {}
+    for (group, category), rows in df.groupby(SKETCH_KEYS, observed=True, sort=False):
+        stats = rows[rows['level'] == -1].iloc[0]
+        items = rows[rows['level'] >= 0]
+        sketch = KLLSketch(k=int(stats['k']))
+        n_levels = int(items['level'].max()) + 1 if len(items) else 1
+        sketch.levels = [items.loc[items['level'] == h, 'value'].to_numpy() for h in range(n_levels)]
+        sketch.count = int(stats['count'])
+        sketch.total = float(stats['total'])
+        sketch.min = float(stats['min'])
+        sketch.max = float(stats['max'])
+        sketches[(group, category)] = sketch
+    return sketches
+
+
+def merge_sketches(*sketch_dicts) -> dict:
+    """Merge several ``{key: KLLSketch}`` dicts (e.g. from shards or sites)."""
+    merged = {}
+    for sketches in sketch_dicts:
+        for key, sketch in sketches.items():
+            if key not in merged:
+                merged[key] = KLLSketch(k=sketch.k)
+            merged[key].merge(sketch)
+    return merged
+
+
+def update_sketches(sketches: dict, df: pd.DataFrame, k: int = 200) -> dict:
+    """Add the doses of one batch to the per-(med_group, med_category) sketches."""
+    df = df.dropna(subset=['med_dose'])
+    for key, doses in df.groupby(SKETCH_KEYS, observed=True, sort=False)['med_dose']:
+        if key not in sketches:
+            sketches[key] = KLLSketch(k=k)
+        sketches[key].update(doses.to_numpy())
+    return sketches
+
+
+def stream_dose_sketches(config: dict, filters=None, batch_size: int = 1_000_000, k: int = 200) -> dict:
+    """Build dose sketches over the medication table without loading it whole."""
+    sketches = {}
+    batches = iter_clif_batches(config, 'medication_admin_continuous', columns=SKETCH_KEYS + ['med_dose'],
+                                filters=filters, typed=False, batch_size=batch_size)
+    for batch in batches:
+        update_sketches(sketches, pa.Table.from_batches([batch]).to_pandas(), k)
+    return sketches
+
+
+def summary_from_sketches(sketches: dict, iqr_factor: float = 3) -> pd.DataFrame:
+    """Count, min/max, mean, median, p95 and IQR outlier bounds per category."""
+    rows = []
+    for (group, category), sketch in sketches.items():
+        q1, median, q3, p95 = sketch.quantiles([0.25, 0.5, 0.75, 0.95])
+        iqr = q3 - q1
+        rows.append({
+            'med_group': group, 'med_category': category, 'count': sketch.count,
+            'min': sketch.min, 'max': sketch.max, 'mean': sketch.mean, 'median': median, 'p95': p95,
+            'q1': q1, 'q3': q3, 'lower_bound': q1 - iqr_factor * iqr, 'upper_bound': q3 + iqr_factor * iqr,
+        })
+    return pd.DataFrame(rows)
+
+
+def ecdf_from_sketches(sketches: dict, n_points: int = 500, iqr_factor: float = 3) -> pd.DataFrame:
+    """Downsampled ECDF of the IQR-filtered doses, as plotted in medication_ecdf.py.
+
+    Point ``i`` is the dose at sorted position ``floor(i * (m - 1) / (n - 1))``
+    of the ``m`` doses inside the IQR bounds, with ``ecdf = (i + 1) / n``.
+    """
+    frames = []
+    summary = summary_from_sketches(sketches, iqr_factor)
+    for row in summary.itertuples(index=False):
+        sketch = sketches[(row.med_group, row.med_category)]
+        first = sketch.rank(row.lower_bound, inclusive=False)
+        m = int(round(sketch.rank(row.upper_bound) - first))
+        if m <= 0:
+            continue
+        n = min(m, n_points)
+        idx = np.linspace(0, m - 1, n, dtype=int)
+        frames.append(pd.DataFrame({
+            'med_group': row.med_group,
+            'med_category': row.med_category,
+            'med_dose': sketch.at_ranks(first + idx),
+            'ecdf': np.arange(1, n + 1) / n,
+        }))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+        columns=['med_group', 'med_category', 'med_dose', 'ecdf'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sketch medication dose distributions batch by batch.')
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--med-group', default=None, help='only sketch this med_group')
+    parser.add_argument('--out', default='med_dose_sketches.parquet')
+    parser.add_argument('-k', type=int, default=200)
+    args = parser.parse_args()
+
+    filters = {'med_group': args.med_group} if args.med_group else None
+    sketches = stream_dose_sketches(load_config(args.config), filters=filters, k=args.k)
+    sketches_to_frame(sketches).to_parquet(args.out, index=False)
+    print(summary_from_sketches(sketches).to_string(index=False))
+    print(f"\nSketches saved to: {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Deterministic synthetic CLIF tables for development and benchmarks.
+
+Writes ``clif_respiratory_support``, ``clif_adt`` and
+``clif_medication_admin_continuous`` files shaped like a real extract: each
+hospitalization has a chain of ADT transfers (a fraction of which overlap the
+previous stay segment), respiratory records whose mode persists in runs with
+some missing ``mode_category`` values, and continuous medication doses. The
+same parameters and seed always give the same files.
+
+Usage::
+
+    python -m clif_pipeline.synthetic --out synthetic_clif --hospitalizations 10000
+"""
+import argparse
+import json
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .loader import TABLE_FILES
+
+LOCATIONS = ['MICU', 'SICU', 'CVICU', 'NICU', 'ED', 'Ward 5 East', 'Ward 7 West', 'Step Down']
+LOCATION_WEIGHTS = [0.22, 0.16, 0.12, 0.05, 0.15, 0.12, 0.1, 0.08]
+
+MODES = {
+    'Assist Control-Volume Control': 'AC/VC',
+    'Pressure Support/CPAP': 'PS/CPAP',
+    'Pressure-Regulated Volume Control': 'PRVC',
+    'SIMV': 'SIMV',
+    'Pressure Control': 'PC',
+    'Volume Support': 'VS',
+    'Blow by': 'Blow by',
+    'Other': 'Other',
+}
+MODE_WEIGHTS = [0.3, 0.25, 0.2, 0.06, 0.06, 0.05, 0.04, 0.04]
+
+MEDICATIONS = {
+    'vasoactives': {'norepinephrine': 0.08, 'vasopressin': 0.03, 'epinephrine': 0.05,
+                    'phenylephrine': 0.8, 'dopamine': 5.0, 'dobutamine': 4.0},
+    'sedation': {'propofol': 30.0, 'dexmedetomidine': 0.6, 'midazolam': 3.0, 'fentanyl': 75.0},
+    'paralytics': {'cisatracurium': 2.0, 'vecuronium': 1.0},
+}
+
+
+@dataclass
+class SyntheticSpec:
+    """Size and shape of a synthetic extract (counts are per-stay means)."""
+    hospitalizations: int = 1000
+    records_per_stay: float = 60
+    transfers_per_stay: float = 3
+    meds_per_stay: float = 25
+    overlap_rate: float = 0.05
+    missing_mode_rate: float = 0.1
+    start: str = '2018-01-01'
+    end: str = '2024-12-31'
+    seed: int = 0
+
+    def scaled(self, factor: float) -> 'SyntheticSpec':
+        return SyntheticSpec(**{**asdict(self), 'hospitalizations': int(round(self.hospitalizations * factor))})
+
+
+def _stay_index(counts):
+    """Owner stay and position within the stay for ``counts.sum()`` rows."""
+    owner = np.repeat(np.arange(len(counts)), counts)
+    position = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, position
+
+
+def _uniform_times(rng, owner, admit, discharge):
+    span = (discharge - admit)[owner]
+    return admit[owner] + (rng.random(len(owner)) * span).astype(np.int64)
+
+
+def generate_tables(spec: SyntheticSpec) -> dict:
+    """Synthetic ``{table: DataFrame}`` for the three CLIF tables."""
+    rng = np.random.default_rng(spec.seed)
+    n = spec.hospitalizations
+    hosp_ids = np.array([f"H{i:08d}" for i in range(n)], dtype=object)
+    us_per_hour = 3_600 * 10**6
+    start = pd.Timestamp(spec.start).value // 1000
+    end = pd.Timestamp(spec.end).value // 1000
+
+    # ADT: a chain of transfers per stay, some starting before the last one ends
+    n_adt = 1 + rng.poisson(max(spec.transfers_per_stay - 1, 0), n)
+    adt_owner, adt_pos = _stay_index(n_adt)
+    duration = (rng.exponential(36, len(adt_owner)) * us_per_hour).astype(np.int64) + us_per_hour
+    admit = start + (rng.random(n) * (end - start)).astype(np.int64)
+    stay_start = np.repeat(np.cumsum(n_adt) - n_adt, n_adt)
+    out_offset = np.cumsum(duration) - np.r_[0, np.cumsum(duration)][stay_start]
+    out_dttm = admit[adt_owner] + out_offset
+    in_dttm = out_dttm - duration
+    overlap = (adt_pos > 0) & (rng.random(len(adt_owner)) < spec.overlap_rate)
+    in_dttm[overlap] -= (rng.random(overlap.sum()) * 6 * us_per_hour).astype(np.int64)
+    discharge = admit + np.add.reduceat(duration, np.cumsum(n_adt) - n_adt)
+    adt = pd.DataFrame({
+        'hospitalization_id': hosp_ids[adt_owner],
+        'in_dttm': in_dttm.astype('datetime64[us]'),
+        'out_dttm': out_dttm.astype('datetime64[us]'),
+        'location_name': rng.choice(LOCATIONS, len(adt_owner), p=LOCATION_WEIGHTS),
+    })
+
+    # Respiratory support: modes persist in runs, some categories are missing
+    n_resp = rng.poisson(spec.records_per_stay, n)
+    resp_owner, resp_pos = _stay_index(n_resp)
+    recorded = _uniform_times(rng, resp_owner, admit, discharge)
+    recorded = recorded[np.lexsort((recorded, resp_owner))]
+    mode_names = np.array(list(MODES), dtype=object)
+    drawn = rng.choice(len(mode_names), len(resp_owner), p=MODE_WEIGHTS)
+    switch = (resp_pos == 0) | (rng.random(len(resp_owner)) < 0.15)
+    mode = drawn[np.maximum.accumulate(np.where(switch, np.arange(len(resp_owner)), 0))]
+    mode_category = mode_names[mode]
+    mode_category[rng.random(len(resp_owner)) < spec.missing_mode_rate] = None
+    respiratory = pd.DataFrame({
+        'hospitalization_id': hosp_ids[resp_owner],
+        'recorded_dttm': recorded.astype('datetime64[us]'),
+        'device_category': np.where(mode_names[mode] == 'Blow by', 'Nasal Cannula', 'IMV'),
+        'mode_name': np.array([MODES.get(m) for m in mode_category], dtype=object),
+        'mode_category': mode_category,
+        'fio2_set': np.round(rng.uniform(0.21, 1.0, len(resp_owner)), 2),
+        'peep_set': rng.choice([5.0, 8.0, 10.0, 12.0], len(resp_owner)),
+    })
+
+    # Continuous medications: gamma-distributed doses around a typical value
+    categories = [(group, cat, dose) for group, cats in MEDICATIONS.items() for cat, dose in cats.items()]
+    n_med = rng.poisson(spec.meds_per_stay, n)
+    med_owner, _ = _stay_index(n_med)
+    pick = rng.integers(len(categories), size=len(med_owner))
+    typical = np.array([c[2] for c in categories])[pick]
+    med_dose = rng.gamma(2.0, 0.5, len(med_owner)) * typical
+    med_dose[rng.random(len(med_owner)) < 0.02] = np.nan
+    medication = pd.DataFrame({
+        'hospitalization_id': hosp_ids[med_owner],
+        'admin_dttm': _uniform_times(rng, med_owner, admit, discharge).astype('datetime64[us]'),
+        'med_group': np.array([c[0] for c in categories], dtype=object)[pick],
+        'med_category': np.array([c[1] for c in categories], dtype=object)[pick],
+        'med_dose': med_dose,
+    })
+    return {'respiratory_support': respiratory, 'adt': adt, 'medication_admin_continuous': medication}
+
+
+def write_synthetic(out_dir, spec: SyntheticSpec = None, filetype: str = 'parquet', site: str = 'SYNTHETIC') -> dict:
+    """Write the synthetic tables plus a ``config.json`` into ``out_dir``; returns the config."""
+    spec = spec or SyntheticSpec()
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for table, df in generate_tables(spec).items():
+        path = out_dir / f"{TABLE_FILES[table]}.{filetype}"
+        if filetype == 'csv':
+            df.to_csv(path, index=False)
+        else:
+            df.to_parquet(path, index=False, row_group_size=1_000_000)
+    config = {'site': site, 'clif2_path': str(out_dir), 'filetype': filetype, 'synthetic': asdict(spec)}
+    with open(out_dir / 'config.json', 'w') as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write deterministic synthetic CLIF tables.')
+    parser.add_argument('--out', default='synthetic_clif')
+    parser.add_argument('--hospitalizations', type=int, default=SyntheticSpec.hospitalizations)
+    parser.add_argument('--records-per-stay', type=float, default=SyntheticSpec.records_per_stay)
+    parser.add_argument('--transfers-per-stay', type=float, default=SyntheticSpec.transfers_per_stay)
+    parser.add_argument('--meds-per-stay', type=float, default=SyntheticSpec.meds_per_stay)
+    parser.add_argument('--overlap-rate', type=float, default=SyntheticSpec.overlap_rate)
+    parser.add_argument('--start', default=SyntheticSpec.start)
+    parser.add_argument('--end', default=SyntheticSpec.end)
+    parser.add_argument('--seed', type=int, default=SyntheticSpec.seed)
+    parser.add_argument('--filetype', choices=['parquet', 'csv'], default='parquet')
+    args = parser.parse_args()
+
+    spec = SyntheticSpec(
+        hospitalizations=args.hospitalizations,
+        records_per_stay=args.records_per_stay,
+        transfers_per_stay=args.transfers_per_stay,
+        meds_per_stay=args.meds_per_stay,
+        overlap_rate=args.overlap_rate,
+        start=args.start,
+        end=args.end,
+        seed=args.seed,
+    )
+    config = write_synthetic(args.out, spec, args.filetype)
+    print(f"Synthetic CLIF tables written to: {config['clif2_path']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Row counts, missing values and value ranges of CLIF tables from Parquet footers.
+
+Every Parquet row group stores ``num_rows`` and, per column, ``null_count``
+and ``min``/``max``. Combining them answers "how many rows", "how many
+missing" and "which date span" without reading data pages. Only the column
+chunks of a row group that were written without statistics are decoded. CSV
+sources are profiled through their cached Parquet copy (see ``csv_source``),
+and a table stored as several files is profiled file by file and combined.
+
+Usage::
+
+    python -m clif_pipeline.table_profile
+    python -m clif_pipeline.table_profile --tables respiratory_support adt --out clif_profile.csv
+"""
+import argparse
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .loader import clif_tables, load_config, source_paths
+
+PROFILE_COLUMNS = ['table', 'column', 'type', 'rows', 'nulls', 'null_pct', 'min', 'max', 'row_groups', 'decoded']
+
+
+def _chunk_stats(statistics):
+    """``(nulls, min, max)`` of a column chunk, None for parts the footer lacks."""
+    if statistics is None:
+        return None, None, None
+    nulls = statistics.null_count if statistics.has_null_count else None
+    if statistics.has_min_max:
+        return nulls, statistics.min, statistics.max
+    # A chunk of only nulls has no min/max to record
+    return nulls, None, None
+
+
+def profile_parquet(path, table: str = None, columns=None, decode_missing: bool = True) -> pd.DataFrame:
+    """One row per column of a Parquet file with rows, nulls, min and max.
+
+    ``decoded`` counts the row groups whose statistics were missing and had to
+    be read; with ``decode_missing=False`` their nulls/min/max stay unknown
+    (NaN).
+    """
+    parquet_file = pq.ParquetFile(path)
+    metadata = parquet_file.metadata
+    arrow_schema = parquet_file.schema_arrow
+    names = [metadata.schema.column(j).path for j in range(metadata.num_columns)]
+    wanted = names if columns is None else [name for name in columns if name in names]
+
+    records = []
+    for name in wanted:
+        j = names.index(name)
+        nulls, low, high, decoded, known = 0, None, None, 0, True
+        for i in range(metadata.num_row_groups):
+            row_group = metadata.row_group(i)
+            chunk_nulls, chunk_min, chunk_max = _chunk_stats(row_group.column(j).statistics)
+            all_null = chunk_nulls is not None and chunk_nulls == row_group.num_rows
+            if chunk_nulls is None or (chunk_min is None and not all_null):
+                if not decode_missing:
+                    known = False
+                    continue
+                values = parquet_file.read_row_group(i, columns=[name]).column(0)
+                min_max = pc.min_max(values)
+                chunk_nulls, chunk_min, chunk_max = values.null_count, min_max['min'].as_py(), min_max['max'].as_py()
+                decoded += 1
+            nulls += chunk_nulls
+            if chunk_min is not None:
+                low = chunk_min if low is None else min(low, chunk_min)
+                high = chunk_max if high is None else max(high, chunk_max)
+        field = arrow_schema.field(name) if name in arrow_schema.names else None
+        records.append({
+            'table': table or Path(path).stem,
+            'column': name,
+            'type': str(field.type) if field is not None else metadata.schema.column(j).physical_type,
+            'rows': metadata.num_rows,
+            'nulls': nulls if known else None,
+            'null_pct': round(nulls / metadata.num_rows * 100, 2) if known and metadata.num_rows else None,
+            'min': low,
+            'max': high,
+            'row_groups': metadata.num_row_groups,
+            'decoded': decoded,
+        })
+    return pd.DataFrame(records, columns=PROFILE_COLUMNS)
+
+
+def combine_profiles(profiles) -> pd.DataFrame:
+    """Profile of a table stored as several files: counts add up and min/max combine.
+
+    A column missing from a file counts that file's rows as missing values.
+    """
+    profiles = list(profiles)
+    if len(profiles) == 1:
+        return profiles[0]
+    total_rows = sum(int(p['rows'].iloc[0]) for p in profiles if len(p))
+    total_row_groups = sum(int(p['row_groups'].iloc[0]) for p in profiles if len(p))
+    combined = pd.concat(profiles, ignore_index=True).groupby(['table', 'column'], sort=False).agg(
+        type=('type', 'first'),
+        present_rows=('rows', 'sum'),
+        nulls=('nulls', lambda nulls: nulls.sum() if nulls.notna().all() else None),
+        min=('min', 'min'),
+        max=('max', 'max'),
+        decoded=('decoded', 'sum'),
+    ).reset_index()
+    combined['rows'] = total_rows
+    combined['nulls'] = combined['nulls'] + (total_rows - combined['present_rows'])
+    combined['null_pct'] = (combined['nulls'] / total_rows * 100).round(2) if total_rows else None
+    combined['row_groups'] = total_row_groups
+    return combined[PROFILE_COLUMNS]
+
+
+def profile_table(config: dict, table: str, columns=None, decode_missing: bool = True) -> pd.DataFrame:
+    """Column profile of one CLIF table, e.g. ``profile_table(config, 'adt')``."""
+    return combine_profiles(
+        profile_parquet(path, table, columns, decode_missing) for path in source_paths(config, table)
+    )
+
+
+def profile_clif(config: dict, tables=None, decode_missing: bool = True) -> pd.DataFrame:
+    """Column profiles of ``tables`` (default every CLIF table under ``clif2_path``)."""
+    frames = [profile_table(config, table, decode_missing=decode_missing) for table in tables or clif_tables(config)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=PROFILE_COLUMNS)
+
+
+def print_profile(profile: pd.DataFrame) -> None:
+    for table, columns in profile.groupby('table', sort=False):
+        print(f"\n{table}: {columns['rows'].iloc[0]:,} rows, {len(columns)} columns, "
+              f"{columns['row_groups'].iloc[0]} row groups")
+        for _, col in columns[columns['column'].str.endswith('_dttm')].iterrows():
+            print(f"  {col['column']} spans {col['min']} to {col['max']}")
+        missing = columns[columns['nulls'].fillna(1) > 0]
+        for _, col in missing.iterrows():
+            if pd.isna(col['nulls']):
+                print(f"  {col['column']}: missing values unknown (no statistics)")
+            else:
+                print(f"  {col['column']}: {int(col['nulls']):,} missing ({col['null_pct']:.2f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile CLIF tables from Parquet metadata.')
+    parser.add_argument('--config', default='config.json')
+    parser.add_argument('--tables', nargs='+', default=None, help='tables to profile (default all under clif2_path)')
+    parser.add_argument('--no-decode', action='store_true',
+                        help='never read data pages; columns without statistics are reported as unknown')
+    parser.add_argument('--out', default=None, help='also write the column profile to this CSV')
+    args = parser.parse_args()
+
+    profile = profile_clif(load_config(args.config), args.tables, decode_missing=not args.no_decode)
+    print_profile(profile)
+    if args.out:
+        profile.to_csv(args.out, index=False)
+        print(f"\nProfile saved to: {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Run-length encoding of ventilation mode sequences and mode transitions.
+
+Each hospitalization's records, in time order, are collapsed into runs of the
+same mode; a change of mode is a transition. All steps work on integer codes
+over the sorted arrays, so there is no per-hospitalization Python loop::
+
+    runs = mode_runs(df_respiratory, mode_col='mode_name')
+    changes = changes_per_hospitalization(runs)          # true mode changes
+    transitions = mode_transitions(runs)                 # one row per change
+    matrix = transition_matrix(transitions, by=['year']) # from -> to counts
+
+Records with a missing hospitalization, time or mode are ignored, so a
+missing mode between two records of the same mode does not split the run.
+"""
+import numpy as np
+import pandas as pd
+
+from .instrument import step
+from .interval_join import to_ns
+from .kernels import decode_codes, factorize_codes, is_sorted_by
+
+NS_PER_HOUR = 3_600 * 10**9
+
+
+def mode_runs(df: pd.DataFrame, mode_col='mode_name', time_col='recorded_dttm',
+              by='hospitalization_id', location_col=None) -> pd.DataFrame:
+    """Runs of consecutive records with the same ``mode_col`` per ``by``.
+
+    Returns one row per run, in (``by``, time) order: ``by``, ``mode_col``,
+    ``start_dttm`` (first record), ``end_dttm`` (first record of the next run,
+    or the run's last record when it is the hospitalization's last run),
+    ``records`` and ``duration_hours``, plus ``location_col`` at the run start
+    when given. The rows are only sorted when they are not already in
+    (``by``, ``time_col``) order.
+    """
+    hosp_codes, hosp_values = factorize_codes(df[by])
+    mode_codes, mode_values = factorize_codes(df[mode_col])
+    times = pd.Series(df[time_col], copy=False)
+    if getattr(times.dt, 'tz', None) is not None:
+        times = times.dt.tz_localize(None)
+    t = to_ns(times)
+    keep = (hosp_codes >= 0) & (mode_codes >= 0) & (t != np.iinfo(np.int64).min)
+
+    with step('sort', rows_in=len(df)):
+        if is_sorted_by(df, [by, time_col]):
+            rows = np.flatnonzero(keep)
+        else:
+            order = np.lexsort((t, hosp_codes))
+            rows = order[keep[order]]
+    h, m, t = hosp_codes[rows], mode_codes[rows], t[rows]
+
+    with step('run_length', rows_in=len(rows)) as info:
+        n = len(rows)
+        starts = np.ones(n, dtype=bool)
+        starts[1:] = (h[1:] != h[:-1]) | (m[1:] != m[:-1])
+        first = np.flatnonzero(starts)
+        records = np.diff(np.r_[first, n])
+        last = first + records - 1
+        run_hosp = h[first]
+        # A run ends where the next run of the same hospitalization starts
+        has_next = np.zeros(len(first), dtype=bool)
+        has_next[:-1] = run_hosp[1:] == run_hosp[:-1]
+        next_first = np.r_[first[1:], 0] if len(first) else first
+        end = np.where(has_next, t[next_first], t[last])
+        info['rows_out'] = len(first)
+
+    runs = pd.DataFrame({
+        by: decode_codes(run_hosp, hosp_values, df[by]),
+        mode_col: decode_codes(m[first], mode_values, df[mode_col]),
+        'start_dttm': t[first].astype('datetime64[ns]'),
+        'end_dttm': end.astype('datetime64[ns]'),
+        'records': records,
+        'duration_hours': (end - t[first]) / NS_PER_HOUR,
+    })
+    if location_col is not None:
+        runs[location_col] = df[location_col].take(rows[first]).to_numpy()
+    return runs
+
+
+def changes_per_hospitalization(runs: pd.DataFrame, by='hospitalization_id') -> pd.DataFrame:
+    """Number of runs and of mode changes (runs - 1) per hospitalization."""
+    counts = runs.groupby(by, observed=True).size().rename('runs').reset_index()
+    counts['changes'] = counts['runs'] - 1
+    return counts
+
+
+def mode_transitions(runs: pd.DataFrame, mode_col='mode_name', by='hospitalization_id') -> pd.DataFrame:
+    """One row per mode change: ``by``, ``from_mode``, ``to_mode``, ``transition_dttm``, ``year``.
+
+    ``from_hours`` is how long the previous mode lasted. Columns of ``runs``
+    besides the run fields (e.g. ``location_name``) are taken from the run
+    that starts at the change.
+    """
+    hosp_codes, _ = factorize_codes(runs[by])
+    change = np.flatnonzero(hosp_codes[1:] == hosp_codes[:-1])
+    before, after = runs.iloc[change], runs.iloc[change + 1]
+    transitions = pd.DataFrame({
+        by: after[by].to_numpy(),
+        'from_mode': before[mode_col].to_numpy(),
+        'to_mode': after[mode_col].to_numpy(),
+        'transition_dttm': after['start_dttm'].to_numpy(),
+        'from_hours': before['duration_hours'].to_numpy(),
+    })
+    transitions['year'] = transitions['transition_dttm'].dt.year
+    run_fields = {by, mode_col, 'start_dttm', 'end_dttm', 'records', 'duration_hours'}
+    for col in runs.columns:
+        if col not in run_fields:
+            transitions[col] = after[col].to_numpy()
+    return transitions
+
+
+def transition_matrix(transitions: pd.DataFrame, by=('year',)) -> pd.DataFrame:
+    """from -> to transition counts per ``by`` group (long format).
+
+    Example (one matrix per location and year)::
+
+        matrix = transition_matrix(transitions, by=['location_name', 'year'])
+        matrix.pivot_table(index='from_mode', columns='to_mode', values='transitions', aggfunc='sum')
+    """
+    keys = [*by, 'from_mode', 'to_mode']
+    return transitions.groupby(keys, observed=True).size().reset_index(name='transitions')
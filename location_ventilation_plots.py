@@ -6,10 +6,38 @@ app = marimo.App(width="medium")
 
 @app.cell
 def _():
+    import marimo as mo
     import pandas as pd
-    import plotly.graph_objects as go
     from pathlib import Path
-    return Path, go, pd
+    from clif_pipeline import load_config, table_path
+    from clif_pipeline.aggregate import location_record_stats, location_yearly_modes
+    from clif_pipeline.cache import StageCache
+    from clif_pipeline.cube import CUBE_RESPIRATORY_COLS, build_site_cube, slice_cube
+    from clif_pipeline.merged_store import MERGED_DIR, read_merged
+    from clif_pipeline.plots import (
+        MODE_COLORS,
+        location_mode_figure,
+        mode_colors_for,
+        write_location_plots,
+    )
+    return (
+        CUBE_RESPIRATORY_COLS,
+        MERGED_DIR,
+        MODE_COLORS,
+        Path,
+        StageCache,
+        build_site_cube,
+        load_config,
+        location_mode_figure,
+        location_record_stats,
+        location_yearly_modes,
+        mo,
+        mode_colors_for,
+        read_merged,
+        slice_cube,
+        table_path,
+        write_location_plots,
+    )
 
 
 @app.cell
@@ -22,37 +50,20 @@ def _(Path):
 
 
 @app.cell
-def _(pd):
-    # Load the merged data
-    df_merged_raw = pd.read_parquet("respiratory_adt_merged.parquet")
-    print(f"Loaded {len(df_merged_raw):,} rows")
-    print(f"Columns: {df_merged_raw.columns.tolist()}")
-    print(f"Unique locations: {df_merged_raw['location_name'].nunique()}")
-    return df_merged_raw,
+def _(load_config):
+    config = load_config()
+    return (config,)
 
 
 @app.cell
-def _(df_merged_raw, pd):
-    # Convert datetime columns and add date column
-    df_merged = df_merged_raw.copy()
-    df_merged['recorded_dttm'] = pd.to_datetime(df_merged['recorded_dttm'])
-    df_merged['date'] = df_merged['recorded_dttm'].dt.date
-    
-    # Sort by hospitalization_id and recorded_dttm
-    df_merged = df_merged.sort_values(['hospitalization_id', 'recorded_dttm'])
-    
-    # Forward fill mode_category within each hospitalization
-    df_merged['mode_category'] = df_merged.groupby('hospitalization_id')['mode_category'].ffill()
-    
-    print(f"\nAfter forward fill:")
-    print(f"  - Null mode_category: {df_merged['mode_category'].isnull().sum()}")
-    print(f"  - Total records: {len(df_merged)}")
-    
-    return df_merged,
+def _(StageCache, config):
+    # Stage outputs are reused until the merged dataset, parameters or code change
+    cache = StageCache.from_config(config)
+    return (cache,)
 
 
 @app.cell
-def _(df_merged):
+def _():
     # Filter for the 3 specific modes
     target_modes = [
         'Assist Control-Volume Control',
@@ -60,144 +71,99 @@ def _(df_merged):
         'Pressure-Regulated Volume Control'
     ]
 
-    df_three_modes = df_merged[df_merged['mode_category'].isin(target_modes)].copy()
-    print(f"\nFiltered to {len(df_three_modes):,} rows with target modes")
+    # Restrict to specific locations / years for quick reruns, e.g. ['MICU'] or (2021, 2023)
+    selected_locations = None
+    selected_years = None
+    return selected_locations, selected_years, target_modes
+
 
-    # Extract year from recorded_dttm
-    df_three_modes['year'] = df_three_modes['recorded_dttm'].dt.year
-    return df_three_modes, target_modes
+@app.cell
+def _(MERGED_DIR, read_merged, selected_locations, selected_years, target_modes):
+    import functools
+
+    # Load only the partitions and rows needed; mode_category_filled is already
+    # forward filled within each hospitalization when the dataset is written.
+    # Only a cache miss below calls this, so a rerun never opens the dataset
+    @functools.cache
+    def load_three_modes():
+        df_three_modes = read_merged(
+            MERGED_DIR,
+            locations=selected_locations,
+            years=selected_years,
+            modes=target_modes,
+            columns=['hospitalization_id', 'recorded_dttm', 'location_name', 'mode_category_filled', 'year'],
+            ordered=False
+        )
+        df_three_modes = df_three_modes.rename(columns={'mode_category_filled': 'mode_category'})
+
+        print(f"Loaded {len(df_three_modes):,} rows with target modes")
+        print(f"Columns: {df_three_modes.columns.tolist()}")
+        print(f"Unique locations: {df_three_modes['location_name'].nunique()}")
+        return df_three_modes
+    return (load_three_modes,)
 
 
 @app.cell
-def _():
-    # Define colors for each mode
-    mode_colors = {
-        'Assist Control-Volume Control': '#66c266',  # green
-        'Pressure Support/CPAP': '#ffcc00',  # yellow
-        'Pressure-Regulated Volume Control': '#fdc086'  # R color
-    }
+def _(MODE_COLORS):
+    # Define colors for each mode (edit a copy to restyle the plots)
+    mode_colors = dict(MODE_COLORS)
     return mode_colors,
 
 
 @app.cell
-def _(df_three_modes):
-    # Get all unique locations
-    locations = sorted(df_three_modes['location_name'].unique())
+def _(
+    MERGED_DIR,
+    cache,
+    load_three_modes,
+    location_record_stats,
+    location_yearly_modes,
+    selected_locations,
+    selected_years,
+    target_modes,
+):
+    # One grouped pass over (location, hospitalization, date, mode) for every location
+    stage_params = {'modes': target_modes, 'locations': selected_locations, 'years': selected_years}
+    yearly_modes_all = cache.cached(
+        'location_yearly_modes',
+        lambda: location_yearly_modes(load_three_modes()),
+        inputs=[MERGED_DIR],
+        params=stage_params
+    )
+    record_stats = cache.cached(
+        'location_record_stats',
+        lambda: location_record_stats(load_three_modes()),
+        inputs=[MERGED_DIR],
+        params=stage_params
+    )
+
+    locations = sorted(yearly_modes_all['location_name'].unique())
     print(f"\nWill process {len(locations)} locations:")
-    for loc in locations:
-        count = len(df_three_modes[df_three_modes['location_name'] == loc])
+    for loc, count in zip(record_stats['location_name'], record_stats['records']):
         print(f"  - {loc}: {count:,} records")
-    return locations,
-
-
-@app.cell
-def _(df_three_modes, go, locations, mode_colors, pd, plots_folder):
-    # Process each location and create plots
-    all_figures = {}
-    location_stats = []
-
-    for location in locations:
-        # Filter data for this location
-        df_location = df_three_modes[df_three_modes['location_name'] == location].copy()
-        
-        if len(df_location) == 0:
-            continue
-            
-        # For each hospitalization and day, find the most used mode
-        hosp_daily_mode = df_location.groupby(['hospitalization_id', 'date', 'mode_category']).size().reset_index(name='count')
-        
-        # Get the dominant mode for each hospitalization-date combination
-        idx_hosp_daily = hosp_daily_mode.groupby(['hospitalization_id', 'date'])['count'].idxmax()
-        hosp_daily_dominant = hosp_daily_mode.loc[idx_hosp_daily]
-        
-        # Extract year from date for aggregation
-        hosp_daily_dominant['year'] = pd.to_datetime(hosp_daily_dominant['date']).dt.year
-        
-        # Count unique hospitalization-days per mode per year
-        yearly_modes = hosp_daily_dominant.groupby(['year', 'mode_category']).size().reset_index(name='hosp_days')
-        
-        # Calculate total hospitalization-days per year for percentage
-        yearly_totals = yearly_modes.groupby('year')['hosp_days'].sum()
-        yearly_modes['total'] = yearly_modes['year'].map(yearly_totals)
-        yearly_modes['percentage'] = (yearly_modes['hosp_days'] / yearly_modes['total'] * 100).round(1)
-        
-        # Create 100% stacked bar chart
-        years_list = sorted(yearly_modes['year'].unique())
-        
-        fig = go.Figure()
-        
-        for mode_name in mode_colors.keys():
-            mode_data = yearly_modes[yearly_modes['mode_category'] == mode_name]
-            
-            percentages = []
-            for yr in years_list:
-                year_mode = mode_data[mode_data['year'] == yr]
-                if not year_mode.empty:
-                    percentages.append(year_mode['percentage'].values[0])
-                else:
-                    percentages.append(0)
-            
-            # Replace display name for Pressure Support/CPAP
-            display_name = 'Pressure Control' if mode_name == 'Pressure Support/CPAP' else mode_name
-            
-            fig.add_trace(go.Bar(
-                name=display_name,
-                x=years_list,
-                y=percentages,
-                text=[f'{p:.1f}%' if p > 0 else '' for p in percentages],
-                textposition='inside',
-                textfont=dict(color='white', size=14, family='Arial Black'),
-                marker_color=mode_colors[mode_name],
-                hovertemplate='%{x}<br>' + display_name + '<br>Percentage: %{text}<extra></extra>'
-            ))
-        
-        fig.update_layout(
-            barmode='stack',
-            title=f'Ventilation Mode Distribution - {location}',
-            xaxis_title='Year',
-            yaxis_title='Percentage (%)',
-            yaxis=dict(range=[0, 100]),
-            height=600,
-            showlegend=True,
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=-0.15,
-                xanchor="center",
-                x=0.5
-            ),
-            bargap=0.15
-        )
-        
-        # Save the plot as PNG
-        filename = f"{location.replace('/', '_').replace(' ', '_')}.png"
-        filepath = plots_folder / filename
-        fig.write_image(str(filepath), width=1200, height=800, scale=2)
-        
-        # Store figure for display
-        all_figures[location] = fig
-        
-        # Collect statistics
-        location_stats.append({
-            'location': location,
-            'records': len(df_location),
-            'hospitalizations': df_location['hospitalization_id'].nunique(),
-            'years': len(years_list),
-            'file': filename
-        })
+    return record_stats, yearly_modes_all
+
+
+@app.cell
+def _(mode_colors, plots_folder, write_location_plots, yearly_modes_all):
+    # Create and save plots for each location from the small yearly table
+    all_figures, plot_files = write_location_plots(yearly_modes_all, plots_folder, mode_colors)
 
     print(f"\n✅ Generated {len(all_figures)} plots")
-    return all_figures, location_stats
+    return all_figures, plot_files
 
 
 @app.cell
-def _(location_stats, pd):
+def _(plot_files, record_stats, yearly_modes_all):
     # Display summary statistics
-    stats_df = pd.DataFrame(location_stats)
+    stats_df = record_stats.rename(columns={'location_name': 'location'})
+    stats_df['years'] = stats_df['location'].map(
+        yearly_modes_all.groupby('location_name', observed=True)['year'].nunique()
+    ).fillna(0).astype(int)
+    stats_df['file'] = stats_df['location'].map(plot_files)
     print("\nLocation Statistics Summary:")
     print(stats_df.to_string(index=False))
     stats_df
-    return stats_df,
+    return (stats_df,)
 
 
 @app.cell
@@ -210,6 +176,109 @@ def _(all_figures):
     return last_location,
 
 
+@app.cell
+def _(CUBE_RESPIRATORY_COLS, build_site_cube, cache, config, table_path, target_modes):
+    # Hosp-days per (year, location, mode_category, mode_name), built once from
+    # the raw tables; the explorer below only slices these small tables
+    mode_cube = cache.cached(
+        'mode_cube',
+        lambda: build_site_cube(config),
+        inputs=[table_path(config, 'respiratory_support'), table_path(config, 'adt')],
+        params={'columns': CUBE_RESPIRATORY_COLS}
+    )
+    # Dominance among the target modes only, as in the saved plots
+    target_mode_cube = cache.cached(
+        'mode_cube',
+        lambda: build_site_cube(config, dominance_modes=target_modes),
+        inputs=[table_path(config, 'respiratory_support'), table_path(config, 'adt')],
+        params={'columns': CUBE_RESPIRATORY_COLS, 'dominance_modes': target_modes}
+    )
+    print(f"Mode cube: {len(mode_cube):,} rows, {mode_cube['hosp_days'].sum():,} hospitalization-days")
+    return mode_cube, target_mode_cube
+
+
+@app.cell
+def _(mo):
+    # Explore any mode set, location and year range from the cube
+    mode_level = mo.ui.dropdown(
+        options={'Mode category': 'mode_category', 'Mode name': 'mode_name'},
+        value='Mode category',
+        label='Level'
+    )
+    mode_level
+    return (mode_level,)
+
+
+@app.cell
+def _(mo, mode_cube, mode_level, target_modes):
+    level_hosp_days = mode_cube.groupby(mode_level.value, observed=True)['hosp_days'].sum().sort_values(ascending=False)
+    if mode_level.value == 'mode_category':
+        default_modes = [m for m in target_modes if m in level_hosp_days.index]
+    else:
+        default_modes = level_hosp_days.index[:3].tolist()
+    cube_years = mode_cube['year']
+
+    mode_select = mo.ui.multiselect(options=sorted(level_hosp_days.index), value=default_modes, label='Modes')
+    location_select = mo.ui.dropdown(
+        options=['All locations', *sorted(mode_cube['location_name'].unique())],
+        value='All locations',
+        label='Location'
+    )
+    year_select = mo.ui.range_slider(
+        start=int(cube_years.min()),
+        stop=int(cube_years.max()),
+        step=1,
+        value=[int(cube_years.min()), int(cube_years.max())],
+        label='Years'
+    )
+    mo.hstack([mode_select, location_select, year_select], justify='start')
+    return location_select, mode_select, year_select
+
+
+@app.cell
+def _(
+    location_mode_figure,
+    location_select,
+    mo,
+    mode_colors,
+    mode_colors_for,
+    mode_cube,
+    mode_level,
+    mode_select,
+    slice_cube,
+    target_mode_cube,
+    target_modes,
+    year_select,
+):
+    # The target mode categories are sliced from the cube that drops other
+    # modes' records first, so they match the saved plots
+    all_locations = location_select.value == 'All locations'
+    target_view = mode_level.value == 'mode_category' and set(mode_select.value) == set(target_modes)
+    if target_view:
+        explorer_note = ("Hospitalization-days whose dominant mode among the target modes is the one shown "
+                         "(other modes' records are ignored), as in the saved plots.")
+    else:
+        explorer_note = ("Hospitalization-days whose dominant mode over **all** modes is one of the selected "
+                         "modes; days dominated by another mode are left out, so counts are lower than "
+                         "in the saved plots.")
+    explorer_modes = slice_cube(
+        target_mode_cube if target_view else mode_cube,
+        modes=mode_select.value,
+        locations=None if all_locations else [location_select.value],
+        years=tuple(year_select.value),
+        level=mode_level.value,
+        by_location=not all_locations
+    )
+    explorer_figure = location_mode_figure(
+        location_select.value,
+        explorer_modes,
+        mode_colors_for(mode_select.value, base=mode_colors),
+        mode_col=mode_level.value
+    )
+    mo.vstack([mo.md(explorer_note), explorer_figure])
+    return explorer_figure, explorer_modes
+
+
 @app.cell
 def _(plots_folder):
     # List all saved plots
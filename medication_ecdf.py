@@ -10,7 +10,23 @@ def _():
     import json
     from pathlib import Path
     import plotly.graph_objects as go
-    return Path, go, json, pd
+    from clif_pipeline import load_clif_table, table_path
+    from clif_pipeline.cache import StageCache
+    from clif_pipeline.ecdf import dose_summary, save_dose_summary
+    from clif_pipeline.sketch import ecdf_from_sketches, stream_dose_sketches, summary_from_sketches
+    return (
+        Path,
+        StageCache,
+        dose_summary,
+        ecdf_from_sketches,
+        go,
+        json,
+        load_clif_table,
+        save_dose_summary,
+        stream_dose_sketches,
+        summary_from_sketches,
+        table_path,
+    )
 
 
 @app.cell
@@ -25,43 +41,55 @@ def _(Path, json):
 
 
 @app.cell
-def _(Path, config, pd):
-    clif_path = Path(config["clif2_path"])
-    medication_file = clif_path / "clif_medication_admin_continuous.parquet"
-
-    print(f"Loading medication admin data from: {medication_file}")
-    df_med = pd.read_parquet(medication_file)
-    print(f"Loaded {len(df_med):,} rows")
-    print(f"Columns: {df_med.columns.tolist()}")
-    return (df_med,)
+def _(StageCache, config, load_clif_table, table_path):
+    medication_file = table_path(config, "medication_admin_continuous")
+
+    # Only the three columns the dose profiles need are read from the file
+    print(f"Loading medication doses from: {medication_file}")
+    cache = StageCache.from_config(config)
+    df_meds = cache.cached(
+        'medication_doses',
+        lambda: load_clif_table(
+            config,
+            "medication_admin_continuous",
+            columns=['med_group', 'med_category', 'med_dose']
+        ),
+        inputs=[medication_file]
+    )
+    print(f"Loaded: {len(df_meds):,} rows")
+    print(f"Columns: {df_meds.columns.tolist()}")
+    return (df_meds,)
 
 
 @app.cell
-def _(df_med):
-    df_med.columns
-    return
+def _(df_meds, dose_summary, save_dose_summary):
+    # Summary and ECDF for every med_group and med_category from one sort
+    dose_stats, dose_ecdf = dose_summary(df_meds)
+    save_dose_summary(dose_stats, dose_ecdf, ".")
+    print(f"Dose summary saved for {len(dose_stats)} medication categories")
 
+    # Filter for vasoactives
+    vaso_stats = dose_stats[dose_stats['med_group'] == 'vasoactives'].sort_values('rows', ascending=False, kind='stable')
+    vaso_ecdf = dose_ecdf[dose_ecdf['med_group'] == 'vasoactives']
+    return vaso_ecdf, vaso_stats
 
-@app.cell
-def _(df_med):
-    # Filter for vasoactives only
-    df_vasoactives = df_med[df_med['med_group'] == 'vasoactives'].copy()
-    print(f"Filtered to vasoactives: {len(df_vasoactives):,} rows")
 
-    grouped = df_vasoactives.groupby(['med_category']).size().reset_index(name='count')
+@app.cell
+def _(vaso_stats):
+    grouped = vaso_stats[['med_category', 'rows']].rename(columns={'rows': 'count'})
     print(f"Number of unique med_category values in vasoactives: {len(grouped)}")
     print(f"\nAll vasoactive categories by count:")
-    print(grouped.sort_values('count', ascending=False))
-    return (df_vasoactives,)
+    print(grouped.to_string(index=False))
+    return
 
 
 @app.cell
-def _(df_vasoactives, go):
-    import numpy as np
+def _(go, vaso_ecdf, vaso_stats):
     from plotly.subplots import make_subplots
 
-    # Get unique categories
-    categories = df_vasoactives['med_category'].value_counts().index[:9]  # Limit to 9 for 3x3 grid
+    # Get the most frequent categories
+    categories = vaso_stats['med_category'].tolist()[:9]  # Limit to 9 for 3x3 grid
+    ecdf_points = dict(tuple(vaso_ecdf.groupby('med_category', observed=True, sort=False)))
 
     # Create subplots
     fig = make_subplots(
@@ -71,36 +99,17 @@ def _(df_vasoactives, go):
         horizontal_spacing=0.1
     )
 
-    # Add ECDF for each category
+    # Add ECDF for each category (outliers beyond 3 IQR already removed, at most 500 points)
     for idx, med_cat in enumerate(categories):
         row = idx // 3 + 1
         col = idx % 3 + 1
 
-        # Get values for this category
-        values = df_vasoactives[df_vasoactives['med_category'] == med_cat]['med_dose'].dropna()
-        
-        # Remove outliers using IQR method
-        Q1 = values.quantile(0.25)
-        Q3 = values.quantile(0.75)
-        IQR = Q3 - Q1
-        lower_bound = Q1 - 3 * IQR
-        upper_bound = Q3 + 3 * IQR
-        values = values[(values >= lower_bound) & (values <= upper_bound)].sort_values()
-
-        if len(values) > 0:
-            # Downsample if too many points
-            if len(values) > 500:
-                indices = np.linspace(0, len(values)-1, 500, dtype=int)
-                values = values.iloc[indices]
-
-            # Calculate ECDF
-            y_ecdf = np.arange(1, len(values) + 1) / len(values)
-
-            # Add trace
+        if med_cat in ecdf_points:
+            cat_points = ecdf_points[med_cat]
             fig.add_trace(
                 go.Scatter(
-                    x=values,
-                    y=y_ecdf,
+                    x=cat_points['med_dose'],
+                    y=cat_points['ecdf'],
                     mode='lines',
                     name=med_cat,
                     showlegend=False,
@@ -127,14 +136,44 @@ def _(df_vasoactives, go):
 
 
 @app.cell
-def _(df_vasoactives):
+def _(vaso_stats):
     # Check dose statistics for each category
-    for cat in df_vasoactives['med_category'].unique()[:5]:
-        doses = df_vasoactives[df_vasoactives['med_category']==cat]['med_dose'].dropna()
-        print(f"\n{cat}:")
-        print(f"  Min: {doses.min():.3f}, Max: {doses.max():.3f}")
-        print(f"  Median: {doses.median():.3f}, Mean: {doses.mean():.3f}")
-        print(f"  95th percentile: {doses.quantile(0.95):.3f}")
+    for stats in vaso_stats.head(5).itertuples(index=False):
+        print(f"\n{stats.med_category}:")
+        print(f"  Min: {stats.min:.3f}, Max: {stats.max:.3f}")
+        print(f"  Median: {stats.median:.3f}, Mean: {stats.mean:.3f}")
+        print(f"  95th percentile: {stats.p95:.3f}")
+    return
+
+
+@app.cell
+def _(config, stream_dose_sketches, summary_from_sketches):
+    # Streaming mode: read the medication table batch by batch and keep a
+    # mergeable quantile sketch per (med_group, med_category)
+    dose_sketches = stream_dose_sketches(config)
+    sketch_summary = summary_from_sketches(dose_sketches)
+    print(f"Sketched {len(dose_sketches)} medication categories")
+    sketch_summary
+    return (dose_sketches,)
+
+
+@app.cell
+def _(dose_sketches, ecdf_from_sketches, go):
+    # ECDF of vasoactives drawn from the sketches (approximate, bounded error)
+    sketch_ecdf = ecdf_from_sketches(dose_sketches)
+    sketch_ecdf = sketch_ecdf[sketch_ecdf['med_group'] == 'vasoactives']
+
+    fig_sketch = go.Figure()
+    for sketch_cat, points in sketch_ecdf.groupby('med_category', observed=True):
+        fig_sketch.add_trace(go.Scatter(x=points['med_dose'], y=points['ecdf'], mode='lines', name=sketch_cat))
+    fig_sketch.update_layout(
+        title_text='ECDF of Vasoactive Medications by Category (streaming sketches)',
+        xaxis_title='Unit Doses',
+        yaxis_title='Cumulative Probability',
+        height=600
+    )
+    fig_sketch.update_yaxes(tickformat=".1%")
+    fig_sketch
     return
 
 
@@ -10,7 +10,25 @@ def _():
     import json
     from pathlib import Path
     import numpy as np
-    return Path, json, pd
+    from clif_pipeline import ADTIndex, load_clif_table, merge_respiratory_adt, table_path
+    from clif_pipeline.cache import StageCache
+    from clif_pipeline.incremental import initialize_state
+    from clif_pipeline.loader import hospitalization_ids
+    from clif_pipeline.merged_store import MERGED_DIR, replace_merged_dataset
+    return (
+        ADTIndex,
+        MERGED_DIR,
+        Path,
+        StageCache,
+        hospitalization_ids,
+        initialize_state,
+        json,
+        load_clif_table,
+        merge_respiratory_adt,
+        pd,
+        replace_merged_dataset,
+        table_path,
+    )
 
 
 @app.cell
@@ -25,10 +43,17 @@ def _(Path, json):
 
 
 @app.cell
-def _(Path, config):
-    clif_path = Path(config["clif2_path"])
-    respiratory_file = clif_path / "clif_respiratory_support.parquet"
-    adt_file = clif_path / "clif_adt.parquet"
+def _(StageCache, config):
+    # Stage outputs are reused until the input files, parameters or code change
+    cache = StageCache.from_config(config)
+    print(f"Stage cache: {cache.cache_dir}")
+    return (cache,)
+
+
+@app.cell
+def _(config, table_path):
+    respiratory_file = table_path(config, "respiratory_support")
+    adt_file = table_path(config, "adt")
 
     print(f"Respiratory support file: {respiratory_file}")
     print(f"ADT file: {adt_file}")
@@ -36,17 +61,17 @@ def _(Path, config):
 
 
 @app.cell
-def _(pd, respiratory_file):
-    df_respiratory_full = pd.read_parquet(respiratory_file)
-    print(f"Loaded {len(df_respiratory_full):,} respiratory support rows")
-    print(f"Columns: {df_respiratory_full.columns.tolist()}")
-
-    # Keep only necessary columns
+def _(cache, config, load_clif_table, respiratory_file):
+    # Only the needed columns are read from the parquet file; strings come back
+    # as categoricals and recorded_dttm as a datetime
     respiratory_cols = ['hospitalization_id', 'recorded_dttm', 'mode_category']
-    df_respiratory = df_respiratory_full[respiratory_cols].copy()
-
-    # Convert datetime
-    df_respiratory['recorded_dttm'] = pd.to_datetime(df_respiratory['recorded_dttm'])
+    df_respiratory = cache.cached(
+        'respiratory_load',
+        lambda: load_clif_table(config, "respiratory_support", columns=respiratory_cols),
+        inputs=[respiratory_file],
+        params={'columns': respiratory_cols}
+    )
+    print(f"Loaded {len(df_respiratory):,} respiratory support rows")
 
     print(f"\nRespiratory data shape: {df_respiratory.shape}")
     df_respiratory.head()
@@ -54,18 +79,17 @@ def _(pd, respiratory_file):
 
 
 @app.cell
-def _(adt_file, pd):
-    df_adt_full = pd.read_parquet(adt_file)
-    print(f"Loaded {len(df_adt_full):,} ADT rows")
-    print(f"Columns: {df_adt_full.columns.tolist()}")
-
-    # Keep only necessary columns
+def _(adt_file, cache, config, load_clif_table):
+    # Only the needed columns are read from the parquet file; in_dttm/out_dttm
+    # come back as datetimes
     adt_cols = ['hospitalization_id', 'in_dttm', 'out_dttm', 'location_name']
-    df_adt = df_adt_full[adt_cols].copy()
-
-    # Convert datetime columns
-    df_adt['in_dttm'] = pd.to_datetime(df_adt['in_dttm'])
-    df_adt['out_dttm'] = pd.to_datetime(df_adt['out_dttm'])
+    df_adt = cache.cached(
+        'adt_load',
+        lambda: load_clif_table(config, "adt", columns=adt_cols),
+        inputs=[adt_file],
+        params={'columns': adt_cols}
+    )
+    print(f"Loaded {len(df_adt):,} ADT rows")
 
     print(f"\nADT data shape: {df_adt.shape}")
     df_adt.head()
@@ -73,55 +97,55 @@ def _(adt_file, pd):
 
 
 @app.cell
-def _(df_adt, df_respiratory):
-    # Check unique hospitalizations in each dataset
-    resp_hosp_ids = df_respiratory['hospitalization_id'].unique()
-    adt_hosp_ids = df_adt['hospitalization_id'].unique()
+def _(config, df_adt, df_respiratory, hospitalization_ids):
+    # Check unique hospitalizations in each dataset on the global integer
+    # hosp_code attached by the loader (one flag per hospitalization, no string hashing)
+    hosp_ids = hospitalization_ids(config)
+    resp_hosp = hosp_ids.mask(df_respiratory['hosp_code'])
+    adt_hosp = hosp_ids.mask(df_adt['hosp_code'])
 
-    print(f"Unique hospitalizations in respiratory: {len(resp_hosp_ids):,}")
-    print(f"Unique hospitalizations in ADT: {len(adt_hosp_ids):,}")
+    print(f"Unique hospitalizations in respiratory: {resp_hosp.sum():,}")
+    print(f"Unique hospitalizations in ADT: {adt_hosp.sum():,}")
 
     # Find overlap
-    common_hosp_ids = set(resp_hosp_ids) & set(adt_hosp_ids)
-    print(f"Common hospitalizations: {len(common_hosp_ids):,}")
+    print(f"Common hospitalizations: {(resp_hosp & adt_hosp).sum():,}")
     return
 
 
 @app.cell
-def _(df_adt, df_respiratory, pd):
-    # Optimized merge using inner join and vectorized filtering
-    print("Starting optimized merge...")
-    
-    # Inner join on hospitalization_id to get all combinations
-    df_merged = pd.merge(
-        df_respiratory,
-        df_adt,
-        on='hospitalization_id',
-        how='inner'
-    )
-    
-    print(f"After inner join: {len(df_merged):,} rows")
-    
-    # Filter to keep only rows where recorded_dttm falls within ADT interval
-    df_merged = df_merged[
-        (df_merged['recorded_dttm'] >= df_merged['in_dttm']) &
-        (df_merged['recorded_dttm'] <= df_merged['out_dttm'])
-    ]
-    
-    print(f"After filtering by time intervals: {len(df_merged):,} rows")
-    
-    # Sort by hospitalization_id and recorded_dttm for consistency
-    df_merged = df_merged.sort_values(['hospitalization_id', 'recorded_dttm'])
-    
-    # If there are duplicates (respiratory record matches multiple ADT intervals), keep first
-    df_merged = df_merged.drop_duplicates(
-        subset=['hospitalization_id', 'recorded_dttm', 'mode_category'],
-        keep='first'
+def _(ADTIndex, df_adt):
+    # Sorted per-hospitalization ADT intervals, saved for reuse by other CLIF tables
+    adt_index = ADTIndex(df_adt)
+    adt_index_file = "adt_index.parquet"
+    adt_index.save(adt_index_file)
+    print(f"ADT index: {len(adt_index):,} intervals for {len(adt_index.hosp_ids):,} hospitalizations")
+    print(f"ADT index saved to: {adt_index_file}")
+    return (adt_index,)
+
+
+@app.cell
+def _(
+    adt_file,
+    adt_index,
+    cache,
+    df_respiratory,
+    merge_respiratory_adt,
+    respiratory_file,
+):
+    # Interval join: each respiratory record is assigned directly to the ADT
+    # interval with in_dttm <= recorded_dttm <= out_dttm (first ADT row wins on overlap)
+    print("Starting interval join...")
+
+    df_merged = cache.cached(
+        'respiratory_adt_merge',
+        lambda: merge_respiratory_adt(df_respiratory, adt_index),
+        inputs=[respiratory_file, adt_file],
+        params={'columns': df_respiratory.columns.tolist()}
     )
-    
+
     print(f"\nFinal merged dataset shape: {df_merged.shape}")
-    print(f"Unique hospitalizations: {df_merged['hospitalization_id'].nunique():,}")
-    
+    print(f"Unique hospitalizations: {df_merged['hosp_code'].nunique():,}")
+
     return (df_merged,)
 
 
@@ -149,14 +173,24 @@ def _(df_merged):
 
 
 @app.cell
-def _(df_merged):
-    # Save the merged dataset to parquet
-    output_file = "respiratory_adt_merged.parquet"
-    df_merged.to_parquet(output_file, index=False)
-    print(f"\nMerged data saved to: {output_file}")
-    print(f"File contains {len(df_merged):,} rows")
+def _(
+    MERGED_DIR,
+    df_adt,
+    df_merged,
+    df_respiratory,
+    initialize_state,
+    replace_merged_dataset,
+):
+    # Save the merged dataset partitioned by year and location_name
+    output_dir = MERGED_DIR
+    replace_merged_dataset(df_merged, output_dir)
+    print(f"\nMerged data saved to: {output_dir}/ (partitioned by year/location_name)")
+    print(f"Dataset contains {len(df_merged):,} rows")
+
+    # Record watermark and per-hospitalization state so later refreshes can run
+    # incrementally: python -m clif_pipeline.incremental
+    initialize_state(df_respiratory, df_adt, df_merged, output_dir)
     return
 
-
 if __name__ == "__main__":
     app.run()
@@ -11,7 +11,34 @@ def _():
     from pathlib import Path
     import plotly.express as px
     import plotly.graph_objects as go
-    return Path, go, json, pd, px
+    from clif_pipeline import load_clif_table, table_path
+    from clif_pipeline.cache import StageCache
+    from clif_pipeline.kernels import daily_dominant_mode
+    from clif_pipeline.plots import mode_year_table
+    from clif_pipeline.table_profile import profile_table
+    from clif_pipeline.transitions import (
+        changes_per_hospitalization,
+        mode_runs,
+        mode_transitions,
+        transition_matrix,
+    )
+    return (
+        Path,
+        StageCache,
+        changes_per_hospitalization,
+        daily_dominant_mode,
+        go,
+        json,
+        load_clif_table,
+        mode_runs,
+        mode_transitions,
+        mode_year_table,
+        pd,
+        profile_table,
+        px,
+        table_path,
+        transition_matrix,
+    )
 
 
 @app.cell
@@ -27,22 +54,31 @@ def _(Path, json):
 
 
 @app.cell
-def _(Path, config):
-    clif_path = Path(config["clif2_path"])
-    respiratory_file = clif_path / "clif_respiratory_support.parquet"
+def _(StageCache, config):
+    # Stage outputs are reused until the input files, parameters or code change
+    cache = StageCache.from_config(config)
+    return (cache,)
+
+
+@app.cell
+def _(config, table_path):
+    respiratory_file = table_path(config, "respiratory_support")
 
     print(f"Loading respiratory support data from: {respiratory_file}")
     return (respiratory_file,)
 
 
 @app.cell
-def _(pd, respiratory_file):
-    df_full = pd.read_parquet(respiratory_file)
-    print(f"Loaded {len(df_full):,} rows")
-
-    # Keep only specified columns
+def _(cache, config, load_clif_table, respiratory_file):
+    # Only the specified columns are read from the parquet file
     columns_to_keep = ['hospitalization_id', 'recorded_dttm', 'mode_name', 'mode_category']
-    df_respiratory = df_full[columns_to_keep].copy()
+    df_respiratory = cache.cached(
+        'respiratory_load',
+        lambda: load_clif_table(config, "respiratory_support", columns=columns_to_keep),
+        inputs=[respiratory_file],
+        params={'columns': columns_to_keep}
+    )
+    print(f"Loaded {len(df_respiratory):,} rows")
 
     print(f"Keeping columns: {df_respiratory.columns.tolist()}")
     return (df_respiratory,)
@@ -97,12 +133,10 @@ def _(df_respiratory):
 
 
 @app.cell
-def _(df_respiratory, pd):
+def _(df_respiratory):
     df_with_dates = df_respiratory.copy()
-    df_with_dates['recorded_dttm'] = pd.to_datetime(df_with_dates['recorded_dttm'])
     df_with_dates['date'] = df_with_dates['recorded_dttm'].dt.date
     daily_counts = df_with_dates.groupby('date').size()
-    print(f"Data spans from {daily_counts.index.min()} to {daily_counts.index.max()}")
     return daily_counts, df_with_dates
 
 
@@ -120,32 +154,38 @@ def _(daily_counts, px):
 
 
 @app.cell
-def _(df_respiratory):
-    missing_values = df_respiratory.isnull().sum()
-    missing_pct = (missing_values / len(df_respiratory) * 100).round(2)
+def _(config, df_respiratory, profile_table):
+    # Row count, date span and missing values come from the Parquet footer
+    # statistics, so no data pages are read
+    respiratory_profile = profile_table(config, "respiratory_support", columns=df_respiratory.columns.tolist())
+    span = respiratory_profile.set_index('column').loc['recorded_dttm']
+    print(f"Data spans from {span['min'].date()} to {span['max'].date()}")
     print("\nMissing Values Summary:")
-    for col in df_respiratory.columns:
-        if missing_values[col] > 0:
-            print(f"{col}: {missing_values[col]:,} ({missing_pct[col]:.2f}%)")
-    return
+    for _, col in respiratory_profile[respiratory_profile['nulls'] > 0].iterrows():
+        print(f"{col['column']}: {col['nulls']:,} ({col['null_pct']:.2f}%)")
+    return (respiratory_profile,)
 
 
 @app.cell
-def _(df_respiratory):
-    # Mode transitions analysis
-    hosp_mode_counts = df_respiratory.groupby('hospitalization_id')['mode_name'].nunique()
-    print(f"Average number of mode changes per hospitalization: {hosp_mode_counts.mean():.2f}")
-    print(f"Max mode changes in a single hospitalization: {hosp_mode_counts.max()}")
-    return (hosp_mode_counts,)
+def _(changes_per_hospitalization, df_respiratory, mode_runs, mode_transitions):
+    # Mode transitions analysis: each hospitalization's records in time order
+    # are collapsed into runs of the same mode_name; a change is a new run
+    mode_name_runs = mode_runs(df_respiratory, mode_col='mode_name')
+    hosp_mode_changes = changes_per_hospitalization(mode_name_runs)
+    mode_name_transitions = mode_transitions(mode_name_runs, mode_col='mode_name')
+    print(f"Average number of mode changes per hospitalization: {hosp_mode_changes['changes'].mean():.2f}")
+    print(f"Max mode changes in a single hospitalization: {hosp_mode_changes['changes'].max()}")
+    print(f"Median time on a mode before it changes: {mode_name_transitions['from_hours'].median():.1f} hours")
+    return hosp_mode_changes, mode_name_transitions
 
 
 @app.cell
-def _(hosp_mode_counts, px):
+def _(hosp_mode_changes, px):
     fig_transitions = px.histogram(
-        hosp_mode_counts.values,
+        hosp_mode_changes['changes'].values,
         nbins=30,
         title="Distribution of Mode Changes per Hospitalization",
-        labels={'value': 'Number of Unique Modes', 'count': 'Number of Hospitalizations'}
+        labels={'value': 'Number of Mode Changes', 'count': 'Number of Hospitalizations'}
     )
     fig_transitions.update_layout(showlegend=False, height=400)
     fig_transitions
@@ -153,16 +193,35 @@ def _(hosp_mode_counts, px):
 
 
 @app.cell
-def _(df_with_dates):
-    # Mode usage over time - first find most used mode per hospitalization per day
-    mode_time_df = df_with_dates.groupby(['hospitalization_id', 'date', 'mode_category']).size().reset_index(name='count')
+def _(mode_name_transitions, px, transition_matrix):
+    # from -> to mode transitions per year; the heatmap sums all years
+    yearly_transitions = transition_matrix(mode_name_transitions, by=['year'])
+    transition_counts = yearly_transitions.pivot_table(
+        index='from_mode', columns='to_mode', values='transitions', aggfunc='sum', fill_value=0, observed=True
+    )
+    fig_transition_matrix = px.imshow(
+        transition_counts,
+        text_auto=True,
+        title="Mode Transitions (from -> to)",
+        labels={'x': 'To Mode', 'y': 'From Mode', 'color': 'Transitions'}
+    )
+    fig_transition_matrix.update_layout(height=500)
+    fig_transition_matrix
+    return (yearly_transitions,)
+
 
-    # For each hospitalization-date combo, find the dominant mode category
-    idx_mode_time = mode_time_df.groupby(['hospitalization_id', 'date'])['count'].idxmax()
-    dominant_modes = mode_time_df.loc[idx_mode_time]
+@app.cell
+def _(cache, daily_dominant_mode, df_with_dates, respiratory_file):
+    # Mode usage over time - most used mode category per hospitalization per day
+    dominant_modes = cache.cached(
+        'hosp_daily_dominant',
+        lambda: daily_dominant_mode(df_with_dates),
+        inputs=[respiratory_file],
+        params={'modes': 'all'}
+    )
 
     # Now count dominant modes by date and category
-    daily_dominant_counts = dominant_modes.groupby(['date', 'mode_category']).size().reset_index(name='count')
+    daily_dominant_counts = dominant_modes.groupby(['date', 'mode_category'], observed=True).size().reset_index(name='count')
     pivot_df = daily_dominant_counts.pivot(index='date', columns='mode_category', values='count').fillna(0)
 
     return (pivot_df,)
@@ -185,28 +244,33 @@ def _(df_with_dates):
 
     df_three_modes = df_with_dates[df_with_dates['mode_category'].isin(target_modes)].copy()
 
-    return (df_three_modes,)
+    return df_three_modes, target_modes
 
 
 @app.cell
-def _(df_three_modes, pd):
-
-
+def _(
+    cache,
+    daily_dominant_mode,
+    df_three_modes,
+    respiratory_file,
+    target_modes,
+):
     # Extract year from recorded_dttm
     df_three_modes['year'] = df_three_modes['recorded_dttm'].dt.year
 
     # For each hospitalization and day, find the most used mode
-    hosp_daily_mode = df_three_modes.groupby(['hospitalization_id', 'date', 'mode_category']).size().reset_index(name='count')
-
-    # Get the dominant mode for each hospitalization-date combination
-    idx_hosp_daily = hosp_daily_mode.groupby(['hospitalization_id', 'date'])['count'].idxmax()
-    hosp_daily_dominant = hosp_daily_mode.loc[idx_hosp_daily]
+    hosp_daily_dominant = cache.cached(
+        'hosp_daily_dominant',
+        lambda: daily_dominant_mode(df_three_modes),
+        inputs=[respiratory_file],
+        params={'modes': target_modes}
+    )
 
     # Extract year from date for aggregation
-    hosp_daily_dominant['year'] = pd.to_datetime(hosp_daily_dominant['date']).dt.year
+    hosp_daily_dominant['year'] = hosp_daily_dominant['date'].dt.year
 
     # Count unique hospitalization-days per mode per year
-    yearly_modes = hosp_daily_dominant.groupby(['year', 'mode_category']).size().reset_index(name='hosp_days')
+    yearly_modes = hosp_daily_dominant.groupby(['year', 'mode_category'], observed=True).size().reset_index(name='hosp_days')
 
     # Calculate total hospitalization-days per year for percentage
     yearly_totals = yearly_modes.groupby('year')['hosp_days'].sum()
@@ -221,7 +285,7 @@ def _(df_three_modes, pd):
 
 
 @app.cell
-def _(go, yearly_modes):
+def _(go, mode_year_table, yearly_modes):
     # Create stacked bar chart with percentages
     years = sorted(yearly_modes['year'].unique())
 
@@ -232,23 +296,16 @@ def _(go, yearly_modes):
         'Pressure-Regulated Volume Control': '#fdc086'  # R color
     }
 
+    # Hosp-days and percentages per mode and year (0 if missing)
+    hosp_days_by_mode = mode_year_table(yearly_modes, mode_colors.keys(), years, value='hosp_days')
+    percentages_by_mode = mode_year_table(yearly_modes, mode_colors.keys(), years)
+
     fig_yearly = go.Figure()
 
     # Add trace for each mode
     for mode in mode_colors.keys():
-        mode_data = yearly_modes[yearly_modes['mode_category'] == mode]
-
-        # Get values for all years (fill 0 if missing)
-        values = []
-        percentages = []
-        for year in years:
-            year_mode = mode_data[mode_data['year'] == year]
-            if not year_mode.empty:
-                values.append(year_mode['hosp_days'].values[0])
-                percentages.append(year_mode['percentage'].values[0])
-            else:
-                values.append(0)
-                percentages.append(0)
+        values = hosp_days_by_mode.loc[mode].tolist()
+        percentages = percentages_by_mode.loc[mode].tolist()
 
         # Replace display name for Pressure Support/CPAP
         display_name = 'Pressure Control' if mode == 'Pressure Support/CPAP' else mode
@@ -285,7 +342,7 @@ def _(go, yearly_modes):
 
 
 @app.cell
-def _(go, yearly_modes):
+def _(go, mode_year_table, yearly_modes):
     # Create 100% stacked bar chart
     years_list_pct = sorted(yearly_modes['year'].unique())
 
@@ -295,18 +352,12 @@ def _(go, yearly_modes):
         'Pressure-Regulated Volume Control': '#fdc086'  # R color
     }
 
+    percentages_by_mode_pct = mode_year_table(yearly_modes, mode_colors_pct.keys(), years_list_pct)
+
     fig_yearly_pct = go.Figure()
 
     for mode_name_pct in mode_colors_pct.keys():
-        mode_data_pct = yearly_modes[yearly_modes['mode_category'] == mode_name_pct]
-
-        percentages_pct = []
-        for yr in years_list_pct:
-            year_mode_pct = mode_data_pct[mode_data_pct['year'] == yr]
-            if not year_mode_pct.empty:
-                percentages_pct.append(year_mode_pct['percentage'].values[0])
-            else:
-                percentages_pct.append(0)
+        percentages_pct = percentages_by_mode_pct.loc[mode_name_pct].tolist()
 
         # Replace display name for Pressure Support/CPAP
         display_name_pct = 'Pressure Control' if mode_name_pct == 'Pressure Support/CPAP' else mode_name_pct